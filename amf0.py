@@ -0,0 +1,233 @@
+# FLV Extract
+# Copyright (C) 2006-2012 J.D. Purcell (moitah@yahoo.com)
+# Python port (C) 2012-2024 Gianluigi Tiesi <sherpya@gmail.com>
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+from datetime import datetime, timezone
+from enum import IntEnum
+from struct import pack, unpack
+from typing import Any, Dict, List, Tuple
+
+from interfaces import FLVException
+
+
+class AMF0Type(IntEnum):
+    NUMBER = 0
+    BOOLEAN = 1
+    STRING = 2
+    OBJECT = 3
+    MOVIECLIP = 4
+    NULL = 5
+    UNDEFINED = 6
+    REFERENCE = 7
+    ECMA_ARRAY = 8
+    OBJECT_END = 9
+    STRICT_ARRAY = 10
+    DATE = 11
+    LONG_STRING = 12
+    UNSUPPORTED = 13
+    RECORDSET = 14
+    XML_DOCUMENT = 15
+    TYPED_OBJECT = 16
+
+
+class AMF0Reader:
+    # Reference: Action Message Format - AMF 0 (Adobe)
+    _data: memoryview
+    _offset: int
+    _references: List[Any]
+
+    def __init__(self, data: bytes):
+        self._data = memoryview(data)
+        self._offset = 0
+        self._references = []
+
+    @property
+    def at_end(self) -> bool:
+        return self._offset >= len(self._data)
+
+    def read_bytes(self, size: int) -> memoryview:
+        if self._offset + size > len(self._data):
+            raise FLVException('Truncated AMF0 data')
+        data = self._data[self._offset:self._offset + size]
+        self._offset += size
+        return data
+
+    def read_uint8(self) -> int:
+        return self.read_bytes(1)[0]
+
+    def read_uint16(self) -> int:
+        return int.from_bytes(self.read_bytes(2), 'big')
+
+    def read_uint32(self) -> int:
+        return int.from_bytes(self.read_bytes(4), 'big')
+
+    def read_double(self) -> float:
+        return unpack('>d', self.read_bytes(8))[0]
+
+    def read_string(self) -> str:
+        return str(self.read_bytes(self.read_uint16()), 'utf-8', 'replace')
+
+    def read_long_string(self) -> str:
+        return str(self.read_bytes(self.read_uint32()), 'utf-8', 'replace')
+
+    def read_properties(self, properties: Dict[str, Any]) -> Dict[str, Any]:
+        while True:
+            name = self.read_string()
+            if not name and self._data[self._offset:self._offset + 1] == bytes([AMF0Type.OBJECT_END]):
+                self._offset += 1
+                return properties
+            properties[name] = self.read_value()
+
+    def read_value(self) -> Any:
+        marker = self.read_uint8()
+        match marker:
+            case AMF0Type.NUMBER:
+                return self.read_double()
+            case AMF0Type.BOOLEAN:
+                return self.read_uint8() != 0
+            case AMF0Type.STRING:
+                return self.read_string()
+            case AMF0Type.OBJECT:
+                obj: Dict[str, Any] = {}
+                self._references.append(obj)
+                return self.read_properties(obj)
+            case AMF0Type.NULL | AMF0Type.UNDEFINED | AMF0Type.UNSUPPORTED:
+                return None
+            case AMF0Type.REFERENCE:
+                index = self.read_uint16()
+                if index >= len(self._references):
+                    raise FLVException(f'Invalid AMF0 reference {index}')
+                return self._references[index]
+            case AMF0Type.ECMA_ARRAY:
+                self.read_uint32()  # approximate count, terminated like an object anyway
+                array: Dict[str, Any] = {}
+                self._references.append(array)
+                return self.read_properties(array)
+            case AMF0Type.STRICT_ARRAY:
+                values: List[Any] = []
+                self._references.append(values)
+                for _ in range(self.read_uint32()):
+                    values.append(self.read_value())
+                return values
+            case AMF0Type.DATE:
+                milliseconds = self.read_double()
+                self.read_bytes(2)  # timezone, reserved
+                try:
+                    return datetime.fromtimestamp(milliseconds / 1000, timezone.utc)
+                except (OverflowError, OSError, ValueError):
+                    raise FLVException(f'Invalid AMF0 date {milliseconds}')
+            case AMF0Type.LONG_STRING | AMF0Type.XML_DOCUMENT:
+                return self.read_long_string()
+            case AMF0Type.TYPED_OBJECT:
+                self.read_string()  # class name
+                typed: Dict[str, Any] = {}
+                self._references.append(typed)
+                return self.read_properties(typed)
+            case _:
+                raise FLVException(f'Unsupported AMF0 type {marker}')
+
+
+class AMF0Writer:
+    _data: bytearray
+
+    def __init__(self) -> None:
+        self._data = bytearray()
+
+    @property
+    def data(self) -> bytes:
+        return bytes(self._data)
+
+    def write_uint8(self, value: int) -> None:
+        self._data.append(value)
+
+    def write_uint16(self, value: int) -> None:
+        self._data += value.to_bytes(2, 'big')
+
+    def write_uint32(self, value: int) -> None:
+        self._data += value.to_bytes(4, 'big')
+
+    def write_double(self, value: float) -> None:
+        self._data += pack('>d', value)
+
+    def write_string(self, value: str) -> None:
+        data = value.encode('utf-8')
+        self.write_uint16(len(data))
+        self._data += data
+
+    def write_properties(self, properties: Dict[str, Any]) -> None:
+        for name, value in properties.items():
+            self.write_string(name)
+            self.write_value(value)
+        self.write_string('')
+        self.write_uint8(AMF0Type.OBJECT_END)
+
+    def write_ecma_array(self, properties: Dict[str, Any]) -> None:
+        self.write_uint8(AMF0Type.ECMA_ARRAY)
+        self.write_uint32(len(properties))
+        self.write_properties(properties)
+
+    def write_value(self, value: Any) -> None:
+        match value:
+            case None:
+                self.write_uint8(AMF0Type.NULL)
+            case bool():
+                self.write_uint8(AMF0Type.BOOLEAN)
+                self.write_uint8(int(value))
+            case int() | float():
+                self.write_uint8(AMF0Type.NUMBER)
+                self.write_double(value)
+            case str() if len(value.encode('utf-8')) > 0xffff:
+                data = value.encode('utf-8')
+                self.write_uint8(AMF0Type.LONG_STRING)
+                self.write_uint32(len(data))
+                self._data += data
+            case str():
+                self.write_uint8(AMF0Type.STRING)
+                self.write_string(value)
+            case datetime():
+                self.write_uint8(AMF0Type.DATE)
+                self.write_double(value.timestamp() * 1000)
+                self.write_uint16(0)  # timezone, reserved
+            case dict():
+                self.write_uint8(AMF0Type.OBJECT)
+                self.write_properties(value)
+            case list() | tuple():
+                self.write_uint8(AMF0Type.STRICT_ARRAY)
+                self.write_uint32(len(value))
+                for item in value:
+                    self.write_value(item)
+            case _:
+                raise FLVException(f'Unsupported AMF0 value {type(value).__name__}')
+
+
+def read_script_data(data: bytes) -> Tuple[str, Any]:
+    # script tags carry a method name followed by its argument, e.g. onMetaData + ECMA array
+    reader = AMF0Reader(data)
+    name = reader.read_value()
+    if not isinstance(name, str):
+        raise FLVException('Invalid script tag')
+    value = reader.read_value() if not reader.at_end else None
+    return name, value
+
+
+def write_script_data(name: str, properties: Dict[str, Any]) -> bytes:
+    # the method name and its properties as an ECMA array, e.g. onMetaData
+    writer = AMF0Writer()
+    writer.write_value(name)
+    writer.write_ecma_array(properties)
+    return writer.data
@@ -0,0 +1,195 @@
+# FLV Extract
+# Copyright (C) 2006-2012 J.D. Purcell (moitah@yahoo.com)
+# Python port (C) 2012-2024 Gianluigi Tiesi <sherpya@gmail.com>
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from dataclasses import dataclass, field, asdict
+from itertools import islice
+from operator import sub
+from typing import Any, Dict, List, Tuple
+
+try:
+    import numpy
+except ImportError:  # optional, only makes large files faster
+    numpy = None  # type: ignore[assignment]
+
+MAX_REPORTED_EVENTS = 100  # gaps and runs kept in a report, all of them are counted
+HISTOGRAM_BINS = 10  # most frequent deltas kept in a report
+JITTER_PERCENTILES = (50, 90, 99)
+DROP_THRESHOLD = 1.5  # shorter than a gap but longer than this many nominal deltas means dropped frames
+GAP_THRESHOLD = 1000  # ms, discontinuities at least this long are reported as gaps
+DRIFT_INTERVAL = 10000  # ms between A/V drift samples
+
+
+@dataclass
+class TrackTiming:
+    frames: int = 0
+    nominal_delta: int = 0
+    deltas: List[Tuple[int, int]] = field(default_factory=list)
+    jitter: Dict[str, int] = field(default_factory=dict)
+    dropped_frames: int = 0
+    gap_count: int = 0
+    gaps: List[Tuple[int, int]] = field(default_factory=list)
+    non_monotonic_count: int = 0
+    non_monotonic: List[Tuple[int, int]] = field(default_factory=list)
+
+
+@dataclass
+class TimingReport:
+    video: TrackTiming
+    audio: TrackTiming
+    max_drift: int = 0
+    drift: List[Tuple[int, int]] = field(default_factory=list)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'TimingReport':
+        return cls(video=TrackTiming(**data['video']), audio=TrackTiming(**data['audio']),
+                   max_drift=data['max_drift'], drift=data['drift'])
+
+
+def timestamp_deltas(timestamps: array) -> Any:
+    if numpy is not None:
+        return numpy.diff(numpy.frombuffer(timestamps, numpy.int64))
+    return list(map(sub, islice(timestamps, 1, None), timestamps))
+
+
+def histogram(deltas: Any) -> Dict[int, int]:
+    if numpy is not None:
+        values, counts = numpy.unique(deltas, return_counts=True)
+        return dict(zip(values.tolist(), counts.tolist()))
+    return dict(Counter(deltas))
+
+
+def delta_histogram(timestamps: array) -> Dict[int, int]:
+    return histogram(timestamp_deltas(timestamps)) if len(timestamps) > 1 else {}
+
+
+def runs(indexes: List[int]) -> List[Tuple[int, int]]:
+    # consecutive indexes as (first index, length)
+    result: List[Tuple[int, int]] = []
+    for index in indexes:
+        if result and result[-1][0] + result[-1][1] == index:
+            result[-1] = (result[-1][0], result[-1][1] + 1)
+        else:
+            result.append((index, 1))
+    return result
+
+
+def analyze_track(timestamps: array) -> TrackTiming:
+    timing = TrackTiming(frames=len(timestamps))
+    if len(timestamps) < 2:
+        return timing
+    deltas = timestamp_deltas(timestamps)
+    counts = histogram(deltas)
+    positive = {delta: count for delta, count in counts.items() if delta > 0}
+    if not positive:
+        return timing
+
+    timing.nominal_delta = max(positive, key=lambda delta: (positive[delta], -delta))
+    timing.deltas = sorted(counts.items(), key=lambda item: -item[1])[:HISTOGRAM_BINS]
+
+    # jitter percentiles straight from the histogram, deltas are whole milliseconds
+    deviations: Counter = Counter()
+    for delta, count in counts.items():
+        deviations[abs(delta - timing.nominal_delta)] += count
+    total = sum(deviations.values())
+    cumulative = 0
+    percentiles = list(JITTER_PERCENTILES)
+    for deviation in sorted(deviations):
+        cumulative += deviations[deviation]
+        while percentiles and cumulative * 100 >= percentiles[0] * total:
+            timing.jitter[f'p{percentiles.pop(0)}'] = deviation
+    timing.jitter['max'] = max(deviations)
+
+    drop_limit = timing.nominal_delta * DROP_THRESHOLD
+    timing.dropped_frames = sum((round(delta / timing.nominal_delta) - 1) * count
+                                for delta, count in counts.items() if drop_limit < delta < GAP_THRESHOLD)
+
+    # the histogram tells whether there is anything to look for at all
+    backwards: List[int] = []
+    if numpy is not None:
+        if max(counts) >= GAP_THRESHOLD:
+            gaps = numpy.flatnonzero(deltas >= GAP_THRESHOLD)
+            timing.gap_count = len(gaps)
+            timing.gaps = list(zip(numpy.frombuffer(timestamps, numpy.int64)[gaps[:MAX_REPORTED_EVENTS]].tolist(),
+                                   deltas[gaps[:MAX_REPORTED_EVENTS]].tolist()))
+        if min(counts) < 0:
+            backwards = numpy.flatnonzero(deltas < 0).tolist()
+    else:
+        if max(counts) >= GAP_THRESHOLD:
+            gaps = [i for i, delta in enumerate(deltas) if delta >= GAP_THRESHOLD]
+            timing.gap_count = len(gaps)
+            timing.gaps = [(timestamps[i], deltas[i]) for i in gaps[:MAX_REPORTED_EVENTS]]
+        if min(counts) < 0:
+            backwards = [i for i, delta in enumerate(deltas) if delta < 0]
+
+    backward_runs = runs(backwards)
+    timing.non_monotonic_count = len(backward_runs)
+    timing.non_monotonic = [(timestamps[i], length) for i, length in backward_runs[:MAX_REPORTED_EVENTS]]
+    return timing
+
+
+def analyze_drift(video_timestamps: array, audio_timestamps: array, audio_positions: array) -> List[Tuple[int, int]]:
+    # audio_positions holds how many audio tags preceded each video tag, the drift is how far apart
+    # the timestamps of neighbouring audio and video tags are in the file
+    drift: List[Tuple[int, int]] = []
+    if not video_timestamps or not audio_timestamps:
+        return drift
+
+    # timestamps can go backwards, the samples are looked up in a sorted copy and mapped back to the tags
+    samples = range(min(video_timestamps), max(video_timestamps) + 1, DRIFT_INTERVAL)
+    if numpy is not None:
+        video = numpy.frombuffer(video_timestamps, numpy.int64)
+        order = numpy.argsort(video, kind='stable')
+        indexes = order[numpy.searchsorted(video[order], list(samples))].tolist()
+    else:
+        order = sorted(range(len(video_timestamps)), key=video_timestamps.__getitem__)
+        times = [video_timestamps[i] for i in order]
+        indexes = [order[bisect_left(times, time)] for time in samples]
+
+    for index in indexes:
+        if audio_positions[index] == 0:
+            continue
+        video_time = video_timestamps[index]
+        drift.append((video_time, video_time - audio_timestamps[audio_positions[index] - 1]))
+    return drift
+
+
+def max_drift(video_timestamps: array, audio_timestamps: array, audio_positions: array) -> int:
+    if not video_timestamps or not audio_timestamps:
+        return 0
+    if numpy is not None:
+        positions = numpy.frombuffer(audio_positions, numpy.int64)
+        mask = positions > 0
+        video = numpy.frombuffer(video_timestamps, numpy.int64)[mask]
+        audio = numpy.frombuffer(audio_timestamps, numpy.int64)[positions[mask] - 1]
+        return int(numpy.abs(video - audio).max()) if len(video) else 0
+    return max((abs(time - audio_timestamps[position - 1])
+                for time, position in zip(video_timestamps, audio_positions) if position), default=0)
+
+
+def analyze_timestamps(video_timestamps: array, audio_timestamps: array, audio_positions: array) -> TimingReport:
+    report = TimingReport(video=analyze_track(video_timestamps), audio=analyze_track(audio_timestamps))
+    report.drift = analyze_drift(video_timestamps, audio_timestamps, audio_positions)
+    report.max_drift = max_drift(video_timestamps, audio_timestamps, audio_positions)
+    return report
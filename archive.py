@@ -0,0 +1,312 @@
+# FLV Extract
+# Copyright (C) 2006-2012 J.D. Purcell (moitah@yahoo.com)
+# Python port (C) 2012-2024 Gianluigi Tiesi <sherpya@gmail.com>
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import os
+import shutil
+import time
+from abc import ABC, abstractmethod
+from io import RawIOBase
+from pathlib import Path
+from tarfile import TarInfo, BLOCKSIZE, RECORDSIZE, GNU_FORMAT
+from tempfile import SpooledTemporaryFile
+from typing import IO, TYPE_CHECKING, BinaryIO, Iterable, List, Set
+from zipfile import ZipFile, ZipInfo
+
+from interfaces import FLVException
+
+if TYPE_CHECKING:
+    from typing_extensions import Buffer
+
+SPILL_BUFFER_SIZE = 8 * 1024 * 1024  # per output, larger outputs spill to a temporary file
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+class StreamMember(RawIOBase):
+    # written in place, only one member at a time can be
+    _archive: 'OutputArchive'
+    _fd: IO[bytes]
+    name: str
+    mtime: float
+    size: int = 0
+    discarded: bool = False
+
+    def __init__(self, archive: 'OutputArchive', name: str, fd: IO[bytes]):
+        super().__init__()
+        self._archive = archive
+        self._fd = fd
+        self.name = name
+        self.mtime = time.time()
+
+    def write(self, data: 'Buffer') -> int:
+        count = self._fd.write(data)
+        self.size += count
+        return count
+
+    def writelines(self, lines: Iterable['Buffer']) -> None:
+        for data in lines:
+            self.write(data)
+
+    def writable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.size
+
+    def close(self) -> None:
+        if not self.closed:
+            super().close()
+            self._archive.member_closed(self)
+
+
+class SpillMember(RawIOBase):
+    # staged in memory up to the spill size, then in a temporary file, and copied in the archive once closed
+    _archive: 'OutputArchive'
+    buffer: SpooledTemporaryFile[bytes]
+    name: str
+    mtime: float
+    discarded: bool = False
+
+    def __init__(self, archive: 'OutputArchive', name: str, spill_size: int):
+        super().__init__()
+        self._archive = archive
+        self.buffer = SpooledTemporaryFile(max_size=spill_size)
+        self.name = name
+        self.mtime = time.time()
+
+    def write(self, data: 'Buffer') -> int:
+        return self.buffer.write(data)
+
+    def writelines(self, lines: Iterable['Buffer']) -> None:
+        self.buffer.writelines(lines)
+
+    def writable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        return self.buffer.read(size)
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        return self.buffer.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self.buffer.tell()
+
+    def close(self) -> None:
+        if not self.closed:
+            super().close()
+            self._archive.member_closed(self)
+
+    @property
+    def size(self) -> int:
+        return self.buffer.seek(0, os.SEEK_END)
+
+
+class OutputArchive(ABC):
+    path: Path
+    names: Set[str]
+    _spill_size: int
+    _stream: StreamMember | None = None
+    # closed while another member was written in place
+    _pending: List[SpillMember]
+    _open: List[StreamMember | SpillMember]
+
+    def __init__(self, path: Path, spill_size: int = SPILL_BUFFER_SIZE):
+        self.path = path
+        self.names = set()
+        self._spill_size = spill_size
+        self._pending = []
+        self._open = []
+
+    def open_member(self, path: Path, seekable: bool) -> StreamMember | SpillMember:
+        name = path.name
+        self.names.add(name)
+        member: StreamMember | SpillMember
+        if not seekable and self._stream is None:
+            member = self._stream = StreamMember(self, name, self.begin_stream(name, time.time()))
+        else:
+            member = SpillMember(self, name, self._spill_size)
+        self._open.append(member)
+        return member
+
+    def discard(self, paths: List[Path]) -> None:
+        # outputs of a failed extraction are left out of the archive
+        names = {path.name for path in paths}
+        for member in self._open:
+            if member.name in names:
+                member.discarded = True
+
+    def member_closed(self, member: StreamMember | SpillMember) -> None:
+        self._open.remove(member)
+        if member is self._stream:
+            self._stream = None
+            if member.discarded:
+                self.abort_stream()
+            else:
+                self.end_stream(member.size)
+            for pending in self._pending:
+                self.add_spilled(pending)
+            self._pending = []
+        elif isinstance(member, SpillMember):
+            if member.discarded:
+                member.buffer.close()
+            elif self._stream is not None:
+                self._pending.append(member)
+            else:
+                self.add_spilled(member)
+
+    def add_spilled(self, member: SpillMember) -> None:
+        size = member.size
+        member.buffer.seek(0)
+        self.add_member(member.name, member.mtime, member.buffer, size)
+        member.buffer.close()
+
+    def close(self) -> None:
+        for member in list(self._open):
+            member.discarded = True
+            member.close()
+        self.finish()
+
+    @abstractmethod
+    def begin_stream(self, name: str, mtime: float) -> IO[bytes]: ...
+
+    @abstractmethod
+    def end_stream(self, size: int) -> None: ...
+
+    @abstractmethod
+    def abort_stream(self) -> None: ...
+
+    @abstractmethod
+    def add_member(self, name: str, mtime: float, fd: IO[bytes], size: int) -> None: ...
+
+    @abstractmethod
+    def finish(self) -> None: ...
+
+
+def tar_header(name: str, mtime: float, size: int) -> bytes:
+    info = TarInfo(name)
+    info.size = size
+    info.mtime = int(mtime)
+    info.mode = 0o644
+    # GNU headers have a fixed size whatever the member size, the header of a streamed member is patched in place
+    return info.tobuf(GNU_FORMAT, 'utf-8', 'surrogateescape')
+
+
+class TarOutputArchive(OutputArchive):
+    _fd: BinaryIO
+    _stream_offset: int = 0
+    _stream_name: str = ''
+    _stream_mtime: float = 0
+
+    def __init__(self, path: Path, spill_size: int = SPILL_BUFFER_SIZE):
+        super().__init__(path, spill_size)
+        self._fd = path.open('wb')
+
+    def pad(self, size: int, alignment: int = BLOCKSIZE) -> None:
+        if size % alignment:
+            self._fd.write(bytes(alignment - size % alignment))
+
+    def begin_stream(self, name: str, mtime: float) -> IO[bytes]:
+        self._stream_offset = self._fd.tell()
+        self._stream_name = name
+        self._stream_mtime = mtime
+        self._fd.write(tar_header(name, mtime, 0))
+        return self._fd
+
+    def end_stream(self, size: int) -> None:
+        self.pad(size)
+        end = self._fd.tell()
+        self._fd.seek(self._stream_offset)
+        self._fd.write(tar_header(self._stream_name, self._stream_mtime, size))
+        self._fd.seek(end)
+
+    def abort_stream(self) -> None:
+        self._fd.seek(self._stream_offset)
+        self._fd.truncate()
+
+    def add_member(self, name: str, mtime: float, fd: IO[bytes], size: int) -> None:
+        self._fd.write(tar_header(name, mtime, size))
+        shutil.copyfileobj(fd, self._fd, COPY_BUFFER_SIZE)
+        self.pad(size)
+
+    def finish(self) -> None:
+        # end of archive marker, padded to a whole record like tarfile does
+        self._fd.write(bytes(BLOCKSIZE * 2))
+        self.pad(self._fd.tell(), RECORDSIZE)
+        self._fd.close()
+
+
+class ZipOutputArchive(OutputArchive):
+    _fd: BinaryIO
+    _zip: ZipFile
+    _stream_fd: IO[bytes] | None = None
+
+    def __init__(self, path: Path, spill_size: int = SPILL_BUFFER_SIZE):
+        super().__init__(path, spill_size)
+        self._fd = path.open('w+b')
+        self._zip = ZipFile(self._fd, 'w')
+
+    @staticmethod
+    def member_info(name: str, mtime: float) -> ZipInfo:
+        return ZipInfo(name, time.localtime(mtime)[:6])
+
+    def begin_stream(self, name: str, mtime: float) -> IO[bytes]:
+        # the size is unknown, zip64 extra fields are needed in case it ends up over 4 GB
+        stream = self._zip.open(self.member_info(name, mtime), 'w', force_zip64=True)
+        self._stream_fd = stream
+        return stream
+
+    def end_stream(self, size: int) -> None:
+        assert self._stream_fd is not None
+        self._stream_fd.close()
+        self._stream_fd = None
+
+    def abort_stream(self) -> None:
+        self.end_stream(0)
+        # zipfile can't remove a member, rewind the archive to its local header
+        info = self._zip.filelist.pop()
+        del self._zip.NameToInfo[info.filename]
+        self._fd.seek(info.header_offset)
+        self._fd.truncate()
+        self._zip.start_dir = info.header_offset
+
+    def add_member(self, name: str, mtime: float, fd: IO[bytes], size: int) -> None:
+        info = self.member_info(name, mtime)
+        info.file_size = size
+        with self._zip.open(info, 'w') as dst:
+            shutil.copyfileobj(fd, dst, COPY_BUFFER_SIZE)
+
+    def finish(self) -> None:
+        self._zip.close()
+        self._fd.close()
+
+
+def open_archive(path: Path, spill_size: int = SPILL_BUFFER_SIZE) -> OutputArchive:
+    match path.suffix.lower():
+        case '.tar':
+            return TarOutputArchive(path, spill_size)
+        case '.zip':
+            return ZipOutputArchive(path, spill_size)
+        case _:
+            raise FLVException(f'Unsupported archive format {path.suffix} (use .tar or .zip)')
@@ -1,6 +1,8 @@
 from .aacwriter import AACWriter
+from .adpcmwriter import ADPCMWriter
+from .g711writer import G711Writer
 from .mp3writer import MP3Writer
 from .speexwriter import SpeexWriter
 from .wavwriter import WAVWriter
 
-__all__ = ['AACWriter', 'MP3Writer', 'SpeexWriter', 'WAVWriter']
+__all__ = ['AACWriter', 'ADPCMWriter', 'G711Writer', 'MP3Writer', 'SpeexWriter', 'WAVWriter']
@@ -21,19 +21,28 @@ from abc import ABC
 from ctypes import c_ulonglong
 from pathlib import Path
 from struct import unpack
+from typing import Any, BinaryIO, Dict
 
-from general import BitHelper
+from general import BitHelper, OutputOpener, open_output, sync_output, reopen_output, copy_range
 from interfaces import IAudioWriter, FLVException
 
 
 class AACWriter(IAudioWriter, ABC):
+    _fd: BinaryIO
     _aac_profile: int
     _samplerate_index: int
     _channel_config: int
 
-    def __init__(self, path: Path):
+    def __init__(self, path: Path, state: Dict[str, Any] | None = None, opener: OutputOpener = open_output):
         self._path = path
-        self._fd = self._path.open('wb')
+        if state is None:
+            self._fd = opener(self._path, False)
+        else:
+            self._fd = reopen_output(self._path, state['size'])
+            if state['aac_profile'] is not None:
+                self._aac_profile = state['aac_profile']
+                self._samplerate_index = state['samplerate_index']
+                self._channel_config = state['channel_config']
 
     def write_chunk(self, chunk: bytes, timestamp: int) -> None:
         length = len(chunk)
@@ -86,3 +95,14 @@ class AACWriter(IAudioWriter, ABC):
 
     def finish(self) -> None:
         self._fd.close()
+
+    def append_part(self, path: Path, state: Dict[str, Any]) -> None:
+        copy_range(path, self._fd, state['prefix'], state['size'])
+
+    def get_state(self) -> Dict[str, Any]:
+        return {
+            'size': sync_output(self._fd),
+            'aac_profile': getattr(self, '_aac_profile', None),
+            'samplerate_index': getattr(self, '_samplerate_index', None),
+            'channel_config': getattr(self, '_channel_config', None),
+        }
@@ -0,0 +1,177 @@
+# FLV Extract
+# Copyright (C) 2006-2012 J.D. Purcell (moitah@yahoo.com)
+# Python port (C) 2012-2024 Gianluigi Tiesi <sherpya@gmail.com>
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import sys
+from array import array
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+from general import OutputOpener, open_output
+from .wavwriter import WAVWriter
+
+# Reference: adpcm_swf_decode from libavcodec's adpcm.c
+
+STEP_TABLE = [
+    7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45, 50, 55, 60, 66, 73, 80, 88, 97, 107,
+    118, 130, 143, 157, 173, 190, 209, 230, 253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658, 724, 796, 876,
+    963, 1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066, 2272, 2499, 2749, 3024, 3327, 3660, 4026, 4428, 4871, 5358,
+    5894, 6484, 7132, 7845, 8630, 9493, 10442, 11487, 12635, 13899, 15289, 16818, 18500, 20350, 22385, 24623, 27086,
+    29794, 32767,
+]
+
+INDEX_TABLES = {
+    2: [-1, 2],
+    3: [-1, -1, 2, 4],
+    4: [-1, -1, -1, -1, 2, 4, 6, 8],
+    5: [-1, -1, -1, -1, -1, -1, -1, -1, 1, 2, 4, 6, 8, 10, 13, 16],
+}
+
+BLOCK_SAMPLES = 4095  # samples per channel following each block header
+
+
+def make_tables(code_size: int) -> Tuple[List[int], List[int]]:
+    # everything the decoder needs for a (step index, code) pair, indexed by step_index << code_size | code
+    sign_mask = 1 << (code_size - 1)
+    index_table = INDEX_TABLES[code_size]
+    differences: List[int] = []
+    next_indexes: List[int] = []
+    for step_index in range(len(STEP_TABLE)):
+        for code in range(1 << code_size):
+            step = STEP_TABLE[step_index]
+            difference = 0
+            k = sign_mask >> 1
+            while k:
+                if code & k:
+                    difference += step
+                step >>= 1
+                k >>= 1
+            difference += step
+            differences.append(-difference if code & sign_mask else difference)
+            next_index = min(max(step_index + index_table[code & (sign_mask - 1)], 0), len(STEP_TABLE) - 1)
+            next_indexes.append(next_index << code_size)
+    return differences, next_indexes
+
+
+_tables = {code_size: make_tables(code_size) for code_size in INDEX_TABLES}
+
+
+class ADPCMWriter(WAVWriter):
+    _channels: int
+
+    def __init__(self, path: Path, channel_count: int, samplerate: int, state: Dict[str, Any] | None = None,
+                 opener: OutputOpener = open_output):
+        super().__init__(path, 16, channel_count, samplerate, state, opener=opener)
+        self._channels = channel_count
+
+    def write_chunk(self, chunk: bytes, timestamp: int) -> None:
+        samples = self.decode(chunk)
+        if sys.byteorder == 'big':
+            samples.byteswap()
+        super().write_chunk(samples.tobytes(), timestamp)
+
+    @staticmethod
+    def sample_count(size: int, code_size: int, channels: int) -> int:
+        count = 0
+        size -= 2
+        while size >= 22 * channels:
+            size -= 22 * channels
+            codes = min(size // (code_size * channels), BLOCK_SAMPLES)
+            size -= codes * code_size * channels
+            count += (codes + 1) * channels
+        return count
+
+    def decode(self, chunk: bytes) -> array:
+        if not chunk:
+            return array('h')
+
+        channels = self._channels
+        code_size = (chunk[0] >> 6) + 2
+        differences, next_indexes = _tables[code_size]
+        code_mask = (1 << code_size) - 1
+        size = len(chunk) * 8
+
+        # the output is allocated once, the loops below only index into it and keep the bit buffer small
+        samples = array('h', bytes(self.sample_count(size, code_size, channels) * 2))
+        predictors = [0] * channels
+        indexes = [0] * channels
+
+        accumulator = chunk[0] & 0x3f
+        bits = 6
+        position = 1
+        written = 0
+        remaining = size - 2
+
+        while remaining >= 22 * channels:
+            remaining -= 22 * channels
+            for channel in range(channels):
+                accumulator &= (1 << bits) - 1
+                while bits < 22:
+                    accumulator = (accumulator << 8) | chunk[position]
+                    position += 1
+                    bits += 8
+                bits -= 22
+                header = accumulator >> bits
+                predictor = header >> 6
+                if predictor & 0x8000:
+                    predictor -= 0x10000
+                predictors[channel] = predictor
+                indexes[channel] = (header & 0x3f) << code_size
+                samples[written] = predictor
+                written += 1
+
+            codes = min(remaining // (code_size * channels), BLOCK_SAMPLES)
+            remaining -= codes * code_size * channels
+            if channels == 1:
+                predictor = predictors[0]
+                index = indexes[0]
+                for _ in range(codes):
+                    if bits < code_size:
+                        accumulator = ((accumulator << 8) | chunk[position]) & 0xffff
+                        position += 1
+                        bits += 8
+                    bits -= code_size
+                    entry = index | ((accumulator >> bits) & code_mask)
+                    predictor += differences[entry]
+                    if predictor > 32767:
+                        predictor = 32767
+                    elif predictor < -32768:
+                        predictor = -32768
+                    index = next_indexes[entry]
+                    samples[written] = predictor
+                    written += 1
+            else:
+                for _ in range(codes):
+                    for channel in range(channels):
+                        if bits < code_size:
+                            accumulator = ((accumulator << 8) | chunk[position]) & 0xffff
+                            position += 1
+                            bits += 8
+                        bits -= code_size
+                        entry = indexes[channel] | ((accumulator >> bits) & code_mask)
+                        predictor = predictors[channel] + differences[entry]
+                        if predictor > 32767:
+                            predictor = 32767
+                        elif predictor < -32768:
+                            predictor = -32768
+                        indexes[channel] = next_indexes[entry]
+                        predictors[channel] = predictor
+                        samples[written] = predictor
+                        written += 1
+
+        return samples
@@ -0,0 +1,73 @@
+# FLV Extract
+# Copyright (C) 2006-2012 J.D. Purcell (moitah@yahoo.com)
+# Python port (C) 2012-2024 Gianluigi Tiesi <sherpya@gmail.com>
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+from pathlib import Path
+from typing import Any, Dict, List
+
+from general import OutputOpener, open_output
+from .wavwriter import WAVWriter
+
+# Reference: ITU-T G.711, g711.c from the Sun reference implementation
+
+G711_SAMPLERATE = 8000  # flv ignores the sound rate flags for G.711
+
+
+def ulaw_to_linear(value: int) -> int:
+    value = ~value & 0xff
+    sample = (((value & 0x0f) << 3) + 0x84) << ((value & 0x70) >> 4)
+    return (0x84 - sample) if (value & 0x80) else (sample - 0x84)
+
+
+def alaw_to_linear(value: int) -> int:
+    value ^= 0x55
+    sample = (value & 0x0f) << 4
+    segment = (value & 0x70) >> 4
+    if segment == 0:
+        sample += 8
+    elif segment == 1:
+        sample += 0x108
+    else:
+        sample = (sample + 0x108) << (segment - 1)
+    return sample if (value & 0x80) else -sample
+
+
+def make_tables(decode: Any) -> List[bytes]:
+    # one translation table per output byte, 16 bit little endian
+    samples = [decode(value) & 0xffff for value in range(256)]
+    return [bytes(sample & 0xff for sample in samples), bytes(sample >> 8 for sample in samples)]
+
+
+_ulaw_tables = make_tables(ulaw_to_linear)
+_alaw_tables = make_tables(alaw_to_linear)
+
+
+class G711Writer(WAVWriter):
+    _tables: List[bytes]
+
+    def __init__(self, path: Path, is_alaw: bool, channel_count: int, state: Dict[str, Any] | None = None,
+                 opener: OutputOpener = open_output):
+        super().__init__(path, 16, channel_count, G711_SAMPLERATE, state, opener=opener)
+        self._tables = _alaw_tables if is_alaw else _ulaw_tables
+
+    def write_chunk(self, chunk: bytes, timestamp: int) -> None:
+        low, high = self._tables
+        samples = bytearray(len(chunk) * 2)
+        samples[0::2] = chunk.translate(low)
+        samples[1::2] = chunk.translate(high)
+        super().write_chunk(samples, timestamp)
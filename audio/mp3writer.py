@@ -21,9 +21,10 @@ from abc import ABC
 from ctypes import c_ulonglong
 from enum import IntEnum
 from pathlib import Path
-from typing import List, BinaryIO
+from typing import Any, Dict, List, BinaryIO
 
-from general import BitHelper
+from diagnostics import Diagnostics
+from general import BitHelper, OutputOpener, open_output, sync_output, reopen_output, copy_range
 from interfaces import IAudioWriter
 
 # http://www.mp3-tech.org/programmer/frame_header.html
@@ -68,7 +69,7 @@ class ChannelMode(IntEnum):
 class MP3Writer(IAudioWriter, ABC):
     _path: Path
     _fd: BinaryIO
-    _warnings: List[str]
+    _warnings: Diagnostics
     _chunk_buffer: List[bytes]
     _frame_offsets: List[int]
     _total_frame_length: int = 0
@@ -82,14 +83,31 @@ class MP3Writer(IAudioWriter, ABC):
     _channel_mode: int = 0
     _first_frame_header: int = 0
 
-    def __init__(self, path: Path, warnings: List[str]):
+    def __init__(self, path: Path, warnings: Diagnostics, state: Dict[str, Any] | None = None,
+                 opener: OutputOpener = open_output):
         self._path = path
-        self._fd = self._path.open('wb')
         self._warnings = warnings
         self._delay_write = True
         self._chunk_buffer = []
         self._frame_offsets = []
 
+        if state is None:
+            self._fd = opener(self._path, True)
+        else:
+            self._fd = reopen_output(self._path, state['size'])
+            self._chunk_buffer = [bytes.fromhex(chunk) for chunk in state['chunk_buffer']]
+            self._frame_offsets = state['frame_offsets']
+            self._total_frame_length = state['total_frame_length']
+            self._is_vbr = state['is_vbr']
+            self._delay_write = state['delay_write']
+            self._has_vbr_header = state['has_vbr_header']
+            self._write_vbr_header = state['write_vbr_header']
+            self._first_bit_rate = state['first_bit_rate']
+            self._mpeg_version = state['mpeg_version']
+            self._sample_rate = state['sample_rate']
+            self._channel_mode = state['channel_mode']
+            self._first_frame_header = state['first_frame_header']
+
     def write_chunk(self, chunk: bytes, timestamp: int) -> None:
         self._chunk_buffer.append(chunk)
         self.parse_mp3_frames(chunk)
@@ -106,6 +124,57 @@ class MP3Writer(IAudioWriter, ABC):
             self.write_vbr_header(False)
         self._fd.close()
 
+    def append_part(self, path: Path, state: Dict[str, Any]) -> None:
+        start = 0
+        if self._first_bit_rate == 0:
+            # the first part decides the stream parameters and the VBR header, as it would reading sequentially
+            self._is_vbr = state['is_vbr']
+            self._delay_write = state['delay_write']
+            self._has_vbr_header = state['has_vbr_header']
+            self._write_vbr_header = state['write_vbr_header']
+            self._first_bit_rate = state['first_bit_rate']
+            self._mpeg_version = state['mpeg_version']
+            self._sample_rate = state['sample_rate']
+            self._channel_mode = state['channel_mode']
+            self._first_frame_header = state['first_frame_header']
+        else:
+            if state['write_vbr_header']:
+                # skip the placeholder the worker wrote
+                start = self.get_frame_length(state['mpeg_version'], 64000, state['sample_rate'], 0)
+            if not self._is_vbr and (state['is_vbr'] or state['first_bit_rate'] not in (0, self._first_bit_rate)):
+                self.detect_vbr()
+            if state['size'] > start:
+                # the worker wrote its frames, it read more than the 64k a VBR header can be decided in
+                self._delay_write = False
+
+        if state['size'] > start:
+            self.flush()
+            copy_range(path, self._fd, start, state['size'])
+        self._frame_offsets.extend(offset + self._total_frame_length for offset in state['frame_offsets'])
+        self._total_frame_length += state['total_frame_length']
+        self._chunk_buffer.extend(bytes.fromhex(chunk) for chunk in state['chunk_buffer'])
+        if self._delay_write and (self._total_frame_length >= 65536):
+            self._delay_write = False
+        if not self._delay_write:
+            self.flush()
+
+    def get_state(self) -> Dict[str, Any]:
+        return {
+            'size': sync_output(self._fd),
+            'chunk_buffer': [chunk.hex() for chunk in self._chunk_buffer],  # at most 64k, before VBR detection
+            'frame_offsets': self._frame_offsets,
+            'total_frame_length': self._total_frame_length,
+            'is_vbr': self._is_vbr,
+            'delay_write': self._delay_write,
+            'has_vbr_header': self._has_vbr_header,
+            'write_vbr_header': self._write_vbr_header,
+            'first_bit_rate': self._first_bit_rate,
+            'mpeg_version': self._mpeg_version,
+            'sample_rate': self._sample_rate,
+            'channel_mode': self._channel_mode,
+            'first_frame_header': self._first_frame_header,
+        }
+
     def flush(self) -> None:
         for chunk in self._chunk_buffer:
             self._fd.write(chunk)
@@ -118,7 +187,7 @@ class MP3Writer(IAudioWriter, ABC):
         while length >= 4:
             header = c_ulonglong(int.from_bytes(buff[offset:offset + 4], 'big') << 32)
             if BitHelper.read(header, 11) != 0x7ff:
-                self._warnings.append('Invalid frame sync')
+                self._warnings.warn('mp3_frame_sync', 'Invalid frame sync')
                 break
 
             mpeg_version = BitHelper.read(header, 2)
@@ -133,7 +202,7 @@ class MP3Writer(IAudioWriter, ABC):
                     or layer != 1
                     or bitrate in (Bitrate.FREE, Bitrate.BAD)
                     or samplerate == Samplerate.RESERVED):
-                self._warnings.append(f'Malformed frame')
+                self._warnings.warn('mp3_malformed_frame', 'Malformed frame')
                 break
 
             bitrate = (MPEG1BitRate[bitrate] if (mpeg_version == MPEGVersion.MPEG1) else MPEG2XBitRate[bitrate]) * 1000
@@ -166,15 +235,7 @@ class MP3Writer(IAudioWriter, ABC):
                 self._channel_mode = channel_mode
                 self._first_frame_header = int.from_bytes(buff[offset:offset + 4], 'big')
             elif not self._is_vbr and (bitrate != self._first_bit_rate):
-                self._is_vbr = True
-                if self._has_vbr_header:
-                    pass
-                elif self._delay_write:
-                    self.write_vbr_header(True)
-                    self._write_vbr_header = True
-                    self._delay_write = False
-                else:
-                    self._warnings.append('Detected VBR too late, cannot add VBR header')
+                self.detect_vbr()
 
             self._frame_offsets.append(self._total_frame_length + offset)
 
@@ -182,6 +243,17 @@ class MP3Writer(IAudioWriter, ABC):
             length -= frame_len
         self._total_frame_length += len(buff)
 
+    def detect_vbr(self) -> None:
+        self._is_vbr = True
+        if self._has_vbr_header:
+            pass
+        elif self._delay_write:
+            self.write_vbr_header(True)
+            self._write_vbr_header = True
+            self._delay_write = False
+        else:
+            self._warnings.warn('mp3_late_vbr', 'Detected VBR too late, cannot add VBR header', once=True)
+
     def write_vbr_header(self, is_placeholder: bool) -> None:
         buff = bytearray(self.get_frame_length(self._mpeg_version, 64000, self._sample_rate, 0))
         if not is_placeholder:
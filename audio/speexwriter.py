@@ -22,9 +22,9 @@ from abc import ABC
 from ctypes import c_int
 from dataclasses import dataclass
 from pathlib import Path
-from typing import List, BinaryIO
+from typing import Any, Dict, List, BinaryIO
 
-from general import BitHelper, OggCRC
+from general import BitHelper, OggCRC, OutputOpener, open_output, sync_output, reopen_output, COPY_CHUNK_SIZE
 from interfaces import IAudioWriter, FLVException
 
 
@@ -39,6 +39,7 @@ SAMPLERATE = 16000
 MS_PER_FRAME = 20
 SAMPLES_PER_FRAME = SAMPLERATE // (1000 // MS_PER_FRAME)
 TARGET_PAGE_DATA_SIZE = 4096
+HEADER_SIZE = (28 + 80) + (28 + 8 + len(VENDOR_STRING))  # Speex header + Vorbis comment
 
 SUB_MODE_SIZES = [0, 43, 119, 160, 220, 300, 364, 492, 79]
 WIDE_BAND_SIZES = [0, 36, 112, 192, 352]
@@ -60,11 +61,10 @@ class SpeexWriter(IAudioWriter, ABC):
     _page_sequence_number: int
     _granule_position: int
 
-    def __init__(self, path: Path, serial_number: int):
+    def __init__(self, path: Path, serial_number: int, state: Dict[str, Any] | None = None,
+                 opener: OutputOpener = open_output):
         self._path = path
         self._serial_number = serial_number
-        self._fd = self._path.open('wb')
-        self._fd.seek((28 + 80) + (28 + 8 + len(VENDOR_STRING)))  # Speex header + Vorbis comment
         self._packet_list = []
         self._packet_list_data_size = 0
         # Header + max segment table + target data size + extra segment
@@ -73,6 +73,21 @@ class SpeexWriter(IAudioWriter, ABC):
         self._page_sequence_number = 2  # First audio packet
         self._granule_position = 0
 
+        if state is None:
+            self._fd = opener(self._path, True)
+            self._fd.seek(HEADER_SIZE)
+        else:
+            self._fd = reopen_output(self._path, state['size'])
+            self._serial_number = state['serial_number']
+            for data, granule_position in state['packets']:
+                self._packet_list.append(OggPacket(data=bytes.fromhex(data), granule_position=granule_position))
+            self._packet_list_data_size = sum(len(packet.data) for packet in self._packet_list)
+            page = bytes.fromhex(state['page'])
+            self._page_buff[:len(page)] = page
+            self._page_buff_offset = len(page)
+            self._page_sequence_number = state['page_sequence_number']
+            self._granule_position = state['granule_position']
+
     def write_chunk(self, chunk: bytes, timestamp: int) -> None:
         frame_start = -1
         frame_end = 0
@@ -132,6 +147,62 @@ class SpeexWriter(IAudioWriter, ABC):
         self.flush_page(False)
         self._fd.close()
 
+    def append_part(self, path: Path, state: Dict[str, Any]) -> None:
+        # close the current page, the pages of the part are renumbered and their positions shifted after it
+        self.write_page()
+        self.flush_page(False)
+        sequence_offset = self._page_sequence_number - 2
+        granule_offset = self._granule_position
+
+        def renumber(page: bytearray) -> None:
+            granule_position = int.from_bytes(page[6:6 + 8], 'little') + granule_offset
+            page[6:6 + 8] = granule_position.to_bytes(8, 'little')
+            page_sequence_number = int.from_bytes(page[18:18 + 4], 'little') + sequence_offset
+            page[18:18 + 4] = page_sequence_number.to_bytes(4, 'little')
+            page[22:22 + 4] = bytes(4)
+
+        with path.open('rb') as fd:
+            fd.seek(HEADER_SIZE)
+            data = bytearray(fd.read(state['size'] - HEADER_SIZE))
+        offset = 0
+        pages = bytearray()
+        while offset + 27 <= len(data):
+            segments = data[offset + 26]
+            length = 27 + segments + sum(data[offset + 27:offset + 27 + segments])
+            page = data[offset:offset + length]
+            renumber(page)
+            crc = OggCRC.calculate(page, 0, length)
+            page[22:22 + 4] = crc.to_bytes(4, 'little')
+            pages += page
+            offset += length
+            if len(pages) >= COPY_CHUNK_SIZE:
+                self._fd.write(pages)
+                pages = bytearray()
+        self._fd.write(pages)
+
+        for packet, granule_position in state['packets']:
+            granule_position += granule_offset
+            self._packet_list.append(OggPacket(data=bytes.fromhex(packet), granule_position=granule_position))
+        self._packet_list_data_size = sum(len(packet.data) for packet in self._packet_list)
+        page = bytearray.fromhex(state['page'])
+        if page:
+            renumber(page)
+        self._page_buff[:len(page)] = page
+        self._page_buff_offset = len(page)
+        self._page_sequence_number = state['page_sequence_number'] + sequence_offset
+        self._granule_position = state['granule_position'] + granule_offset
+
+    def get_state(self) -> Dict[str, Any]:
+        return {
+            'size': sync_output(self._fd),
+            'serial_number': self._serial_number,
+            # pending packets and the last (not yet checksummed) page are small, keep them inline
+            'packets': [(packet.data.hex(), packet.granule_position) for packet in self._packet_list],
+            'page': self._page_buff[:self._page_buff_offset].hex(),
+            'page_sequence_number': self._page_sequence_number,
+            'granule_position': self._granule_position,
+        }
+
     def write_frame_packet(self, data: bytes, start_bit: int, end_bit: int) -> None:
         length_bits = end_bit - start_bit
         frame = BitHelper.copy_block(data, start_bit, length_bits)
@@ -17,12 +17,45 @@
 # COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
 # IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import sys
 from abc import ABC
+from array import array
 from pathlib import Path
-from typing import BinaryIO
+from typing import Any, BinaryIO, Dict
 
+from diagnostics import Diagnostics
+from general import OutputOpener, open_output, sync_output, reopen_output, COPY_CHUNK_SIZE
 from interfaces import IAudioWriter
 
+# Reference: EBU Tech 3306 (RF64)
+
+HEADER_SIZE = 80  # RIFF, JUNK reserved for ds64, fmt and data chunk headers
+DS64_SIZE = 28
+DATA_SIZE_OFFSET = HEADER_SIZE - 4
+MAX_FILE_SIZE = 0x7ffffffe  # larger files switch to RF64
+BYTE_ORDER_PROBE_SAMPLES = 4096
+
+
+def guess_byte_order(chunk: bytes, channel_count: int) -> str:
+    # the right byte order gives a much smoother waveform, compare neighbouring samples of each channel
+    count = min(len(chunk) // 2, BYTE_ORDER_PROBE_SAMPLES)
+    native = array('h', chunk[:count * 2])
+    swapped = array('h', native)
+    swapped.byteswap()
+    little, big = (native, swapped) if sys.byteorder == 'little' else (swapped, native)
+
+    def roughness(samples: array) -> int:
+        return sum(abs(b - a) for a, b in zip(samples, samples[channel_count:]))
+
+    return 'big' if roughness(big) < roughness(little) else 'little'
+
+
+def swap_bytes(chunk: bytes) -> bytearray:
+    swapped = bytearray(len(chunk) & ~1)
+    swapped[0::2] = chunk[1:len(swapped):2]
+    swapped[1::2] = chunk[0:len(swapped):2]
+    return swapped
+
 
 class WAVWriter(IAudioWriter, ABC):
     _path: Path
@@ -36,22 +69,42 @@ class WAVWriter(IAudioWriter, ABC):
     _block_align: int
     _final_sample_len = 0
     _sample_len = 0
+    _byte_order: str | None = 'little'
+    _warnings: Diagnostics | None = None
 
-    def __init__(self, path: Path, bits_per_sample: int, channel_count: int, samplerate: int):
+    def __init__(self, path: Path, bits_per_sample: int, channel_count: int, samplerate: int,
+                 state: Dict[str, Any] | None = None, byte_order: str | None = 'little',
+                 warnings: Diagnostics | None = None, opener: OutputOpener = open_output):
         self._path = path
+        # None detects the byte order of 16 bit samples from the first chunk
+        self._byte_order = byte_order if bits_per_sample == 16 else 'little'
+        self._warnings = warnings
 
         # WAVTools.WAVWriter
-        self._fd = self._path.open('wb')
+        if state is None:
+            self._fd = opener(self._path, True)
+        else:
+            self._fd = reopen_output(self._path, state['size'])
+            self._wrote_headers = state['wrote_headers']
+            self._sample_len = state['sample_len']
+            self._byte_order = state['byte_order']
         self._bits_per_sample = bits_per_sample
         self._channel_count = channel_count
         self._samplerate = samplerate
-        self._block_align = self._channel_count * (self._bits_per_sample + 7) // 8
+        self._block_align = self._channel_count * ((self._bits_per_sample + 7) // 8)
         # WAVTools.WAVWriter
 
         # wtf
         self.block_align = (bits_per_sample // 8) * channel_count
 
     def write_chunk(self, chunk: bytes, timestamp: int) -> None:
+        if self._byte_order is None and chunk:
+            self._byte_order = guess_byte_order(chunk, self._channel_count)
+            if self._warnings is not None:
+                self._warnings.warn('pcm_byte_order',
+                                    f'PCM byte order unspecified, detected {self._byte_order} endian.', once=True)
+        if self._byte_order == 'big':
+            chunk = swap_bytes(chunk)
         self.write(chunk, len(chunk) // self.block_align)
 
     def finish(self) -> None:
@@ -61,19 +114,64 @@ class WAVWriter(IAudioWriter, ABC):
 
         if self._sample_len != self._final_sample_len:
             data_chunk_size = self.get_data_chunk_size(self._sample_len)
-            self._fd.seek(4)
-            self._fd.write((data_chunk_size + (data_chunk_size & 1) + 36).to_bytes(4, 'little'))
-            self._fd.seek(40)
-            self._fd.write(data_chunk_size.to_bytes(4, 'little'))
+            riff_size = data_chunk_size + (data_chunk_size & 1) + HEADER_SIZE - 8
+            if (data_chunk_size + HEADER_SIZE) > MAX_FILE_SIZE:
+                # sizes don't fit the 32 bit fields, the reserved JUNK chunk becomes ds64
+                self._fd.seek(0)
+                self._fd.write(b'RF64')
+                self._fd.write(int.to_bytes(0xffffffff, 4, 'little'))
+                self._fd.seek(12)
+                self._fd.write(b'ds64')
+                self._fd.write(DS64_SIZE.to_bytes(4, 'little'))
+                self._fd.write(riff_size.to_bytes(8, 'little'))
+                self._fd.write(data_chunk_size.to_bytes(8, 'little'))
+                self._fd.write(self._sample_len.to_bytes(8, 'little'))
+                self._fd.write(int.to_bytes(0, 4, 'little'))  # table length
+                self._fd.seek(DATA_SIZE_OFFSET)
+                self._fd.write(int.to_bytes(0xffffffff, 4, 'little'))
+            else:
+                self._fd.seek(4)
+                self._fd.write(riff_size.to_bytes(4, 'little'))
+                self._fd.seek(DATA_SIZE_OFFSET)
+                self._fd.write(data_chunk_size.to_bytes(4, 'little'))
 
         self._fd.close()
 
+    def append_part(self, path: Path, state: Dict[str, Any]) -> None:
+        if state['sample_len'] == 0:
+            return
+        # samples of every part follow the byte order detected in the first one
+        if self._byte_order is None:
+            self._byte_order = state['byte_order']
+        swap = state['byte_order'] != self._byte_order
+        if not self._wrote_headers:
+            self.write_headers()
+            self._wrote_headers = True
+
+        size = state['sample_len'] * self._block_align
+        with path.open('rb') as fd:
+            fd.seek(HEADER_SIZE)
+            while size > 0:
+                data = fd.read(min(size, COPY_CHUNK_SIZE))
+                if not data:
+                    break
+                self._fd.write(swap_bytes(data) if swap else data)
+                size -= len(data)
+        self._sample_len += state['sample_len']
+
+    def get_state(self) -> Dict[str, Any]:
+        return {'size': sync_output(self._fd), 'wrote_headers': self._wrote_headers, 'sample_len': self._sample_len,
+                'byte_order': self._byte_order}
+
     def write_headers(self) -> None:
         data_chunk_size = self.get_data_chunk_size(self._final_sample_len)
 
         self._fd.write(b'RIFF')
-        self._fd.write((data_chunk_size + (data_chunk_size & 1) + 36).to_bytes(4, 'little'))
+        self._fd.write((data_chunk_size + (data_chunk_size & 1) + HEADER_SIZE - 8).to_bytes(4, 'little'))
         self._fd.write(b'WAVE')
+        self._fd.write(b'JUNK')
+        self._fd.write(DS64_SIZE.to_bytes(4, 'little'))
+        self._fd.write(bytes(DS64_SIZE))
         self._fd.write(b'fmt ')
         self._fd.write(int.to_bytes(16, 4, 'little'))
         self._fd.write(int.to_bytes(1, 2, 'little'))
@@ -86,12 +184,7 @@ class WAVWriter(IAudioWriter, ABC):
         self._fd.write(data_chunk_size.to_bytes(4, 'little'))
 
     def get_data_chunk_size(self, sample_count: int) -> int:
-        max_file_size = 0x7ffffffe
-
-        data_size = sample_count * self._block_align
-        if (data_size + 44) > max_file_size:
-            data_size = ((max_file_size - 44) // self._block_align) * self._block_align
-        return data_size
+        return sample_count * self._block_align
 
     def write(self, buff: bytes, sample_count: int) -> None:
         if sample_count <= 0:
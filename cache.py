@@ -0,0 +1,128 @@
+# FLV Extract
+# Copyright (C) 2006-2012 J.D. Purcell (moitah@yahoo.com)
+# Python port (C) 2012-2024 Gianluigi Tiesi <sherpya@gmail.com>
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import hashlib
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+SAMPLE_BLOCKS = 16
+SAMPLE_BLOCK_SIZE = 64 * 1024
+HASH_CHUNK_SIZE = 1024 * 1024
+RESULT_FILE = 'result.json'
+STALE_STAGING_AGE = 3600  # seconds, staging directories left over by crashed runs
+
+
+def link_or_copy(src: Path, dst: Path) -> None:
+    # hard links make both storing and serving a cached result O(1)
+    dst.unlink(missing_ok=True)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+class ResultCache:
+    directory: Path
+    max_size: int
+    full_hash: bool
+
+    def __init__(self, directory: Path, max_size: int, full_hash: bool = False):
+        self.directory = directory
+        self.max_size = max_size
+        self.full_hash = full_hash
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def fingerprint(self, path: Path) -> str:
+        # size plus a hash of evenly spaced blocks, or of the whole content when full_hash is set
+        size = path.stat().st_size
+        digest = hashlib.sha256(size.to_bytes(8, 'big'))
+        with path.open('rb') as fd:
+            if self.full_hash or size <= SAMPLE_BLOCKS * SAMPLE_BLOCK_SIZE:
+                while chunk := fd.read(HASH_CHUNK_SIZE):
+                    digest.update(chunk)
+            else:
+                step = (size - SAMPLE_BLOCK_SIZE) // (SAMPLE_BLOCKS - 1)
+                for i in range(SAMPLE_BLOCKS):
+                    fd.seek(i * step)
+                    digest.update(fd.read(SAMPLE_BLOCK_SIZE))
+        return ('f' if self.full_hash else 's') + digest.hexdigest()
+
+    def key(self, path: Path, options: Dict[str, Any]) -> str:
+        # the same input extracted with different options gives different outputs
+        options_digest = hashlib.sha256(json.dumps(options, sort_keys=True).encode()).hexdigest()
+        return hashlib.sha256(f'{self.fingerprint(path)}:{options_digest}'.encode()).hexdigest()
+
+    def lookup(self, key: str) -> Tuple[Path, Dict[str, Any]] | None:
+        entry = self.directory / key
+        try:
+            with (entry / RESULT_FILE).open('r') as fd:
+                result = json.load(fd)
+        except (OSError, ValueError):
+            return None
+        # hard linked outputs modified in place invalidate the entry
+        for name, size in result['outputs'].items():
+            path = entry / f'output{name}'
+            if not path.is_file() or path.stat().st_size != size:
+                return None
+        os.utime(entry / RESULT_FILE)  # most recently used
+        return entry, result
+
+    def store(self, key: str, outputs: List[Tuple[str, Path]], result: Dict[str, Any]) -> None:
+        entry = self.directory / key
+        staging = self.directory / f'{key}.tmp-{os.getpid()}'
+        shutil.rmtree(staging, ignore_errors=True)
+        staging.mkdir()
+        try:
+            for name, path in outputs:
+                link_or_copy(path, staging / f'output{name}')
+            with (staging / RESULT_FILE).open('w') as fd:
+                json.dump({**result, 'outputs': {name: path.stat().st_size for name, path in outputs}}, fd)
+            shutil.rmtree(entry, ignore_errors=True)
+            os.rename(staging, entry)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+        self.evict()
+
+    def evict(self) -> None:
+        # least recently used entries go first until the cache fits in max_size
+        entries = []
+        total = 0
+        now = time.time()
+        for entry in self.directory.iterdir():
+            result = entry / RESULT_FILE
+            if '.tmp-' in entry.name:
+                if (now - entry.stat().st_mtime) > STALE_STAGING_AGE:
+                    shutil.rmtree(entry, ignore_errors=True)
+                continue
+            if not entry.is_dir() or not result.exists():
+                continue
+            size = sum(path.stat().st_size for path in entry.iterdir())
+            entries.append((result.stat().st_mtime, size, entry))
+            total += size
+
+        entries.sort()
+        for _, size, entry in entries:
+            if total <= self.max_size:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
@@ -0,0 +1,87 @@
+# FLV Extract
+# Copyright (C) 2006-2012 J.D. Purcell (moitah@yahoo.com)
+# Python port (C) 2012-2024 Gianluigi Tiesi <sherpya@gmail.com>
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import json
+import os
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, List, Sequence
+
+from interfaces import FLVException
+
+
+class CheckpointLog:
+    # lists that only grow as the extraction goes (AVI index, timestamps) are appended to a log next to the
+    # checkpoint, which only keeps their length and the size of the log it covers: writing a checkpoint costs what
+    # was added since the previous one instead of everything so far
+    path: Path
+    _fd: BinaryIO | None = None
+    _lengths: Dict[str, int]  # items of each list in the log
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lengths = {}
+
+    def add(self, name: str, values: Sequence[int]) -> Dict[str, Any]:
+        start = self._lengths.get(name, 0)
+        # a list that got shorter was started over, it is logged again from its first item
+        if len(values) < start:
+            start = 0
+        if len(values) > start or start < self._lengths.get(name, 0):
+            self.write({'name': name, 'start': start, 'values': list(values[start:])})
+        self._lengths[name] = len(values)
+        return {'log': name, 'length': len(values)}
+
+    def write(self, record: Dict[str, Any]) -> None:
+        if self._fd is None:
+            self._fd = self.path.open('ab')
+        self._fd.write(json.dumps(record).encode() + b'\n')
+
+    def commit(self) -> int:
+        # synced before the checkpoint refers to it, the size returned goes in the checkpoint
+        if self._fd is None:
+            self._fd = self.path.open('ab')
+        self._fd.flush()
+        os.fsync(self._fd.fileno())
+        return self._fd.tell()
+
+    def restore(self, size: int) -> Dict[str, List[int]]:
+        # the lists as they were at the checkpoint, records logged after it are dropped
+        self.close()
+        lists: Dict[str, List[int]] = {}
+        with self.path.open('r+b') as fd:
+            if os.fstat(fd.fileno()).st_size < size:
+                raise FLVException('Checkpoint log is shorter than the checkpoint')
+            for line in fd.read(size).splitlines():
+                record = json.loads(line)
+                values = lists.setdefault(record['name'], [])
+                del values[record['start']:]
+                values.extend(record['values'])
+            fd.truncate(size)
+        self._lengths = {name: len(values) for name, values in lists.items()}
+        return lists
+
+    def close(self) -> None:
+        if self._fd is not None:
+            self._fd.close()
+            self._fd = None
+
+    def unlink(self) -> None:
+        self.close()
+        self._lengths = {}
+        self.path.unlink(missing_ok=True)
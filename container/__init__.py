@@ -0,0 +1,4 @@
+from .fmp4writer import FMP4Writer
+from .mkvwriter import MKVWriter
+
+__all__ = ['FMP4Writer', 'MKVWriter']
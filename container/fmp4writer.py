@@ -0,0 +1,467 @@
+# FLV Extract
+# Copyright (C) 2006-2012 J.D. Purcell (moitah@yahoo.com)
+# Python port (C) 2012-2024 Gianluigi Tiesi <sherpya@gmail.com>
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from fractions import Fraction
+from pathlib import Path
+from typing import Any, Dict, List, BinaryIO, Sequence
+
+from diagnostics import Diagnostics
+from general import OutputOpener, open_output
+from interfaces import IAudioWriter, IVideoWriter, FLVException
+from video.avc import AVCConfig, parse_avc_config
+
+# Reference: ISO/IEC 14496-12 (ISO base media file format) and ISO/IEC 23000-19 (CMAF)
+
+AAC_SAMPLE_RATES = [96000, 88200, 64000, 48000, 44100, 32000, 24000, 22050, 16000, 12000, 11025, 8000, 7350]
+AAC_FRAME_SAMPLES = 1024
+
+VIDEO_TIMESCALE = 1000  # flv timestamps are in milliseconds
+MAX_FRAGMENT_SIZE = 8 * 1024 * 1024  # forces a fragment even without a keyframe
+AUDIO_FRAGMENT_DURATION = 2000  # ms, used only for audio-only files
+
+SAMPLE_FLAGS_SYNC = 0x02000000  # sample_depends_on = 2
+SAMPLE_FLAGS_NON_SYNC = 0x01010000  # sample_depends_on = 1, sample_is_non_sync_sample = 1
+
+MATRIX = b''.join(x.to_bytes(4, 'big') for x in (0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000))
+
+
+def box(type_: bytes, *payload: bytes) -> bytes:
+    data = b''.join(payload)
+    return (8 + len(data)).to_bytes(4, 'big') + type_ + data
+
+
+def full_box(type_: bytes, version: int, flags: int, *payload: bytes) -> bytes:
+    return box(type_, ((version << 24) | flags).to_bytes(4, 'big'), *payload)
+
+
+def descriptor(tag: int, *payload: bytes) -> bytes:
+    data = b''.join(payload)
+    length = len(data)
+    size = bytearray([length & 0x7f])
+    length >>= 7
+    while length:
+        size.insert(0, 0x80 | (length & 0x7f))
+        length >>= 7
+    return bytes([tag]) + bytes(size) + data
+
+
+@dataclass
+class FMP4Sample:
+    data: bytes
+    dts: int
+    duration: int = 0
+    flags: int = SAMPLE_FLAGS_SYNC
+    composition_offset: int = 0
+
+
+class FMP4Track(ABC):
+    track_id: int = 0
+    handler: bytes
+    timescale: int
+    samples: List[FMP4Sample]
+    data_size: int = 0
+    next_dts: int | None = None
+    finished: bool = False
+    dropped: bool = False
+
+    def __init__(self, handler: bytes, timescale: int):
+        self.handler = handler
+        self.timescale = timescale
+        self.samples = []
+
+    @property
+    @abstractmethod
+    def configured(self) -> bool: ...
+
+    @abstractmethod
+    def sample_entry(self) -> bytes: ...
+
+    def add_sample(self, sample: FMP4Sample) -> None:
+        self.samples.append(sample)
+        self.data_size += len(sample.data)
+
+
+class FMP4VideoTrack(FMP4Track):
+    config: AVCConfig | None = None
+    held_sample: FMP4Sample | None = None
+    last_duration: int = 0
+
+    def __init__(self):
+        super().__init__(b'vide', VIDEO_TIMESCALE)
+
+    @property
+    def configured(self) -> bool:
+        return self.config is not None
+
+    def sample_entry(self) -> bytes:
+        assert self.config is not None
+        return box(b'avc1',
+                   bytes(6), int.to_bytes(1, 2, 'big'),  # data_reference_index
+                   bytes(16),
+                   self.config.width.to_bytes(2, 'big'),
+                   self.config.height.to_bytes(2, 'big'),
+                   int.to_bytes(0x00480000, 4, 'big'),  # 72 dpi
+                   int.to_bytes(0x00480000, 4, 'big'),
+                   bytes(4),
+                   int.to_bytes(1, 2, 'big'),  # frame_count
+                   bytes(32),  # compressorname
+                   int.to_bytes(0x18, 2, 'big'),  # depth
+                   int.to_bytes(-1, 2, 'big', signed=True),
+                   box(b'avcC', self.config.record))
+
+
+class FMP4AudioTrack(FMP4Track):
+    config: bytes | None = None
+    samplerate: int = 0
+    channels: int = 0
+
+    def __init__(self):
+        super().__init__(b'soun', 0)
+
+    @property
+    def configured(self) -> bool:
+        return self.config is not None
+
+    def set_config(self, config: bytes) -> None:
+        if len(config) < 2:
+            raise FLVException('Invalid AAC audio specific config.')
+        samplerate_index = ((config[0] & 0x07) << 1) | (config[1] >> 7)
+        if samplerate_index > 12:
+            raise FLVException('Invalid AAC sample rate index.')
+        self.config = config
+        self.samplerate = AAC_SAMPLE_RATES[samplerate_index]
+        self.channels = (config[1] >> 3) & 0x0f
+        self.timescale = self.samplerate
+
+    def sample_entry(self) -> bytes:
+        assert self.config is not None
+        esds = descriptor(0x03,
+                          int.to_bytes(0, 2, 'big'),  # ES_ID
+                          b'\x00',
+                          descriptor(0x04,
+                                     b'\x40',  # objectTypeIndication: MPEG-4 Audio
+                                     b'\x15',  # streamType: AudioStream
+                                     bytes(3 + 4 + 4),  # bufferSizeDB, maxBitrate, avgBitrate
+                                     descriptor(0x05, self.config)),
+                          descriptor(0x06, b'\x02'))
+        return box(b'mp4a',
+                   bytes(6), int.to_bytes(1, 2, 'big'),  # data_reference_index
+                   bytes(8),
+                   int.to_bytes(self.channels or 2, 2, 'big'),
+                   int.to_bytes(16, 2, 'big'),  # samplesize
+                   bytes(4),
+                   ((self.samplerate & 0xffff) << 16).to_bytes(4, 'big'),
+                   full_box(b'esds', 0, 0, esds))
+
+
+class FMP4Writer:
+    _path: Path
+    _fd: BinaryIO | None
+    _warnings: Diagnostics
+    _video: FMP4VideoTrack | None = None
+    _audio: FMP4AudioTrack | None = None
+    _tracks: List[FMP4Track]
+    _wrote_init: bool = False
+    _sequence_number: int = 1
+    _max_fragment_size: int
+
+    def __init__(self, path: Path, warnings: Diagnostics, max_fragment_size: int = MAX_FRAGMENT_SIZE,
+                 opener: OutputOpener = open_output):
+        self._path = path
+        self._fd = opener(self._path, False)
+        self._warnings = warnings
+        self._tracks = []
+        self._max_fragment_size = max_fragment_size
+
+    def video_writer(self) -> 'FMP4VideoWriter':
+        if self._video is None:
+            self._video = FMP4VideoTrack()
+        return FMP4VideoWriter(self, self._video, self._path, self._warnings)
+
+    def audio_writer(self) -> 'FMP4AudioWriter':
+        if self._audio is None:
+            self._audio = FMP4AudioTrack()
+        return FMP4AudioWriter(self, self._audio, self._path, self._warnings)
+
+    @property
+    def fragment_size(self) -> int:
+        return sum(track.data_size for track in (self._video, self._audio) if track is not None)
+
+    def add_video_sample(self, sample: FMP4Sample, keyframe: bool) -> None:
+        track = self._video
+        assert track is not None
+
+        if track.held_sample is not None:
+            # the duration of a video sample is only known once the next one arrives
+            held = track.held_sample
+            track.last_duration = max(sample.dts - held.dts, 0)
+            held.duration = track.last_duration
+            track.add_sample(held)
+            track.held_sample = None
+
+        if track.samples and (keyframe or self.fragment_size >= self._max_fragment_size):
+            self.write_fragment()
+
+        track.held_sample = sample
+
+    def add_audio_sample(self, sample: FMP4Sample) -> None:
+        track = self._audio
+        assert track is not None
+
+        track.add_sample(sample)
+
+        if self._video is None:
+            duration = len(track.samples) * AAC_FRAME_SAMPLES * 1000 // track.timescale
+            if duration >= AUDIO_FRAGMENT_DURATION:
+                self.write_fragment()
+        elif self.fragment_size >= self._max_fragment_size:
+            self.write_fragment()
+
+    def finish_track(self, track: FMP4Track, last_duration: int = 0) -> None:
+        track.finished = True
+        if isinstance(track, FMP4VideoTrack) and track.held_sample is not None:
+            track.held_sample.duration = track.last_duration or last_duration
+            track.add_sample(track.held_sample)
+            track.held_sample = None
+
+        if all(t.finished for t in (self._video, self._audio) if t is not None):
+            self.write_fragment()
+            self.close()
+
+    def close(self) -> None:
+        if self._fd is not None:
+            self._fd.close()
+            self._fd = None
+
+    def unlink(self) -> None:
+        self.close()
+        self._path.unlink(missing_ok=True)
+
+    def write_init_segment(self) -> None:
+        for track in (self._video, self._audio):
+            if track is not None and track.configured:
+                track.track_id = len(self._tracks) + 1
+                self._tracks.append(track)
+
+        ftyp = box(b'ftyp', b'iso6', int.to_bytes(0, 4, 'big'), b'iso6', b'cmfc', b'isom', b'mp41')
+        mvhd = full_box(b'mvhd', 0, 0,
+                        bytes(8),  # creation_time, modification_time
+                        VIDEO_TIMESCALE.to_bytes(4, 'big'),
+                        bytes(4),  # duration
+                        int.to_bytes(0x00010000, 4, 'big'),  # rate
+                        int.to_bytes(0x0100, 2, 'big'),  # volume
+                        bytes(10),
+                        MATRIX,
+                        bytes(24),
+                        (len(self._tracks) + 1).to_bytes(4, 'big'))  # next_track_ID
+
+        traks = [self.trak(track) for track in self._tracks]
+        mvex = box(b'mvex', *(full_box(b'trex', 0, 0,
+                                       track.track_id.to_bytes(4, 'big'),
+                                       int.to_bytes(1, 4, 'big'),  # default_sample_description_index
+                                       bytes(8),  # default_sample_duration, default_sample_size
+                                       (SAMPLE_FLAGS_SYNC if track.handler == b'soun'
+                                        else SAMPLE_FLAGS_NON_SYNC).to_bytes(4, 'big'))
+                              for track in self._tracks))
+
+        assert self._fd is not None
+        self._fd.write(ftyp + box(b'moov', mvhd, *traks, mvex))
+        self._wrote_init = True
+
+    @staticmethod
+    def trak(track: FMP4Track) -> bytes:
+        is_video = track.handler == b'vide'
+        width = height = 0
+        if isinstance(track, FMP4VideoTrack) and track.config is not None:
+            width, height = track.config.width, track.config.height
+
+        tkhd = full_box(b'tkhd', 0, 3,  # enabled, in movie
+                        bytes(8),
+                        track.track_id.to_bytes(4, 'big'),
+                        bytes(4),
+                        bytes(4),  # duration
+                        bytes(8),
+                        bytes(4),  # layer, alternate_group
+                        int.to_bytes(0 if is_video else 0x0100, 2, 'big'),  # volume
+                        bytes(2),
+                        MATRIX,
+                        (width << 16).to_bytes(4, 'big'),
+                        (height << 16).to_bytes(4, 'big'))
+        mdhd = full_box(b'mdhd', 0, 0,
+                        bytes(8),
+                        track.timescale.to_bytes(4, 'big'),
+                        bytes(4),  # duration
+                        int.to_bytes(0x55c4, 2, 'big'),  # language: und
+                        bytes(2))
+        name = b'VideoHandler\x00' if is_video else b'SoundHandler\x00'
+        hdlr = full_box(b'hdlr', 0, 0, bytes(4), track.handler, bytes(12), name)
+        media_header = full_box(b'vmhd', 0, 1, bytes(8)) if is_video else full_box(b'smhd', 0, 0, bytes(4))
+        dinf = box(b'dinf', full_box(b'dref', 0, 0, int.to_bytes(1, 4, 'big'), full_box(b'url ', 0, 1)))
+        stbl = box(b'stbl',
+                   full_box(b'stsd', 0, 0, int.to_bytes(1, 4, 'big'), track.sample_entry()),
+                   full_box(b'stts', 0, 0, bytes(4)),
+                   full_box(b'stsc', 0, 0, bytes(4)),
+                   full_box(b'stsz', 0, 0, bytes(8)),
+                   full_box(b'stco', 0, 0, bytes(4)))
+        return box(b'trak', tkhd, box(b'mdia', mdhd, hdlr, box(b'minf', media_header, dinf, stbl)))
+
+    def write_fragment(self) -> None:
+        pending = [track for track in (self._video, self._audio) if track is not None and track.samples]
+        if not pending:
+            return
+
+        if not self._wrote_init:
+            self.write_init_segment()
+
+        tracks = []
+        for track in pending:
+            if track.track_id:
+                tracks.append(track)
+                continue
+            # configured after the init segment was written
+            if not track.dropped:
+                self._warnings.warn('late_track',
+                                    f'Track {track.handler.decode()} configured too late, dropping its samples.',
+                                    once=True)
+                track.dropped = True
+            track.samples = []
+            track.data_size = 0
+
+        if not tracks:
+            return
+
+        # sizes don't depend on the data offsets, so build once to measure and once for real
+        moof = self.moof(tracks, [0] * len(tracks))
+        offsets = []
+        offset = len(moof) + 8
+        for track in tracks:
+            offsets.append(offset)
+            offset += track.data_size
+        moof = self.moof(tracks, offsets)
+
+        assert self._fd is not None
+        self._fd.write(moof)
+        self._fd.write((8 + sum(track.data_size for track in tracks)).to_bytes(4, 'big') + b'mdat')
+        for track in tracks:
+            self._fd.writelines(sample.data for sample in track.samples)
+            track.samples = []
+            track.data_size = 0
+        self._fd.flush()
+        self._sequence_number += 1
+
+    def moof(self, tracks: Sequence[FMP4Track], data_offsets: List[int]) -> bytes:
+        trafs = []
+        for track, data_offset in zip(tracks, data_offsets):
+            is_video = track.handler == b'vide'
+            tfhd = full_box(b'tfhd', 0, 0x020000, track.track_id.to_bytes(4, 'big'))  # default-base-is-moof
+            tfdt = full_box(b'tfdt', 1, 0, track.samples[0].dts.to_bytes(8, 'big'))
+            entries = bytearray()
+            for sample in track.samples:
+                entries += sample.duration.to_bytes(4, 'big')
+                entries += len(sample.data).to_bytes(4, 'big')
+                if is_video:
+                    entries += sample.flags.to_bytes(4, 'big')
+                    entries += sample.composition_offset.to_bytes(4, 'big', signed=True)
+            # data-offset, sample-duration, sample-size (+ sample-flags, sample-composition-time-offset)
+            trun = full_box(b'trun', 1 if is_video else 0, 0xf01 if is_video else 0x301,
+                            len(track.samples).to_bytes(4, 'big'),
+                            data_offset.to_bytes(4, 'big', signed=True),
+                            bytes(entries))
+            trafs.append(box(b'traf', tfhd, tfdt, trun))
+        return box(b'moof', full_box(b'mfhd', 0, 0, self._sequence_number.to_bytes(4, 'big')), *trafs)
+
+
+class FMP4VideoWriter(IVideoWriter, ABC):
+    _muxer: FMP4Writer
+    _track: FMP4VideoTrack
+    _warnings: Diagnostics
+
+    def __init__(self, muxer: FMP4Writer, track: FMP4VideoTrack, path: Path, warnings: Diagnostics):
+        self._muxer = muxer
+        self._track = track
+        self._path = path
+        self._warnings = warnings
+
+    def write_chunk(self, chunk: bytes, timestamp: int, frame_type: int) -> None:
+        if len(chunk) < 4:
+            return
+
+        if chunk[0] == 0:  # AVC sequence header
+            config = parse_avc_config(chunk[4:])
+            if self._track.config is None:
+                self._track.config = config
+            elif config.record != self._track.config.record:
+                self._warnings.warn('sequence_header_changed',
+                                    'AVC sequence header changed, ignoring new configuration.')
+        elif chunk[0] == 1 and self._track.config is not None:  # NALUs
+            keyframe = frame_type == 1
+            sample = FMP4Sample(data=chunk[4:], dts=timestamp,
+                                flags=SAMPLE_FLAGS_SYNC if keyframe else SAMPLE_FLAGS_NON_SYNC,
+                                composition_offset=int.from_bytes(chunk[1:4], 'big', signed=True))
+            self._muxer.add_video_sample(sample, keyframe)
+
+    def finish(self, average_framerate: Fraction) -> None:
+        self._muxer.finish_track(self._track, round(1000 / average_framerate) if average_framerate else 0)
+
+    def get_state(self) -> Dict[str, Any]:
+        raise FLVException('Checkpoints are not supported with fragmented MP4 output.')
+
+    def unlink(self) -> None:
+        self._muxer.unlink()
+
+
+class FMP4AudioWriter(IAudioWriter, ABC):
+    _muxer: FMP4Writer
+    _track: FMP4AudioTrack
+    _warnings: Diagnostics
+
+    def __init__(self, muxer: FMP4Writer, track: FMP4AudioTrack, path: Path, warnings: Diagnostics):
+        self._muxer = muxer
+        self._track = track
+        self._path = path
+        self._warnings = warnings
+
+    def write_chunk(self, chunk: bytes, timestamp: int) -> None:
+        if len(chunk) < 1:
+            return
+
+        if chunk[0] == 0:  # AAC sequence header
+            if self._track.config is None:
+                self._track.set_config(chunk[1:])
+            elif chunk[1:] != self._track.config:
+                self._warnings.warn('sequence_header_changed',
+                                    'AAC sequence header changed, ignoring new configuration.')
+        elif self._track.config is not None:
+            track = self._track
+            if track.next_dts is None:
+                track.next_dts = timestamp * track.timescale // 1000
+            sample = FMP4Sample(data=chunk[1:], dts=track.next_dts, duration=AAC_FRAME_SAMPLES)
+            track.next_dts += AAC_FRAME_SAMPLES
+            self._muxer.add_audio_sample(sample)
+
+    def finish(self) -> None:
+        self._muxer.finish_track(self._track)
+
+    def get_state(self) -> Dict[str, Any]:
+        raise FLVException('Checkpoints are not supported with fragmented MP4 output.')
+
+    def unlink(self) -> None:
+        self._muxer.unlink()
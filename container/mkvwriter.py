@@ -0,0 +1,547 @@
+# FLV Extract
+# Copyright (C) 2006-2012 J.D. Purcell (moitah@yahoo.com)
+# Python port (C) 2012-2024 Gianluigi Tiesi <sherpya@gmail.com>
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+from abc import ABC, abstractmethod
+from array import array
+from fractions import Fraction
+from pathlib import Path
+from struct import pack
+from typing import Any, Dict, List, BinaryIO, Tuple
+
+from audio.mp3writer import MPEG1SampleRate, MPEG20SampleRate, MPEG25SampleRate, MPEGVersion, ChannelMode
+from audio.wavwriter import guess_byte_order
+from diagnostics import Diagnostics
+from general import OutputOpener, open_output
+from interfaces import IAudioWriter, IVideoWriter, VideoCodecID, AudioFormat, SampleRates, FLVException
+from video.aviwriter import get_frame_size
+from video.avc import parse_avc_config
+from .fmp4writer import AAC_SAMPLE_RATES
+
+# Reference: RFC 8794 (EBML) and RFC 9559 (Matroska)
+
+EBML = 0x1a45dfa3
+EBML_VERSION = 0x4286
+EBML_READ_VERSION = 0x42f7
+EBML_MAX_ID_LENGTH = 0x42f2
+EBML_MAX_SIZE_LENGTH = 0x42f3
+DOC_TYPE = 0x4282
+DOC_TYPE_VERSION = 0x4287
+DOC_TYPE_READ_VERSION = 0x4285
+VOID = 0xec
+
+SEGMENT = 0x18538067
+SEEK_HEAD = 0x114d9b74
+SEEK = 0x4dbb
+SEEK_ID = 0x53ab
+SEEK_POSITION = 0x53ac
+INFO = 0x1549a966
+TIMESTAMP_SCALE = 0x2ad7b1
+MUXING_APP = 0x4d80
+WRITING_APP = 0x5741
+DURATION = 0x4489
+TRACKS = 0x1654ae6b
+TRACK_ENTRY = 0xae
+TRACK_NUMBER = 0xd7
+TRACK_UID = 0x73c5
+TRACK_TYPE = 0x83
+FLAG_LACING = 0x9c
+LANGUAGE = 0x22b59c
+CODEC_ID = 0x86
+CODEC_PRIVATE = 0x63a2
+VIDEO = 0xe0
+PIXEL_WIDTH = 0xb0
+PIXEL_HEIGHT = 0xba
+AUDIO = 0xe1
+SAMPLING_FREQUENCY = 0xb5
+CHANNELS = 0x9f
+BIT_DEPTH = 0x6264
+CLUSTER = 0x1f43b675
+TIMESTAMP = 0xe7
+SIMPLE_BLOCK = 0xa3
+CUES = 0x1c53bb6b
+CUE_POINT = 0xbb
+CUE_TIME = 0xb3
+CUE_TRACK_POSITIONS = 0xb7
+CUE_TRACK = 0xf7
+CUE_CLUSTER_POSITION = 0xf1
+
+TRACK_TYPE_VIDEO = 1
+TRACK_TYPE_AUDIO = 2
+
+BLOCK_FLAG_KEYFRAME = 0x80
+BLOCK_FLAG_DISCARDABLE = 0x01
+
+UNKNOWN_SIZE = b'\x01\xff\xff\xff\xff\xff\xff\xff'
+SEEK_HEAD_SPACE = 96  # reserved after the segment start, enough for three seek entries
+MAX_CLUSTER_SIZE = 8 * 1024 * 1024  # forces a cluster even without a keyframe
+MAX_CLUSTER_DURATION = 5000  # ms, also keeps block timestamps within their signed 16 bit range
+
+SPEEX_FORMAT_TAG = 0xa109
+
+
+def ebml_size(size: int) -> bytes:
+    length = 1
+    while size >= (1 << (7 * length)) - 1:
+        length += 1
+    return ((1 << (7 * length)) | size).to_bytes(length, 'big')
+
+
+def element_header(id_: int, size: int) -> bytes:
+    return id_.to_bytes((id_.bit_length() + 7) // 8, 'big') + ebml_size(size)
+
+
+def element(id_: int, *payload: bytes) -> bytes:
+    data = b''.join(payload)
+    return element_header(id_, len(data)) + data
+
+
+def uint_element(id_: int, value: int) -> bytes:
+    return element(id_, value.to_bytes(max((value.bit_length() + 7) // 8, 1), 'big'))
+
+
+def float_element(id_: int, value: float) -> bytes:
+    return element(id_, pack('>d', value))
+
+
+def string_element(id_: int, value: str) -> bytes:
+    return element(id_, value.encode())
+
+
+def void_element(size: int) -> bytes:
+    # size includes the 1 byte id and the 8 byte length
+    return VOID.to_bytes(1, 'big') + b'\x01' + (size - 9).to_bytes(7, 'big') + bytes(size - 9)
+
+
+class MKVTrack(ABC):
+    number: int = 0
+    track_type: int
+    codec_id: str = ''
+    codec_private: bytes = b''
+    finished: bool = False
+    dropped: bool = False
+
+    def __init__(self, track_type: int):
+        self.track_type = track_type
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.codec_id)
+
+    @abstractmethod
+    def settings(self) -> bytes: ...
+
+    def entry(self) -> bytes:
+        return element(TRACK_ENTRY,
+                       uint_element(TRACK_NUMBER, self.number),
+                       uint_element(TRACK_UID, self.number),
+                       uint_element(TRACK_TYPE, self.track_type),
+                       uint_element(FLAG_LACING, 0),
+                       string_element(LANGUAGE, 'und'),
+                       string_element(CODEC_ID, self.codec_id),
+                       element(CODEC_PRIVATE, self.codec_private) if self.codec_private else b'',
+                       self.settings())
+
+
+class MKVVideoTrack(MKVTrack):
+    width: int = 0
+    height: int = 0
+
+    def __init__(self):
+        super().__init__(TRACK_TYPE_VIDEO)
+
+    def settings(self) -> bytes:
+        return element(VIDEO, uint_element(PIXEL_WIDTH, self.width), uint_element(PIXEL_HEIGHT, self.height))
+
+
+class MKVAudioTrack(MKVTrack):
+    samplerate: int = 0
+    channels: int = 0
+    bits_per_sample: int = 0
+
+    def __init__(self):
+        super().__init__(TRACK_TYPE_AUDIO)
+
+    def settings(self) -> bytes:
+        return element(AUDIO,
+                       float_element(SAMPLING_FREQUENCY, self.samplerate),
+                       uint_element(CHANNELS, self.channels),
+                       uint_element(BIT_DEPTH, self.bits_per_sample) if self.bits_per_sample else b'')
+
+
+class MKVWriter:
+    _path: Path
+    _fd: BinaryIO | None
+    _warnings: Diagnostics
+    _video: MKVVideoTrack | None = None
+    _audio: MKVAudioTrack | None = None
+    _tracks: List[MKVTrack]
+    _wrote_header: bool = False
+    _segment_offset: int = 0
+    _duration_offset: int = 0
+    _info_position: int = 0
+    _tracks_position: int = 0
+    _max_timestamp: int = 0
+
+    _blocks: List[Tuple[MKVTrack, int, int, bytes | memoryview]]
+    _cluster_size: int = 0
+    _cluster_keyframes: Dict[MKVTrack, int]
+
+    # cues are only written at the end, keep them compact
+    _cue_times: array
+    _cue_positions: array
+
+    def __init__(self, path: Path, warnings: Diagnostics, opener: OutputOpener = open_output):
+        self._path = path
+        self._fd = opener(self._path, True)
+        self._warnings = warnings
+        self._tracks = []
+        self._blocks = []
+        self._cluster_keyframes = {}
+        self._cue_times = array('Q')
+        self._cue_positions = array('Q')
+
+    def video_writer(self, codec_id: int) -> 'MKVVideoWriter':
+        if self._video is None:
+            self._video = MKVVideoTrack()
+        return MKVVideoWriter(self, self._video, codec_id, self._path, self._warnings)
+
+    def audio_writer(self, mediainfo: int) -> 'MKVAudioWriter':
+        if self._audio is None:
+            self._audio = MKVAudioTrack()
+        return MKVAudioWriter(self, self._audio, mediainfo, self._path, self._warnings)
+
+    @property
+    def cue_track(self) -> MKVTrack | None:
+        return self._video if self._video is not None else self._audio
+
+    @property
+    def position(self) -> int:
+        assert self._fd is not None
+        return self._fd.tell() - self._segment_offset
+
+    def add_block(self, track: MKVTrack, data: bytes | memoryview, timestamp: int, flags: int) -> None:
+        keyframe = (flags & BLOCK_FLAG_KEYFRAME) != 0
+        if self._blocks:
+            relative = timestamp - self._blocks[0][1]
+            # clusters start at video keyframes, audio only files are split by duration
+            if ((keyframe and track is self._video and track in self._cluster_keyframes and relative >= 0)
+                    or not (-0x8000 <= relative < MAX_CLUSTER_DURATION)
+                    or self._cluster_size >= MAX_CLUSTER_SIZE):
+                self.write_cluster()
+
+        if keyframe and track not in self._cluster_keyframes:
+            self._cluster_keyframes[track] = timestamp
+        self._blocks.append((track, timestamp, flags, data))
+        self._cluster_size += len(data)
+        self._max_timestamp = max(self._max_timestamp, timestamp)
+
+    def finish_track(self, track: MKVTrack) -> None:
+        track.finished = True
+        if all(t.finished for t in (self._video, self._audio) if t is not None):
+            self.write_cluster()
+            if not self._wrote_header:
+                self.write_header()
+            self.write_cues()
+            self.close()
+
+    def close(self) -> None:
+        if self._fd is not None:
+            self._fd.close()
+            self._fd = None
+
+    def unlink(self) -> None:
+        self.close()
+        self._path.unlink(missing_ok=True)
+
+    def write_header(self) -> None:
+        for track in (self._video, self._audio):
+            if track is not None and track.configured:
+                track.number = len(self._tracks) + 1
+                self._tracks.append(track)
+
+        assert self._fd is not None
+        self._fd.write(element(EBML,
+                               uint_element(EBML_VERSION, 1),
+                               uint_element(EBML_READ_VERSION, 1),
+                               uint_element(EBML_MAX_ID_LENGTH, 4),
+                               uint_element(EBML_MAX_SIZE_LENGTH, 8),
+                               string_element(DOC_TYPE, 'matroska'),
+                               uint_element(DOC_TYPE_VERSION, 4),
+                               uint_element(DOC_TYPE_READ_VERSION, 2)))
+        self._fd.write(SEGMENT.to_bytes(4, 'big') + UNKNOWN_SIZE)  # patched once all clusters are written
+        self._segment_offset = self._fd.tell()
+        self._fd.write(void_element(SEEK_HEAD_SPACE))
+
+        self._info_position = self.position
+        info = element(INFO,
+                       uint_element(TIMESTAMP_SCALE, 1000000),  # flv timestamps are in milliseconds
+                       string_element(MUXING_APP, 'FLV Extract'),
+                       string_element(WRITING_APP, 'FLV Extract'),
+                       float_element(DURATION, 0))
+        self._duration_offset = self._fd.tell() + len(info) - 8
+        self._fd.write(info)
+
+        self._tracks_position = self.position
+        self._fd.write(element(TRACKS, *(track.entry() for track in self._tracks)))
+        self._wrote_header = True
+
+    def write_cluster(self) -> None:
+        if not self._blocks:
+            return
+
+        if not self._wrote_header:
+            self.write_header()
+
+        cluster_timestamp = self._blocks[0][1]
+        parts: List[bytes | memoryview] = []
+        for track, timestamp, flags, data in self._blocks:
+            if not track.number:
+                # configured after the header was written
+                if not track.dropped:
+                    name = 'Video' if track is self._video else 'Audio'
+                    self._warnings.warn('late_track', f'{name} track configured too late, dropping its blocks.')
+                    track.dropped = True
+                continue
+            block = (bytes([0x80 | track.number])  # track numbers are < 127, a single byte vint
+                     + (timestamp - cluster_timestamp).to_bytes(2, 'big', signed=True)
+                     + bytes([flags]))
+            parts.append(element_header(SIMPLE_BLOCK, len(block) + len(data)) + block)
+            parts.append(data)
+
+        cue_track = self.cue_track
+        cue = self._cluster_keyframes.get(cue_track) if cue_track is not None else None
+        self._blocks = []
+        self._cluster_size = 0
+        self._cluster_keyframes = {}
+        if not parts:
+            return
+
+        if cue is not None:
+            self._cue_times.append(cue)
+            self._cue_positions.append(self.position)
+
+        cluster_header = uint_element(TIMESTAMP, cluster_timestamp)
+        assert self._fd is not None
+        self._fd.write(element_header(CLUSTER, len(cluster_header) + sum(map(len, parts))) + cluster_header)
+        self._fd.writelines(parts)
+
+    def write_cues(self) -> None:
+        assert self._fd is not None
+        cue_track = self.cue_track
+        cues_position = 0
+        if self._cue_times and cue_track is not None:
+            cues_position = self.position
+            track_number = uint_element(CUE_TRACK, cue_track.number)
+            self._fd.write(element(CUES, *(element(CUE_POINT,
+                                                   uint_element(CUE_TIME, time),
+                                                   element(CUE_TRACK_POSITIONS,
+                                                           track_number,
+                                                           uint_element(CUE_CLUSTER_POSITION, position)))
+                                           for time, position in zip(self._cue_times, self._cue_positions))))
+
+        segment_size = self.position
+        seeks = [(INFO, self._info_position), (TRACKS, self._tracks_position)]
+        if cues_position:
+            seeks.append((CUES, cues_position))
+        seek_head = element(SEEK_HEAD, *(element(SEEK,
+                                                 element(SEEK_ID, id_.to_bytes(4, 'big')),
+                                                 uint_element(SEEK_POSITION, position))
+                                         for id_, position in seeks))
+
+        self._fd.seek(self._segment_offset - 7)
+        self._fd.write(segment_size.to_bytes(7, 'big'))
+        self._fd.write(seek_head + void_element(SEEK_HEAD_SPACE - len(seek_head)))
+        self._fd.seek(self._duration_offset)
+        self._fd.write(pack('>d', self._max_timestamp))
+
+
+class MKVVideoWriter(IVideoWriter, ABC):
+    _muxer: MKVWriter
+    _track: MKVVideoTrack
+    _codec_id: int
+    _warnings: Diagnostics
+
+    def __init__(self, muxer: MKVWriter, track: MKVVideoTrack, codec_id: int, path: Path, warnings: Diagnostics):
+        if codec_id not in (VideoCodecID.H263, VideoCodecID.VP6, VideoCodecID.VP6v2, VideoCodecID.AVC):
+            raise FLVException('Unsupported video codec')
+
+        self._muxer = muxer
+        self._track = track
+        self._codec_id = codec_id
+        self._path = path
+        self._warnings = warnings
+
+        if codec_id == VideoCodecID.VP6v2:
+            self._warnings.warn('alpha_dropped',
+                                'Matroska output keeps only the color planes of VP6 video with alpha channel.',
+                                once=True)
+
+    def write_chunk(self, chunk: bytes, timestamp: int, frame_type: int) -> None:
+        track = self._track
+        flags = BLOCK_FLAG_KEYFRAME if frame_type == 1 else BLOCK_FLAG_DISCARDABLE if frame_type == 3 else 0
+
+        if self._codec_id == VideoCodecID.AVC:
+            if len(chunk) < 4:
+                return
+            if chunk[0] == 0:  # AVC sequence header
+                config = parse_avc_config(chunk[4:])
+                if not track.configured:
+                    track.codec_id = 'V_MPEG4/ISO/AVC'
+                    track.codec_private = config.record
+                    track.width, track.height = config.width, config.height
+                elif config.record != track.codec_private:
+                    self._warnings.warn('sequence_header_changed',
+                                        'AVC sequence header changed, ignoring new configuration.')
+            elif chunk[0] == 1 and track.configured:  # NALUs, blocks are stored in presentation order
+                composition_offset = int.from_bytes(chunk[1:4], 'big', signed=True)
+                self._muxer.add_block(track, memoryview(chunk)[4:], timestamp + composition_offset, flags)
+            return
+
+        # the same payload the AVI writer stores
+        offset = 0
+        length = len(chunk)
+        if self._codec_id == VideoCodecID.VP6:
+            offset = 1
+        elif self._codec_id == VideoCodecID.VP6v2:
+            if length < 4:
+                return
+            offset = 4
+            length = min(offset + (int.from_bytes(chunk[:4], 'big') & 0xffffff), length)
+
+        if not track.configured:
+            width, height = get_frame_size(self._codec_id, chunk)
+            if not width:
+                return
+            track.codec_id = 'V_MS/VFW/FOURCC'
+            track.width, track.height = width, height
+            fourcc = b'FLV1' if self._codec_id == VideoCodecID.H263 else b'VP6F'
+            track.codec_private = (pack('<IiiHH', 40, width, height, 1, 24) + fourcc
+                                   + pack('<IiiII', width * height * 3, 0, 0, 0, 0))  # BITMAPINFOHEADER
+
+        self._muxer.add_block(track, memoryview(chunk)[offset:length], timestamp, flags)
+
+    def finish(self, average_framerate: Fraction) -> None:
+        self._muxer.finish_track(self._track)
+
+    def get_state(self) -> Dict[str, Any]:
+        raise FLVException('Checkpoints are not supported with Matroska output.')
+
+    def unlink(self) -> None:
+        self._muxer.unlink()
+
+
+class MKVAudioWriter(IAudioWriter, ABC):
+    _muxer: MKVWriter
+    _track: MKVAudioTrack
+    _format: int
+    _warnings: Diagnostics
+
+    def __init__(self, muxer: MKVWriter, track: MKVAudioTrack, mediainfo: int, path: Path, warnings: Diagnostics):
+        self._muxer = muxer
+        self._track = track
+        self._format = mediainfo >> 4
+        self._path = path
+        self._warnings = warnings
+
+        match self._format:
+            case AudioFormat.PCM | AudioFormat.PCM_LE:
+                # 16 bit PCM is in the byte order of the encoding machine, detected from the first chunk
+                if self._format == AudioFormat.PCM_LE or not (mediainfo >> 1) & 0x1:
+                    track.codec_id = 'A_PCM/INT/LIT'
+                track.samplerate = SampleRates[(mediainfo >> 2) & 0x3]
+                track.bits_per_sample = 16 if (mediainfo >> 1) & 0x1 else 8
+                track.channels = 2 if mediainfo & 0x1 else 1
+            case AudioFormat.SPEEX:
+                # there's no native Speex codec ID, use the ACM mapping, flv Speex is always 16 kHz mono
+                track.codec_id = 'A_MS/ACM'
+                track.samplerate = 16000
+                track.channels = 1
+                track.codec_private = pack('<HHIIHHH', SPEEX_FORMAT_TAG, 1, 16000, 0, 0, 16, 0)  # WAVEFORMATEX
+            case AudioFormat.MP3 | AudioFormat.MP3_8k | AudioFormat.AAC:
+                pass  # configured from the stream
+            case _:
+                raise FLVException('Unsupported audio format')
+
+    def write_chunk(self, chunk: bytes, timestamp: int) -> None:
+        track = self._track
+
+        if self._format == AudioFormat.AAC:
+            if len(chunk) < 1:
+                return
+            if chunk[0] == 0:  # AAC sequence header
+                config = chunk[1:]
+                if not track.configured:
+                    if len(config) < 2 or (((config[0] & 0x07) << 1) | (config[1] >> 7)) > 12:
+                        raise FLVException('Invalid AAC audio specific config.')
+                    track.codec_id = 'A_AAC'
+                    track.codec_private = config
+                    track.samplerate = AAC_SAMPLE_RATES[((config[0] & 0x07) << 1) | (config[1] >> 7)]
+                    track.channels = ((config[1] >> 3) & 0x0f) or 2
+                elif config != track.codec_private:
+                    self._warnings.warn('sequence_header_changed',
+                                        'AAC sequence header changed, ignoring new configuration.')
+            elif track.configured:
+                self._muxer.add_block(track, memoryview(chunk)[1:], timestamp, BLOCK_FLAG_KEYFRAME)
+            return
+
+        if self._format in (AudioFormat.MP3, AudioFormat.MP3_8k) and not track.configured:
+            if not self.read_mp3_header(chunk):
+                return
+
+        if self._format == AudioFormat.PCM and not track.configured:
+            if not chunk:
+                return
+            byte_order = guess_byte_order(chunk, track.channels)
+            track.codec_id = 'A_PCM/INT/BIG' if byte_order == 'big' else 'A_PCM/INT/LIT'
+            self._warnings.warn('pcm_byte_order', f'PCM byte order unspecified, detected {byte_order} endian.',
+                                once=True)
+
+        self._muxer.add_block(track, chunk, timestamp, BLOCK_FLAG_KEYFRAME)
+
+    def read_mp3_header(self, chunk: bytes) -> bool:
+        # http://www.mp3-tech.org/programmer/frame_header.html
+        if len(chunk) < 4 or chunk[0] != 0xff or (chunk[1] & 0xe0) != 0xe0:
+            return False
+
+        mpeg_version = (chunk[1] >> 3) & 0x03
+        samplerate_index = (chunk[2] >> 2) & 0x03
+        if mpeg_version == MPEGVersion.RESERVED or samplerate_index == 3:
+            return False
+
+        match mpeg_version:
+            case MPEGVersion.MPEG1:
+                samplerate = MPEG1SampleRate[samplerate_index]
+            case MPEGVersion.MPEG2:
+                samplerate = MPEG20SampleRate[samplerate_index]
+            case _:
+                samplerate = MPEG25SampleRate[samplerate_index]
+
+        self._track.codec_id = 'A_MPEG/L3'
+        self._track.samplerate = samplerate
+        self._track.channels = 1 if (chunk[3] >> 6) == ChannelMode.MONO else 2
+        return True
+
+    def finish(self) -> None:
+        self._muxer.finish_track(self._track)
+
+    def get_state(self) -> Dict[str, Any]:
+        raise FLVException('Checkpoints are not supported with Matroska output.')
+
+    def unlink(self) -> None:
+        self._muxer.unlink()
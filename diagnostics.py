@@ -0,0 +1,112 @@
+# FLV Extract
+# Copyright (C) 2006-2012 J.D. Purcell (moitah@yahoo.com)
+# Python port (C) 2012-2024 Gianluigi Tiesi <sherpya@gmail.com>
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+from dataclasses import dataclass, field, asdict
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+MAX_WARNING_SAMPLES = 5  # distinct messages kept per code, all of them are counted
+
+# (offset, timestamp) of the tag being processed, for warnings raised by the writers
+WarningContext = Callable[[], Tuple[int | None, int | None]]
+
+
+@dataclass
+class Diagnostic:
+    code: str
+    once: bool = False  # about the setup rather than the data (e.g. an unsupported codec), counted once per message
+    count: int = 0
+    first_offset: int | None = None
+    last_offset: int | None = None
+    first_timestamp: int | None = None
+    last_timestamp: int | None = None
+    samples: List[str] = field(default_factory=list)
+
+    def add(self, count: int, first_offset: int | None, last_offset: int | None, first_timestamp: int | None,
+            last_timestamp: int | None, samples: List[str]) -> None:
+        if self.first_offset is None:
+            self.first_offset, self.last_offset = first_offset, last_offset
+        if self.first_timestamp is None:
+            self.first_timestamp, self.last_timestamp = first_timestamp, last_timestamp
+        if self.once:
+            samples = [message for message in samples if message not in self.samples]
+            count = len(samples)
+            if count == 0:
+                return
+        self.count += count
+        if last_offset is not None:
+            self.last_offset = last_offset
+        if last_timestamp is not None:
+            self.last_timestamp = last_timestamp
+        for message in samples:
+            if len(self.samples) >= MAX_WARNING_SAMPLES:
+                break
+            if message not in self.samples:
+                self.samples.append(message)
+
+
+class Diagnostics:
+    # warnings by code, each with a count, the offsets and timestamps it was seen between and a few sample messages;
+    # a damaged stream warning on every tag costs the same memory as a single warning
+    entries: Dict[str, Diagnostic]
+    _context: WarningContext | None
+
+    def __init__(self, context: WarningContext | None = None):
+        self.entries = {}
+        self._context = context
+
+    def warn(self, code: str, message: str, offset: int | None = None, timestamp: int | None = None,
+             once: bool = False) -> None:
+        if self._context is not None and offset is None and timestamp is None:
+            offset, timestamp = self._context()
+        entry = self.entries.get(code)
+        if entry is None:
+            entry = self.entries[code] = Diagnostic(code, once)
+        entry.add(1, offset, offset, timestamp, timestamp, [message])
+
+    def merge(self, data: Dict[str, Dict[str, Any]]) -> None:
+        # warnings exported by to_dict, in order, e.g. from a checkpoint or the ranges of a parallel extraction
+        for code, values in data.items():
+            entry = self.entries.get(code)
+            if entry is None:
+                entry = self.entries[code] = Diagnostic(code, values['once'])
+            entry.add(values['count'], values['first_offset'], values['last_offset'], values['first_timestamp'],
+                      values['last_timestamp'], values['samples'])
+
+    def restore(self, data: Dict[str, Dict[str, Any]]) -> None:
+        self.entries.clear()
+        self.merge(data)
+
+    def messages(self) -> List[str]:
+        # the distinct messages, repeats are summed up in one line per code
+        lines = []
+        for entry in self.entries.values():
+            lines.extend(entry.samples)
+            if entry.count > len(entry.samples):
+                span = '' if entry.first_offset is None else f', offsets {entry.first_offset} to {entry.last_offset}'
+                lines.append(f'{entry.code} repeated {entry.count} times in total{span}.')
+        return lines
+
+    def to_dict(self) -> Dict[str, Dict[str, Any]]:
+        return {code: {k: v for k, v in asdict(entry).items() if k != 'code'} for code, entry in self.entries.items()}
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.messages())
+
+    def __len__(self) -> int:
+        return len(self.entries)
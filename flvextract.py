@@ -18,19 +18,80 @@
 # COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
 # IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import json
+import signal
+import sys
 from argparse import ArgumentParser, Namespace
 from pathlib import Path
+from types import FrameType
+from typing import List, Tuple
+from urllib.parse import urlsplit
 
-from flvfile import FLVFile
+from archive import open_archive, SPILL_BUFFER_SIZE
+from cache import ResultCache
+from flvfile import FLVFile, FOLLOW_IDLE_TIMEOUT, CHECKPOINT_INTERVAL
+from hashing import HASH_ALGORITHMS
+from interfaces import IInputSource
+from iopolicy import IOPolicy
+from server import serve, SERVER_WORKERS, SERVER_QUEUE_LIMIT
+from source import FileSource, HTTPRangeReader, PrefetchSource, RangeSource, PREFETCH_DEPTH, PREFETCH_WINDOW
 
 
 class Arguments(Namespace):
-    source_path: Path
+    source_paths: List[str]
     extract_video: bool
     extract_audio: bool
     extract_timecodes: bool
     overwrite: bool
+    fragmented_mp4: bool
+    matroska: bool
+    follow: bool
+    follow_timeout: float
+    checkpoint_interval: float
+    resume: bool
+    recover: bool
+    verify: bool
+    remux: bool
+    cut: bool
+    timing: bool
+    keyframes_only: bool
+    parallel: int
+    start: float | None
+    end: float | None
+    cache_directory: Path | None
+    cache_size: int
+    cache_full_hash: bool
+    prefetch_window: int
+    prefetch_depth: int | None
     output_directory: Path | None
+    archive_path: Path | None
+    spill_size: int
+    drop_cache: bool
+    preallocate: bool
+    warnings_json: bool
+    hash_algorithms: List[str]
+    serve_path: Path | None
+    workers: int
+    queue_limit: int
+
+
+def open_source(location: str, args: Arguments, parser: ArgumentParser) -> Tuple[Path, IInputSource]:
+    source: IInputSource
+    url = urlsplit(location)
+    if url.scheme in ('http', 'https'):
+        if not Path(url.path).name:
+            parser.error('The source URL must end with a file name')
+        source_path = (args.dir or Path.cwd()) / Path(url.path).name
+        source = RangeSource(HTTPRangeReader(location))
+        depth = args.prefetch_depth if args.prefetch_depth is not None else PREFETCH_DEPTH
+    else:
+        source_path = Path(location)
+        source = FileSource(source_path)
+        depth = args.prefetch_depth or 0
+
+    if depth > 0:
+        source = PrefetchSource(source, args.prefetch_window * 1024, depth)
+    return source_path, source
 
 
 def main() -> None:
@@ -59,6 +120,168 @@ def main() -> None:
                         help='Overwrite output files without prompting.',
                         action='store_true',
                         default=False)
+    parser.add_argument('--fmp4',
+                        dest='fragmented_mp4',
+                        help='Write AVC/AAC streams into a fragmented MP4 (CMAF) file.',
+                        action='store_true',
+                        default=False)
+    parser.add_argument('--mkv',
+                        dest='matroska',
+                        help='Write audio and video streams into a single Matroska file.',
+                        action='store_true',
+                        default=False)
+    parser.add_argument('--follow',
+                        dest='follow',
+                        help='Follow a file that is still being written, like tail -f.',
+                        action='store_true',
+                        default=False)
+    parser.add_argument('--follow-timeout',
+                        dest='follow_timeout',
+                        type=float,
+                        help=f'Seconds without growth before a followed file is finalized '
+                             f'(default: {FOLLOW_IDLE_TIMEOUT:g}).',
+                        default=FOLLOW_IDLE_TIMEOUT)
+    parser.add_argument('--checkpoint',
+                        dest='checkpoint_interval',
+                        type=float,
+                        nargs='?',
+                        const=CHECKPOINT_INTERVAL,
+                        metavar='SECONDS',
+                        help=f'Periodically save a checkpoint to resume from '
+                             f'(default: every {CHECKPOINT_INTERVAL:g}s).',
+                        default=0)
+    parser.add_argument('--resume',
+                        dest='resume',
+                        help='Resume an interrupted extraction from its last checkpoint, '
+                             'overwriting its partial outputs.',
+                        action='store_true',
+                        default=False)
+    parser.add_argument('--recover',
+                        dest='recover',
+                        help='Skip damaged regions and resynchronize on the next valid tag.',
+                        action='store_true',
+                        default=False)
+    parser.add_argument('--verify',
+                        dest='verify',
+                        help='Check the tag structure without extracting anything and print a JSON report.',
+                        action='store_true',
+                        default=False)
+    parser.add_argument('--remux',
+                        dest='remux',
+                        help='Write a copy of the source with a regenerated onMetaData keyframes index '
+                             'instead of extracting it.',
+                        action='store_true',
+                        default=False)
+    parser.add_argument('--cut',
+                        dest='cut',
+                        help='Write the tags between --start and --end into a new FLV instead of extracting them.',
+                        action='store_true',
+                        default=False)
+    parser.add_argument('--timing',
+                        dest='timing',
+                        help='Analyze audio and video timestamps and print a JSON report.',
+                        action='store_true',
+                        default=False)
+    parser.add_argument('--keyframes',
+                        dest='keyframes_only',
+                        help='Extract only the video keyframes, the payloads of the other tags are not read.',
+                        action='store_true',
+                        default=False)
+    parser.add_argument('--parallel',
+                        dest='parallel',
+                        type=int,
+                        metavar='N',
+                        help='Split a large input into N ranges extracted by separate processes.',
+                        default=0)
+    parser.add_argument('--start',
+                        dest='start',
+                        type=float,
+                        metavar='SECONDS',
+                        help='Start extracting at the last keyframe before this time.')
+    parser.add_argument('--end',
+                        dest='end',
+                        type=float,
+                        metavar='SECONDS',
+                        help='Stop extracting after this time.')
+    parser.add_argument('--cache',
+                        dest='cache_directory',
+                        type=Path,
+                        metavar='DIR',
+                        help='Reuse the outputs of inputs already extracted with the same options.')
+    parser.add_argument('--cache-size',
+                        dest='cache_size',
+                        type=int,
+                        metavar='MB',
+                        help='Maximum cache size, least recently used results are evicted (default: 10240).',
+                        default=10240)
+    parser.add_argument('--cache-full-hash',
+                        dest='cache_full_hash',
+                        help='Identify inputs by hashing all of their content instead of sampled blocks.',
+                        action='store_true',
+                        default=False)
+    parser.add_argument('--prefetch-window',
+                        dest='prefetch_window',
+                        type=int,
+                        help='Size in KB of each read-ahead window.',
+                        default=PREFETCH_WINDOW // 1024)
+    parser.add_argument('--prefetch-depth',
+                        dest='prefetch_depth',
+                        type=int,
+                        help=f'''Number of windows read ahead of the parser. Enabled by default for
+http(s) sources (depth {PREFETCH_DEPTH}), disabled for local files unless specified.''',
+                        default=None)
+    parser.add_argument('--archive',
+                        dest='archive_path',
+                        type=Path,
+                        help='Write the outputs as members of a .tar or .zip archive.',
+                        default=None)
+    parser.add_argument('--spill-size',
+                        dest='spill_size',
+                        type=int,
+                        help='''Size in MB an archive member that can't be written in place is buffered in memory
+before spilling to a temporary file.''',
+                        default=SPILL_BUFFER_SIZE // (1024 * 1024))
+    parser.add_argument('--serve',
+                        dest='serve_path',
+                        type=Path,
+                        metavar='SOCKET',
+                        help='''Run as a server extracting the JSON jobs sent to this Unix socket, one per line
+({"input": path, "output_directory": dir, "options": {"audio": true, ...}}).''',
+                        default=None)
+    parser.add_argument('--workers',
+                        dest='workers',
+                        type=int,
+                        help=f'Worker processes of the server (default: {SERVER_WORKERS}).',
+                        default=SERVER_WORKERS)
+    parser.add_argument('--queue-limit',
+                        dest='queue_limit',
+                        type=int,
+                        help=f'Jobs waiting for a worker, the next ones are rejected (default: {SERVER_QUEUE_LIMIT}).',
+                        default=SERVER_QUEUE_LIMIT)
+    parser.add_argument('--hash',
+                        dest='hash_algorithms',
+                        action='append',
+                        choices=HASH_ALGORITHMS,
+                        metavar='ALGORITHM',
+                        help=f'''Hash the outputs as they are written and print their digests and sizes as JSON,
+can be given several times ({", ".join(HASH_ALGORITHMS)}).''',
+                        default=[])
+    parser.add_argument('--warnings-json',
+                        dest='warnings_json',
+                        help='Print the warnings as JSON, by code with their count, offsets, timestamps and samples.',
+                        action='store_true',
+                        default=False)
+    parser.add_argument('--drop-cache',
+                        dest='drop_cache',
+                        help='''Read the input with sequential hints and drop the pages already read or written from
+the page cache as the extraction goes.''',
+                        action='store_true',
+                        default=False)
+    parser.add_argument('--preallocate',
+                        dest='preallocate',
+                        help='Preallocate the outputs from the stream sizes announced in onMetaData.',
+                        action='store_true',
+                        default=False)
     parser.add_argument(
         '-d',
         dest='dir',
@@ -66,20 +289,108 @@ def main() -> None:
         help='''Output directory. If not specified, output files will be written
 in the same directory as the source file.''')
 
-    parser.add_argument('source_path', type=Path, help='Source FLV File')
+    parser.add_argument('source_paths',
+                        nargs='*',
+                        metavar='source_path',
+                        help='Source FLV File or http(s) URL, several sources are concatenated in order '
+                             'into the outputs named after the first one')
     args = parser.parse_args(namespace=Arguments())
+    if args.serve_path is not None:
+        serve(args.serve_path, args.workers, args.queue_limit)
+        return
+    if not args.source_paths:
+        parser.error('the following arguments are required: source_path')
+    if args.verify and len(args.source_paths) > 1:
+        parser.error('--verify takes a single source')
+    if args.remux and len(args.source_paths) > 1:
+        parser.error('--remux takes a single source')
+    if args.cut and len(args.source_paths) > 1:
+        parser.error('--cut takes a single source')
+    if args.cut and args.start is None and args.end is None:
+        parser.error('--cut needs --start or --end')
+
+    source_path, source = open_source(args.source_paths[0], args, parser)
+    segments = [open_source(location, args, parser)[1] for location in args.source_paths[1:]]
+
+    flvFile = FLVFile(source_path, source)
+
+    if args.verify:
+        report = flvFile.verify()
+        print(json.dumps(report.to_dict(), indent=2))
+        sys.exit(0 if report.ok else 1)
 
-    flvFile = FLVFile(args.source_path)
     if args.dir is not None:
         flvFile.output_directory = args.dir
-    flvFile.extract_streams(args.extract_audio, args.extract_video, args.extract_timecodes, args.overwrite)
+    flvFile.hash_algorithms = args.hash_algorithms
+
+    if args.follow:
+        def stop(_signum: int, _frame: FrameType | None) -> None:
+            flvFile.stop()
+
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGTERM, stop)
+
+    cache = None
+    if args.cache_directory is not None:
+        cache = ResultCache(args.cache_directory, args.cache_size * 1024 * 1024, args.cache_full_hash)
 
-    print(f'True Frame Rate: {flvFile.true_framerate:g} ({flvFile.true_framerate})')
-    print(f'Average Frame Rate: {flvFile.average_framerate:g} ({flvFile.average_framerate})')
+    archive = None
+    if args.archive_path is not None:
+        archive = open_archive(args.archive_path, args.spill_size * 1024 * 1024)
+
+    io_policy = None
+    if args.drop_cache or args.preallocate:
+        io_policy = IOPolicy(args.drop_cache, args.preallocate)
+
+    try:
+        if args.remux:
+            flvFile.remux(args.overwrite, archive)
+        elif args.cut:
+            flvFile.cut(round(args.start * 1000) if args.start is not None else None,
+                        round(args.end * 1000) if args.end is not None else None, args.overwrite, archive)
+        else:
+            flvFile.extract_streams(args.extract_audio, args.extract_video, args.extract_timecodes, args.overwrite,
+                                   fragmented_mp4=args.fragmented_mp4,
+                                   matroska=args.matroska,
+                                   follow=args.follow,
+                                   follow_timeout=args.follow_timeout,
+                                   checkpoint_interval=args.checkpoint_interval,
+                                   resume=args.resume,
+                                   recover=args.recover,
+                                   start=round(args.start * 1000) if args.start is not None else None,
+                                   end=round(args.end * 1000) if args.end is not None else None,
+                                   cache=cache,
+                                   timing=args.timing,
+                                   archive=archive,
+                                   keyframes_only=args.keyframes_only,
+                                   parallel=args.parallel,
+                                   segments=segments,
+                                   io_policy=io_policy)
+    finally:
+        if archive is not None:
+            archive.close()
+
+    if flvFile.true_framerate is not None:
+        print(f'True Frame Rate: {flvFile.true_framerate:g} ({flvFile.true_framerate})')
+    if flvFile.average_framerate is not None:
+        print(f'Average Frame Rate: {flvFile.average_framerate:g} ({flvFile.average_framerate})')
     print()
 
-    for warn in flvFile.warnings:
-        print(f'Warning: {warn}')
+    if flvFile.timing is not None:
+        print(json.dumps(flvFile.timing.to_dict()))
+        print()
+
+    if args.hash_algorithms:
+        print(json.dumps({str(path): flvFile.output_digests[path].to_dict() for path in flvFile.outputs
+                          if path in flvFile.output_digests}))
+        print()
+
+    if args.warnings_json:
+        print(json.dumps(flvFile.warnings.to_dict()))
+        print()
+    else:
+        for warn in flvFile.warnings:
+            print(f'Warning: {warn}')
 
     print('Finished')
 
@@ -17,24 +17,64 @@
 # COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
 # IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+from io import TextIOWrapper
 from abc import ABC
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field, asdict
 from enum import IntEnum
 from fractions import Fraction
+from itertools import islice, pairwise
 from pathlib import Path
-from typing import List, BinaryIO, TextIO, Dict
-
-from audio import MP3Writer, WAVWriter, AACWriter, SpeexWriter
-from interfaces import IDisposable, IAudioWriter, IVideoWriter, VideoCodecID, FLVException
+from typing import Any, BinaryIO, Callable, Collection, List, TextIO, Dict, Iterator, Sequence, Tuple, cast
+
+from amf0 import read_script_data, write_script_data
+from analytics import TimingReport, analyze_timestamps, delta_histogram
+from archive import OutputArchive
+from audio import MP3Writer, WAVWriter, AACWriter, SpeexWriter, G711Writer, ADPCMWriter
+from cache import ResultCache, link_or_copy, SAMPLE_BLOCKS, SAMPLE_BLOCK_SIZE
+from checkpoint import CheckpointLog
+from diagnostics import Diagnostics
+from container import FMP4Writer, MKVWriter
+from general import OutputOpener, open_output, reopen_output, COPY_CHUNK_SIZE
+from hashing import HashingOutput, OutputDigest
+from iopolicy import IOPolicy
+from interfaces import (IDisposable, IAudioWriter, IVideoWriter, IInputSource, VideoCodecID, AudioFormat, SampleRates,
+                        FLVException)
+from metadata import FLVMetadata
+from source import FileSource
 from video import AVIWriter, RawH264Writer
 
 
+def logged_values(lists: Dict[str, List[int]], reference: Dict[str, Any]) -> List[int]:
+    # a list of the checkpoint log as a checkpoint refers to it
+    return lists.get(reference['log'], [])[:reference['length']]
+
+
 class DummyWriter:
     def write_chunk(self, data: bytes, timestamp: int | None = None, frametype: int | None = None) -> None: ...
 
+    def write_passthrough(self, *args: Any) -> bool:
+        return True
+
     def write(self, timestamp: int) -> None: ...
 
     def finish(self, average_framerate: Fraction | None = None) -> None: ...
 
+    def get_state(self) -> Dict[str, Any] | None:
+        return None
+
+    @property
+    def outputs(self) -> List[Path]:
+        return []
+
     def unlink(self) -> None: ...
 
 
@@ -44,33 +84,50 @@ class Tag(IntEnum):
     SCRIPT = 18
 
 
-class AudioFormat(IntEnum):
-    PCM = 0
-    ADPCM = 1
-    MP3 = 2
-    PCM_LE = 3
-    NELLY_16k = 4
-    NELLY_8k = 5
-    NELLYMOSER = 6
-    ALAW = 7
-    ULAW = 8
-    AAC = 10
-    SPEEX = 11
-    MP3_8k = 14
+READ_BUFFER_SIZE = 64 * 1024
+
+PASSTHROUGH_MIN_SIZE = 128 * 1024  # smaller payloads are cheaper to read than to copy with extra syscalls
+PASSTHROUGH_HEAD_SIZE = 16  # payload bytes a writer may parse (frame size, alpha offset)
+
+FOLLOW_POLL_INTERVAL = 0.25  # seconds
+FOLLOW_IDLE_TIMEOUT = 10.0  # seconds without growth before a followed file is considered complete
 
+CHECKPOINT_VERSION = 7
+CHECKPOINT_INTERVAL = 30.0  # seconds
+LOGGED_STATE = ('index', 'frame_offsets')  # writer state lists that only grow, kept in the checkpoint log
 
-SampleRates = [5512, 11025, 22050, 44100]
+PROGRESS_INTERVAL = 4 * 1024 * 1024  # input bytes between two progress reports
+
+RESYNC_WINDOW = 1024 * 1024
+RESYNC_MAX_TIMESTAMP_JUMP = 60 * 60 * 1000  # ms
+METADATA_SCAN_TAGS = 16  # onMetaData is expected among the first tags
+SEGMENT_SCAN_TAGS = 64  # codec and sequence headers of a concatenated input are checked in its first tags
+KEYFRAME_TIME_TOLERANCE = 10  # ms, keyframes tables store times as seconds
+
+MAX_VERIFY_ISSUES = 100  # issues kept in a report, all of them are counted
+
+PARALLEL_MIN_RANGE = 16 * 1024 * 1024  # smaller ranges don't pay for the worker startup and the merge
+
+# streams whose payload ends up in an output, by extension, to estimate its size for preallocation
+OUTPUT_STREAMS = {'.avi': ('video',), '.264': ('video',), '.mp3': ('audio',), '.wav': ('audio',),
+                  '.aac': ('audio',), '.spx': ('audio',), '.mp4': ('audio', 'video'), '.mkv': ('audio', 'video')}
+
+# tag type, data size, timestamp, stream id (always 0); lookahead to get overlapping candidates
+RESYNC_PATTERN = re.compile(rb'(?=[\x08\x09\x12].{7}\x00\x00\x00)', re.DOTALL)
 
 
 class TimeCodeWriter:
     _path: Path | None = None
     _fd: TextIO | None = None
 
-    def __init__(self, path: Path | None):
+    def __init__(self, path: Path | None, state: Dict[str, Any] | None = None, opener: OutputOpener = open_output):
         if path is not None:
             self._path = path
-            self._fd = self._path.open('w')
-            self._fd.write('# timecode format v2\n')
+            if state is None:
+                self._fd = TextIOWrapper(opener(self._path, False))
+                self._fd.write('# timecode format v2\n')
+            else:
+                self._fd = TextIOWrapper(reopen_output(self._path, state['size']))
 
     def write(self, timestamp: int) -> None:
         if self._fd is not None:
@@ -82,72 +139,327 @@ class TimeCodeWriter:
             self._fd = None
             self._path = None
 
+    def append_part(self, path: Path, state: Dict[str, Any]) -> None:
+        if self._fd is not None:
+            with path.open('rb') as fd:
+                fd.readline()  # timecode format header
+                fd.seek(max(fd.tell(), state['prefix']))
+                self._fd.write(fd.read(state['size'] - fd.tell()).decode())
+
+    def get_state(self) -> Dict[str, Any] | None:
+        if self._fd is None:
+            return None
+        self._fd.flush()
+        os.fsync(self._fd.fileno())
+        return {'size': self._fd.tell()}
+
+    @property
+    def outputs(self) -> List[Path]:
+        return [self._path] if self._path is not None else []
+
     def unlink(self) -> None:
         if self._path is not None:
             self._path.unlink()
 
 
+@dataclass(slots=True)
+class FLVTag:
+    tag_type: int
+    timestamp: int
+    offset: int
+    data_size: int
+    stream_id: int = 0
+    mediainfo: int = 0
+    _source: IInputSource | None = field(default=None, repr=False, compare=False)
+    _data: memoryview | None = field(default=None, repr=False, compare=False)
+
+    @property
+    def is_keyframe(self) -> bool:
+        return self.tag_type == Tag.VIDEO and (self.mediainfo >> 4) == 1
+
+    @property
+    def data(self) -> memoryview:
+        # the tag data after the header, mediainfo byte included, read on first access
+        if self._data is None:
+            assert self._source is not None
+            self._data = memoryview(self._source.read_at(self.offset + 11, self.data_size))
+        return self._data
+
+
+@dataclass
+class RangeResult:
+    stop_offset: int
+    # (mediainfo, writer state) of the streams found, the state is None when the stream isn't extracted
+    audio: Tuple[int, Dict[str, Any] | None] | None
+    video: Tuple[int, Dict[str, Any] | None] | None
+    timecodes: Dict[str, Any] | None
+    video_timestamps: array
+    audio_timestamps: array
+    audio_positions: array
+    warnings: Dict[str, Dict[str, Any]]
+    metadata: FLVMetadata | None
+
+
+@dataclass
+class VerifyIssue:
+    offset: int
+    kind: str
+    message: str
+
+
+@dataclass
+class VerifyReport:
+    path: str
+    file_size: int
+    verified_size: int = 0
+    tag_count: int = 0
+    audio_tags: int = 0
+    video_tags: int = 0
+    script_tags: int = 0
+    keyframes: int = 0
+    first_timestamp: int | None = None
+    last_timestamp: int | None = None
+    issue_counts: Dict[str, int] = field(default_factory=dict)
+    issues: List[VerifyIssue] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not self.issue_counts
+
+    def add_issue(self, offset: int, kind: str, message: str) -> None:
+        self.issue_counts[kind] = self.issue_counts.get(kind, 0) + 1
+        if len(self.issues) < MAX_VERIFY_ISSUES:
+            self.issues.append(VerifyIssue(offset, kind, message))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'ok': self.ok, **asdict(self)}
+
+
 class FLVFile(IDisposable, ABC):
     _input_path: Path
     output_directory: Path
 
     _overwrite: bool = False
-    _fd: BinaryIO | None = None
+    _source: IInputSource | None = None
+    _segments: List[IInputSource]
+    _segment_number: int = 1
+    _sequence_headers: Dict[int, bytes]
+    _timestamp_offset: int = 0
     _file_offset: int = 0
     _file_length: int = 0
+    _buffer: bytes = b''
+    _buffer_offset: int = 0
 
     _audio_writer: IAudioWriter | DummyWriter | None = None
     _video_writer: IVideoWriter | DummyWriter | None = None
     _timecode_writer: TimeCodeWriter | DummyWriter | None = None
-
-    _video_timestamps: List[int]
+    _audio_mediainfo: int = 0
+    _video_mediainfo: int = 0
+    _fmp4_writer: FMP4Writer | None = None
+    _mkv_writer: MKVWriter | None = None
+    _archive: OutputArchive | None = None
+    _io_policy: IOPolicy | None = None
+    _next_cache_drop: int = 0
+    _next_progress: int = 0
+
+    _video_timestamps: array
+    _audio_timestamps: array
+    _audio_positions: array  # audio tags read before each video tag
 
     _extract_audio: bool = False
     _extract_video: bool = False
     _extract_timecodes: bool = False
+    _fragmented_mp4: bool = False
+    _matroska: bool = False
+    _follow: bool = False
+    _follow_timeout: float = FOLLOW_IDLE_TIMEOUT
+    _stop_requested: bool = False
+    _checkpoint_interval: float = 0
+    _checkpoint_options: Dict[str, Any]
+    _checkpoint_log: CheckpointLog | None = None
+    _checkpointed: bool = False  # this run wrote or restored the checkpoint, its outputs are needed to resume
+    _next_checkpoint: float = 0
+    _recover: bool = False
+    _last_timestamp: int | None = None
+    _tag_offset: int | None = None
+    _end_timestamp: int | None = None
+    _metadata_read: bool = False
+    _output_refused: bool = False
 
     extracted_audio: bool = False
     extracted_video: bool = False
     extracted_timecodes: bool = False
 
-    average_framerate: Fraction | None
-    true_framerate: Fraction | None
+    metadata: FLVMetadata | None = None
+    timing: TimingReport | None = None
+
+    average_framerate: Fraction | None = None
+    true_framerate: Fraction | None = None
+
+    # called with the input offset and size as the extraction goes
+    progress: Callable[[int, int], None] | None = None
+    # outputs are hashed as they are written, with these hashlib algorithms
+    hash_algorithms: Sequence[str] = ()
 
-    warnings: List[str]
+    warnings: Diagnostics
+    skipped_ranges: List[Tuple[int, int]]
+    outputs: List[Path]
+    output_digests: Dict[Path, OutputDigest]
 
-    def __init__(self, input_path: Path):
+    def __init__(self, input_path: Path, source: IInputSource | None = None):
+        # with another source the input path only names the outputs
         self._input_path = input_path
         self.output_directory = self._input_path.parent
-        self.warnings = []
-        self._fd = self._input_path.open('rb')
+        self.warnings = Diagnostics(self.warning_context)
+        self.skipped_ranges = []
+        self.outputs = []
+        self.output_digests = {}
+        self._source = source if source is not None else FileSource(self._input_path)
+        self._segments = []
+        self._sequence_headers = {}
         self._file_offset = 0
-        self._file_length = self._input_path.stat().st_size
+        self._file_length = self._source.size
+
+    @property
+    def checkpoint_path(self) -> Path:
+        return self._input_path.with_suffix('.checkpoint')
 
     def dispose(self) -> None:
-        assert self._fd is not None
-        self._fd.close()
-        self._fd = None
-        self.close_output(None, True)
+        assert self._source is not None
+        self._source.close()
+        self._source = None
+        for source in self._segments:
+            source.close()
+        self._segments = []
+        # outputs are still needed to resume from a checkpoint
+        self.close_output(None, not self._checkpointed)
+        if self._checkpoint_log is not None:
+            self._checkpoint_log.close()
 
     def close(self) -> None:
         self.dispose()
 
     def extract_streams(self, extract_audio: bool, extract_video: bool, extract_timecodes: bool,
-                        overwrite: bool) -> None:
+                        overwrite: bool, fragmented_mp4: bool = False, follow: bool = False,
+                        follow_timeout: float = FOLLOW_IDLE_TIMEOUT, checkpoint_interval: float = 0,
+                        resume: bool = False, recover: bool = False, start: int | None = None,
+                        end: int | None = None, cache: ResultCache | None = None, matroska: bool = False,
+                        timing: bool = False, archive: OutputArchive | None = None,
+                        keyframes_only: bool = False, parallel: int = 0,
+                        segments: Sequence[IInputSource] = (), io_policy: IOPolicy | None = None) -> None:
         self._overwrite = overwrite
+        self._archive = archive
+        self._io_policy = io_policy
+        self._fragmented_mp4 = fragmented_mp4
+        self._matroska = matroska
+        self._follow = follow
+        self._follow_timeout = follow_timeout
+        self._stop_requested = False
         self._extract_audio = extract_audio
         self._extract_video = extract_video
         self._extract_timecodes = extract_timecodes
-        self._video_timestamps = []
-
-        self.seek(0)
-
-        assert self._fd is not None
-        if self._file_length < 4 or self._fd.read(4) != b'FLV\x01':
-            if self._file_length >= 8 and self._fd.read(4) == b'ftyp':
-                raise FLVException('This is a MP4 file. YAMB or MP4Box can be used to extract streams.')
-            else:
-                raise FLVException('Not a flv file')
+        self._checkpoint_interval = checkpoint_interval
+        self._recover = recover
+        self._last_timestamp = None
+        self._end_timestamp = end
+        self._video_timestamps = array('q')
+        self._audio_timestamps = array('q')
+        self._audio_positions = array('q')
+        self._segments = list(segments)
+        self._segment_number = 1
+        self._sequence_headers = {}
+        self._timestamp_offset = 0
+        self.outputs = []
+        self.output_digests = {}
+        self.timing = None
+        self._output_refused = False
+        self._checkpointed = False
+
+        if self._segments:
+            if self._checkpoint_interval or resume:
+                self.option_disabled('Checkpoints are not supported with concatenated inputs, disabled.')
+                self._checkpoint_interval = 0
+                resume = False
+            if self._follow:
+                self.option_disabled('Follow mode is not supported with concatenated inputs, disabled.')
+                self._follow = False
+            if start is not None:
+                self.option_disabled('A start time is not supported with concatenated inputs, ignored.')
+                start = None
+            if keyframes_only:
+                self.option_disabled('Keyframe-only mode is not supported with concatenated inputs, disabled.')
+                keyframes_only = False
+        if self._fragmented_mp4 and self._checkpoint_interval:
+            self.option_disabled('Checkpoints are not supported with fragmented MP4 output, disabled.')
+            self._checkpoint_interval = 0
+        if self._matroska and self._checkpoint_interval:
+            self.option_disabled('Checkpoints are not supported with Matroska output, disabled.')
+            self._checkpoint_interval = 0
+        if self._archive is not None and self._checkpoint_interval:
+            self.option_disabled('Checkpoints are not supported with archive output, disabled.')
+            self._checkpoint_interval = 0
+        if self.hash_algorithms and (self._checkpoint_interval or resume):
+            # the outputs reopened when resuming weren't hashed
+            self.option_disabled('Checkpoints are not supported with output hashing, disabled.')
+            self._checkpoint_interval = 0
+            resume = False
+        if keyframes_only:
+            if self._checkpoint_interval:
+                self.option_disabled('Checkpoints are not supported in keyframe-only mode, disabled.')
+                self._checkpoint_interval = 0
+            if self._follow:
+                self.option_disabled('Follow mode is not supported in keyframe-only mode, disabled.')
+                self._follow = False
+            if self._extract_audio:
+                self.option_disabled('Audio is not extracted in keyframe-only mode.')
+        if io_policy is not None and io_policy.preallocate and archive is not None:
+            self.option_disabled('Preallocation is not supported with archive output, disabled.')
+        if parallel > 1:
+            unsupported = [name for name, enabled in (
+                ('follow mode', self._follow), ('checkpoints', self._checkpoint_interval or resume),
+                ('recovery', recover), ('a start or end time', start is not None or end is not None),
+                ('fragmented MP4 output', fragmented_mp4), ('Matroska output', matroska),
+                ('archive output', archive is not None), ('keyframe-only mode', keyframes_only),
+                ('a remote input', not isinstance(self._source, FileSource)),
+                ('concatenated inputs', bool(self._segments))) if enabled]
+            if unsupported:
+                self.option_disabled(f'Parallel extraction is not supported with {", ".join(unsupported)}, disabled.')
+                parallel = 0
+
+        # a checkpoint is only resumed with the options that wrote it
+        self._checkpoint_options = {'audio': extract_audio, 'video': extract_video, 'timecodes': extract_timecodes,
+                                    'fragmented_mp4': fragmented_mp4, 'matroska': matroska, 'recover': recover,
+                                    'start': start, 'end': end}
+        self._checkpoint_log = CheckpointLog(self.checkpoint_path.with_name(self.checkpoint_path.name + '.log'))
+        checkpoint: Dict[str, Any] | None = None
+        if resume and self.checkpoint_path.exists():
+            with self.checkpoint_path.open('r') as fd:
+                checkpoint = json.load(fd)
+            if not self._checkpoint_interval:
+                self._checkpoint_interval = CHECKPOINT_INTERVAL
+        else:
+            if resume:
+                self.option_disabled('No checkpoint to resume from, extracting from the start.')
+            # a checkpoint left by another run doesn't match the outputs this one writes
+            self.checkpoint_path.unlink(missing_ok=True)
+            self._checkpoint_log.unlink()
+
+        # a growing or partially extracted input can't be cached
+        cache_key: str | None = None
+        if (cache is not None and not follow and checkpoint is None and archive is None and not self._segments
+                and isinstance(self._source, FileSource)):
+            options = {'audio': extract_audio, 'video': extract_video, 'timecodes': extract_timecodes,
+                       'fragmented_mp4': fragmented_mp4, 'matroska': matroska, 'recover': recover, 'start': start,
+                       'end': end, 'timing': timing, 'keyframes_only': keyframes_only}
+            cache_key = cache.key(self._input_path, options)
+            if self.load_cached_result(cache, cache_key):
+                return
+
+        self.read_header()
+        if self._io_policy is not None:
+            assert self._source is not None
+            self._io_policy.open_input(self._source.fileno)
+            self._next_cache_drop = self._io_policy.drop_interval
 
         # TODO: check if the input uses an output file extension
         # Please change the extension of this FLV file.
@@ -161,19 +473,874 @@ class FLVFile(IDisposable, ABC):
         self.seek(data_offset)
 
         _prev_tag_size = self.read_uint32()
-        while self._file_offset < self._file_length:
-            if not self.read_tag():
-                break
-            if (self._file_length - self._file_offset) < 4:
+        if self._segments:
+            self.check_segment(self._file_offset)
+        sequential = not (parallel > 1 and self.extract_parallel(data_offset, parallel))
+        if keyframes_only:
+            self.read_keyframes(start)
+        elif checkpoint is not None:
+            self.restore_checkpoint(checkpoint)
+        elif start is not None:
+            self.seek_to_time(start)
+
+        self._next_checkpoint = time.monotonic() + self._checkpoint_interval
+        self._next_progress = 0
+        while True:
+            while sequential and not self._stop_requested and not keyframes_only:
+                if not self.read_tag():
+                    break
+                if not self.wait_for_data(4):
+                    break
+                _prev_tag_size = self.read_uint32()
+                if self._checkpoint_interval and time.monotonic() >= self._next_checkpoint:
+                    self.write_checkpoint()
+                    self._next_checkpoint = time.monotonic() + self._checkpoint_interval
+                if self._io_policy is not None and self._file_offset >= self._next_cache_drop:
+                    self.drop_cache()
+                if self.progress is not None and self._file_offset >= self._next_progress:
+                    self.progress(self._file_offset, self._file_length)
+                    self._next_progress = self._file_offset + PROGRESS_INTERVAL
+            if self._stop_requested or not self._segments:
                 break
-            _prev_tag_size = self.read_uint32()
+            self.open_segment(self._segments.pop(0))
 
         self.average_framerate = self.calculate_average_framerate()
         self.true_framerate = self.calculate_true_framerate()
+        if timing:
+            self.timing = analyze_timestamps(self._video_timestamps, self._audio_timestamps, self._audio_positions)
 
         self.close_output(self.average_framerate, False)
+        self.checkpoint_path.unlink(missing_ok=True)
+        self._checkpoint_log.unlink()
+        self._checkpointed = False
+        if self._io_policy is not None:
+            self.drop_cache()
+
+        # outputs left as they were aren't part of the result, the entry would miss them
+        if cache is not None and cache_key is not None and not self._stop_requested and not self._output_refused:
+            self.store_cached_result(cache, cache_key)
+
+    def warning_context(self) -> Tuple[int | None, int | None]:
+        # warnings raised by the writers are about the tag being read
+        return self._tag_offset, self._last_timestamp
+
+    def option_disabled(self, message: str) -> None:
+        self.warnings.warn('option_disabled', message, once=True)
+
+    def read_header(self) -> None:
+        self.seek(0)
+
+        self.wait_for_data(9)
+        if self._file_length < 4 or self.read_bytes(4) != b'FLV\x01':
+            if self._file_length >= 8 and self.read_bytes(4) == b'ftyp':
+                raise FLVException('This is a MP4 file. YAMB or MP4Box can be used to extract streams.')
+            else:
+                raise FLVException('Not a flv file')
+
+    def open_segment(self, source: IInputSource) -> None:
+        # the next input of a concatenation continues the writers of the previous ones
+        assert self._source is not None
+        if self._io_policy is not None:
+            self.drop_cache()
+        self._source.close()
+        self._source = source
+        self._file_length = self._source.size
+        self._buffer = b''
+        self._buffer_offset = 0
+        self._next_progress = 0
+        if self._io_policy is not None:
+            self._io_policy.open_input(self._source.fileno)
+            self._next_cache_drop = self._io_policy.drop_interval
+        self._segment_number += 1
+
+        self.read_header()
+        _flags = self.read_uint8()
+        self.seek(self.read_uint32())
+        _prev_tag_size = self.read_uint32()
+
+        # recorders usually restart the timestamps in each input, its first frame is then rebased one frame
+        # after the last one of the previous input, following the video when there is one
+        first_timestamps = self.check_segment(self._file_offset)
+        for tag_type, timestamps in ((Tag.VIDEO, self._video_timestamps), (Tag.AUDIO, self._audio_timestamps)):
+            if tag_type in first_timestamps and len(timestamps) > 0:
+                if first_timestamps[tag_type] + self._timestamp_offset <= timestamps[-1]:
+                    frame_duration = timestamps[-1] - timestamps[-2] if len(timestamps) > 1 else 0
+                    self._timestamp_offset = timestamps[-1] + frame_duration - first_timestamps[tag_type]
+                break
+
+    def check_segment(self, offset: int) -> Dict[int, int]:
+        # returns the first timestamp of each tag type in the input
+        assert self._source is not None
+        first_timestamps: Dict[int, int] = {}
+        for tag_offset, tag_type, data_size, timestamp, mediainfo in islice(self.iter_tag_headers(offset),
+                                                                            SEGMENT_SCAN_TAGS):
+            if tag_type == Tag.SCRIPT or data_size == 0 or (tag_type == Tag.VIDEO and (mediainfo >> 4) == 5):
+                continue
+            first_timestamps.setdefault(tag_type, timestamp)
+
+            if tag_type == Tag.AUDIO and self.extracted_audio:
+                # WAV has a single format header, other formats only need the same codec
+                if ((mediainfo >> 4) != (self._audio_mediainfo >> 4)
+                        or (isinstance(self._audio_writer, WAVWriter) and mediainfo != self._audio_mediainfo)):
+                    raise FLVException(f'Segment {self._segment_number} changes the audio format')
+            if tag_type == Tag.VIDEO and self.extracted_video:
+                if (mediainfo & 0x0f) != (self._video_mediainfo & 0x0f):
+                    raise FLVException(f'Segment {self._segment_number} changes the video codec')
+
+            if self.is_config_tag(tag_offset):
+                header = self._source.read_at(tag_offset + 11, data_size)
+                previous = self._sequence_headers.get(tag_type)
+                if previous is not None and header != previous:
+                    codec = 'AVC' if tag_type == Tag.VIDEO else 'AAC'
+                    self.warnings.warn('segment_sequence_header',
+                                       f'Segment {self._segment_number} changes the {codec} sequence header.')
+                self._sequence_headers[tag_type] = header
+        return first_timestamps
+
+    def extract_parallel(self, data_offset: int, workers: int) -> bool:
+        # each worker extracts a range of whole tags, the outputs are then stitched in order
+        start = data_offset + 4
+        workers = min(workers, (self._file_length - start) // PARALLEL_MIN_RANGE)
+        if workers < 2:
+            return False
+        boundaries = [start]
+        for index in range(1, workers):
+            offset = self.find_tag_boundary(max(start + (self._file_length - start) * index // workers,
+                                                boundaries[-1] + 1))
+            if offset is None:
+                break
+            boundaries.append(offset)
+        boundaries.append(self._file_length)
+        if len(boundaries) < 3:
+            return False
+
+        options = {'audio': self._extract_audio, 'video': self._extract_video, 'timecodes': self._extract_timecodes}
+        part_dir = Path(tempfile.mkdtemp(prefix='.parts-', dir=self._input_path.parent))
+        try:
+            with ProcessPoolExecutor(len(boundaries) - 1) as executor:
+                futures = [executor.submit(extract_range, self._input_path, part_dir / f'{index}.flv', data_offset,
+                                           begin, end, options)
+                           for index, (begin, end) in enumerate(pairwise(boundaries))]
+                results = [future.result() for future in futures]
+
+            # a boundary found inside a payload makes the range before it overrun its end
+            if any(result.stop_offset != end for result, end in zip(results, boundaries[1:-1])):
+                self.warnings.warn('parallel_split',
+                                   'Unable to split the input at tag boundaries, extracting sequentially.', once=True)
+                return False
+            for index, result in enumerate(results):
+                self.merge_range(part_dir / f'{index}.flv', result)
+        finally:
+            shutil.rmtree(part_dir, ignore_errors=True)
+
+        self.seek(self._file_length)
+        return True
+
+    def extract_range(self, data_offset: int, start: int, end: int, audio: bool, video: bool,
+                      timecodes: bool) -> RangeResult:
+        self._extract_audio = audio
+        self._extract_video = video
+        self._extract_timecodes = timecodes
+        self._video_timestamps = array('q')
+        self._audio_timestamps = array('q')
+        self._audio_positions = array('q')
+
+        # the sequence headers at the start of the file set up the writers of every range, their output is
+        # already in the first range and is left out of the others
+        self.seek(data_offset + 4)
+        while self._file_offset < start and self.is_config_tag(self._file_offset):
+            if not self.read_tag() or not self.wait_for_data(4):
+                break
+            self.read_uint32()
+        self.reset_statistics()
+        writers = (self._audio_writer, self._video_writer, self._timecode_writer)
+        prefixes = []
+        for writer in writers:
+            state = writer.get_state() if writer is not None else None
+            prefixes.append(state['size'] if state is not None else 0)
+
+        self.seek(start)
+        while self._file_offset < end:
+            if not self.read_tag():
+                break
+            if not self.wait_for_data(4):
+                break
+            _prev_tag_size = self.read_uint32()
+
+        states: List[Dict[str, Any] | None] = []
+        for writer, prefix in zip((self._audio_writer, self._video_writer, self._timecode_writer), prefixes):
+            state = writer.get_state() if writer is not None else None
+            if state is not None:
+                state['prefix'] = prefix
+            states.append(state)
+        audio_state, video_state, timecode_state = states
+
+        assert self._source is not None
+        self._source.close()
+        self._source = None
+        return RangeResult(
+            stop_offset=self._file_offset,
+            audio=None if self._audio_writer is None else (self._audio_mediainfo, audio_state),
+            video=None if self._video_writer is None else (self._video_mediainfo, video_state),
+            timecodes=timecode_state,
+            video_timestamps=self._video_timestamps,
+            audio_timestamps=self._audio_timestamps,
+            audio_positions=self._audio_positions,
+            warnings=self.warnings.to_dict(),
+            metadata=self.metadata,
+        )
+
+    def merge_range(self, part_path: Path, result: RangeResult) -> None:
+        if result.audio is not None:
+            mediainfo, state = result.audio
+            if self._audio_writer is None:
+                self._audio_mediainfo = mediainfo
+                self._audio_writer = self.get_audio_writer(mediainfo) if self._extract_audio else DummyWriter()
+                self.extracted_audio = not isinstance(self._audio_writer, DummyWriter)
+            elif (mediainfo >> 4) != (self._audio_mediainfo >> 4):
+                raise FLVException('Audio format changes between ranges')
+            self.append_part(self._audio_writer, part_path, state)
+
+        if result.video is not None:
+            mediainfo, state = result.video
+            if self._video_writer is None:
+                self._video_mediainfo = mediainfo
+                self._video_writer = self.get_video_writer(mediainfo) if self._extract_video else DummyWriter()
+                self.extracted_video = not isinstance(self._video_writer, DummyWriter)
+            elif (mediainfo & 0x0f) != (self._video_mediainfo & 0x0f):
+                raise FLVException('Video codec changes between ranges')
+            if self._timecode_writer is None:
+                path = self._input_path.with_suffix('.txt')
+                self._timecode_writer = TimeCodeWriter(
+                    path if self._extract_timecodes and self.can_write_to(path) else None, opener=self.open_output)
+            self.append_part(self._video_writer, part_path, state)
+            self.append_part(self._timecode_writer, part_path, result.timecodes)
+
+        # the audio positions of a range count from its first audio tag
+        self._audio_positions.extend(position + len(self._audio_timestamps) for position in result.audio_positions)
+        self._video_timestamps.extend(result.video_timestamps)
+        self._audio_timestamps.extend(result.audio_timestamps)
+        # every range reports the same issues of the stream (e.g. an unsupported codec), they are counted once
+        self.warnings.merge(result.warnings)
+        if self.metadata is None:
+            self.metadata = result.metadata
+
+    def append_part(self, writer: IAudioWriter | IVideoWriter | TimeCodeWriter | DummyWriter, part_path: Path,
+                    state: Dict[str, Any] | None) -> None:
+        if isinstance(writer, DummyWriter) or state is None or not writer.outputs:
+            return
+        writer.append_part(part_path.with_name(part_path.stem + self.output_name(writer.outputs[0])), state)
+
+    def output_name(self, path: Path) -> str:
+        # outputs are named after the input, e.g. '.264' or '.alpha.avi'
+        return path.name[len(self._input_path.stem):]
+
+    def load_cached_result(self, cache: ResultCache, key: str) -> bool:
+        cached = cache.lookup(key)
+        if cached is None:
+            return False
+        entry, result = cached
+        if not isinstance(result['warnings'], dict):
+            return False  # stored by a version that kept warnings as a list
+        digests = result.get('digests', {})
+        if self.hash_algorithms and not all(name in digests and all(algorithm in digests[name]
+                                                                    for algorithm in self.hash_algorithms)
+                                            for name in result['outputs']):
+            return False  # stored without the digests asked for, they are stored along with the new outputs
+
+        targets = [(name, self._input_path.with_name(self._input_path.stem + name)) for name in result['outputs']]
+        if not all(self.can_write_to(path) for _, path in targets):
+            return False
+        for name, path in targets:
+            link_or_copy(entry / f'output{name}', path)
+
+        self.outputs = [path for _, path in targets]
+        if self.hash_algorithms:
+            self.output_digests = {path: OutputDigest(digests[name]['size'], {algorithm: digests[name][algorithm]
+                                                                              for algorithm in self.hash_algorithms})
+                                   for name, path in targets}
+        self.average_framerate = Fraction(result['average_framerate']) if result['average_framerate'] else None
+        self.true_framerate = Fraction(result['true_framerate']) if result['true_framerate'] else None
+        self.extracted_audio = result['extracted_audio']
+        self.extracted_video = result['extracted_video']
+        self.skipped_ranges = [(start, end) for start, end in result['skipped_ranges']]
+        self.warnings.merge(result['warnings'])
+        self.timing = TimingReport.from_dict(result['timing']) if result['timing'] is not None else None
+        return True
+
+    def store_cached_result(self, cache: ResultCache, key: str) -> None:
+        result = {
+            'average_framerate': str(self.average_framerate) if self.average_framerate is not None else None,
+            'true_framerate': str(self.true_framerate) if self.true_framerate is not None else None,
+            'extracted_audio': self.extracted_audio,
+            'extracted_video': self.extracted_video,
+            'skipped_ranges': self.skipped_ranges,
+            'warnings': self.warnings.to_dict(),
+            'timing': self.timing.to_dict() if self.timing is not None else None,
+            'digests': {self.output_name(path): self.output_digests[path].to_dict() for path in self.outputs
+                        if path in self.output_digests},
+        }
+        cache.store(key, [(self.output_name(path), path) for path in self.outputs], result)
+
+    def get_data_offset(self) -> int:
+        assert self._source is not None
+        header = self._source.read_at(0, 9)
+        if len(header) < 9 or header[:4] != b'FLV\x01':
+            raise FLVException('Not a flv file')
+        return int.from_bytes(header[5:9], 'big')
+
+    def read_tag_header(self, offset: int) -> Tuple[int, int, int, int] | None:
+        # (tag type, data size, timestamp, mediainfo) of a complete tag, None if there is none at offset
+        assert self._source is not None
+        header = self._source.read_at(offset, 12)
+        if len(header) < 11:
+            return None
+        tag_type = header[0]
+        data_size = int.from_bytes(header[1:4], 'big')
+        if tag_type not in (Tag.AUDIO, Tag.VIDEO, Tag.SCRIPT) or (offset + 11 + data_size) > self._file_length:
+            return None
+        timestamp = int.from_bytes(header[4:7], 'big') | (header[7] << 24)
+        return tag_type, data_size, timestamp, header[11] if data_size > 0 else 0
+
+    def tags(self, types: Collection[int] | None = None, data: bool = False) -> Iterator[FLVTag]:
+        # every tag of the file in order, the data of the tags is only read when asked for (or accessed);
+        # iterating moves the file offset, it can't be interleaved with an extraction
+        self.seek(self.get_data_offset() + 4)
+        while (self._file_length - self._file_offset) >= 11:
+            tag = self.read_tag_record()
+            if (tag.tag_type not in (Tag.AUDIO, Tag.VIDEO, Tag.SCRIPT)
+                    or (tag.offset + 11 + tag.data_size) > self._file_length):
+                return
+            end = tag.offset + 11 + tag.data_size + 4
+            if types is None or tag.tag_type in types:
+                if data:
+                    self.read_tag_data(tag)
+                elif tag.data_size > 0:
+                    tag.mediainfo = self.read_uint8()
+                    tag._source = self._source
+                yield tag
+            self.seek(end)
+
+    def read_tag_record(self) -> FLVTag:
+        # header of the tag at the file offset, the offset moves to its data
+        offset = self._file_offset
+        header = self.read_view(11)
+        timestamp = (int.from_bytes(header[4:7], 'big') | (header[7] << 24)) + self._timestamp_offset
+        return FLVTag(header[0], timestamp, offset, int.from_bytes(header[1:4], 'big'),
+                      int.from_bytes(header[8:11], 'big'))
+
+    def read_tag_data(self, tag: FLVTag) -> memoryview:
+        # the data of a tag read with read_tag_record, from the read buffer when it holds it
+        tag._data = self.read_view(tag.data_size)
+        tag.mediainfo = tag._data[0] if tag.data_size > 0 else 0
+        return tag._data
+
+    def iter_tag_headers(self, offset: int) -> Iterator[Tuple[int, int, int, int, int]]:
+        # (offset, tag type, data size, timestamp, mediainfo) of each tag, payloads are skipped
+        while (self._file_length - offset) >= 11:
+            header = self.read_tag_header(offset)
+            if header is None:
+                return
+            tag_type, data_size, timestamp, mediainfo = header
+            yield offset, tag_type, data_size, timestamp, mediainfo
+            offset += 11 + data_size + 4
+
+    def read_metadata(self) -> FLVMetadata | None:
+        if self.metadata is None and not self._metadata_read:
+            self._metadata_read = True
+            assert self._source is not None
+            headers = self.iter_tag_headers(self.get_data_offset() + 4)
+            for offset, tag_type, data_size, _timestamp, _mediainfo in islice(headers, METADATA_SCAN_TAGS):
+                if tag_type == Tag.SCRIPT:
+                    self.read_script_tag(self._source.read_at(offset + 11, data_size))
+                    if self.metadata is not None:
+                        break
+        return self.metadata
+
+    def read_script_tag(self, data: bytes) -> None:
+        # a malformed script tag is as good as missing, it doesn't stop the extraction
+        try:
+            name, value = read_script_data(data)
+            if name == 'onMetaData' and self.metadata is None:
+                self.metadata = FLVMetadata.from_script_data(value)
+        except (FLVException, ValueError, OverflowError, RecursionError) as e:
+            self.warnings.warn('invalid_script_tag', f'Invalid script tag: {e}')
+
+    def find_keyframe(self, timestamp: int) -> int | None:
+        # offset of the last video keyframe at or before timestamp (ms), None if there is none
+        metadata = self.read_metadata()
+        if metadata is not None and metadata.keyframe_positions:
+            index = metadata.find_keyframe(timestamp)
+            if index is None:
+                return None
+            offset = metadata.keyframe_positions[index]
+            if self.is_keyframe_at(offset, round(metadata.keyframe_times[index] * 1000)):
+                return offset
+            self.warnings.warn('keyframes_table', 'Keyframes table does not match the file, scanning for keyframes.',
+                               once=True)
+            metadata.keyframe_times, metadata.keyframe_positions = [], []
+        return self.scan_keyframe(timestamp)
+
+    def is_keyframe_at(self, offset: int, timestamp: int) -> bool:
+        return self.is_keyframe_header(self.read_tag_header(offset), timestamp)
+
+    @staticmethod
+    def is_keyframe_header(header: Tuple[int, int, int, int] | None, timestamp: int) -> bool:
+        if header is None or header[0] != Tag.VIDEO or (header[3] >> 4) != 1:
+            return False
+        return abs(header[2] - timestamp) <= KEYFRAME_TIME_TOLERANCE
+
+    def scan_keyframe(self, timestamp: int) -> int | None:
+        keyframe = None
+        for offset, tag_type, _data_size, tag_timestamp, mediainfo in self.iter_tag_headers(self.get_data_offset() + 4):
+            if tag_type != Tag.VIDEO:
+                continue
+            if tag_timestamp > timestamp:
+                break
+            if (mediainfo >> 4) == 1:
+                keyframe = offset
+        return keyframe
+
+    def iter_keyframe_tags(self) -> Iterator[Tuple[int, int, int]]:
+        # (offset, data size, timestamp) of the video keyframes and sequence headers (also tagged as keyframes),
+        # from the keyframes table when there is one, tag headers are scanned otherwise
+        offset = self.get_data_offset() + 4
+        metadata = self.read_metadata()
+        if metadata is not None:
+            for index, (time_, position) in enumerate(zip(metadata.keyframe_times, metadata.keyframe_positions)):
+                header = self.read_tag_header(position) if position >= offset else None
+                if not self.is_keyframe_header(header, round(time_ * 1000)):
+                    self.warnings.warn('keyframes_table',
+                                       'Keyframes table does not match the file, scanning for keyframes.', once=True)
+                    break
+                assert header is not None
+                if index == 0:
+                    # sequence headers come before the first keyframe
+                    yield from self.scan_keyframe_tags(offset, position)
+                yield position, header[1], header[2]
+                offset = position + 11 + header[1] + 4
+        # keyframes written after the table, e.g. by a recorder that didn't update it
+        yield from self.scan_keyframe_tags(offset)
+
+    def scan_keyframe_tags(self, offset: int, end: int | None = None) -> Iterator[Tuple[int, int, int]]:
+        for tag_offset, tag_type, data_size, timestamp, mediainfo in self.iter_tag_headers(offset):
+            if end is not None and tag_offset >= end:
+                return
+            if tag_type == Tag.VIDEO and (mediainfo >> 4) == 1:
+                yield tag_offset, data_size, timestamp
+
+    def read_keyframes(self, start: int | None) -> None:
+        assert self._source is not None
+        for offset, data_size, timestamp in self.iter_keyframe_tags():
+            if self._stop_requested:
+                break
+            before_start = start is not None and timestamp < start
+            if before_start and not self.is_config_tag(offset):
+                continue
+            # one read per tag, the payloads of the other tags are never read
+            self._buffer = self._source.read_at(offset, 11 + data_size)
+            self._buffer_offset = offset
+            self.seek(offset)
+            if not self.read_tag():
+                break
+            if before_start:
+                self.reset_statistics()
+
+    def is_config_tag(self, offset: int) -> bool:
+        # metadata and codec sequence headers needed by the writers whatever the start position
+        assert self._source is not None
+        header = self._source.read_at(offset, 13)
+        if len(header) < 13:
+            return False
+        match header[0]:
+            case Tag.SCRIPT:
+                return True
+            case Tag.VIDEO:
+                return (header[11] & 0x0f) == VideoCodecID.AVC and header[12] == 0
+            case Tag.AUDIO:
+                return (header[11] >> 4) == AudioFormat.AAC and header[12] == 0
+        return False
+
+    def seek_to_time(self, timestamp: int) -> None:
+        offset = self.find_keyframe(timestamp)
+        if offset is None or offset <= self._file_offset:
+            return
+
+        while self._file_offset < offset and self.is_config_tag(self._file_offset):
+            if not self.read_tag() or not self.wait_for_data(4):
+                return
+            self.read_uint32()
+        self.reset_statistics()
+        self.seek(offset)
+
+    def reset_statistics(self) -> None:
+        # sequence headers read before a start position would skew the frame rate statistics of the range
+        del self._video_timestamps[:]
+        del self._audio_timestamps[:]
+        del self._audio_positions[:]
+
+    def verify(self) -> VerifyReport:
+        # walks tag headers and PreviousTagSize only, payloads are never read
+        assert self._source is not None
+        report = VerifyReport(path=str(self._input_path), file_size=self._file_length)
+
+        header = self._source.read_at(0, 13)
+        if len(header) < 13 or header[:4] != b'FLV\x01':
+            report.add_issue(0, 'signature', 'Not a flv file')
+            return report
+
+        data_offset = int.from_bytes(header[5:9], 'big')
+        if not 9 <= data_offset <= self._file_length - 4:
+            report.add_issue(5, 'header', f'Invalid data offset {data_offset}')
+            return report
+
+        chunk = self._source.read_at(data_offset, 4 + 13)
+        if int.from_bytes(chunk[:4], 'big') != 0:
+            report.add_issue(data_offset, 'prev_tag_size', 'First PreviousTagSize is not 0')
+
+        offset = data_offset + 4
+        last_timestamps: Dict[int, int] = {}
+        while (self._file_length - offset) >= 11:
+            # chunk holds the header of the tag at offset (and its first two payload bytes)
+            tag_type = chunk[4]
+            data_size = int.from_bytes(chunk[5:8], 'big')
+            timestamp = int.from_bytes(chunk[8:11], 'big') | (chunk[11] << 24)
+            stream_id = int.from_bytes(chunk[12:15], 'big')
+
+            if tag_type & 0xe0 or tag_type not in (Tag.AUDIO, Tag.VIDEO, Tag.SCRIPT):
+                report.add_issue(offset, 'tag_type', f'Encrypted or invalid tag type {tag_type}')
+                break
+            if stream_id != 0:
+                report.add_issue(offset, 'stream_id', f'Stream id is {stream_id}, expected 0')
+
+            end = offset + 11 + data_size
+            if end > self._file_length:
+                report.add_issue(offset, 'truncated', f'Tag needs {end - self._file_length} bytes past end of file')
+                break
+
+            if tag_type in last_timestamps and timestamp < last_timestamps[tag_type]:
+                report.add_issue(offset, 'timestamp', f'Timestamp {timestamp} < {last_timestamps[tag_type]}')
+            last_timestamps[tag_type] = timestamp
+            if report.first_timestamp is None:
+                report.first_timestamp = timestamp
+            report.last_timestamp = timestamp
+
+            report.tag_count += 1
+            match tag_type:
+                case Tag.AUDIO:
+                    report.audio_tags += 1
+                case Tag.VIDEO:
+                    report.video_tags += 1
+                    # AVC sequence headers are flagged as keyframes too, they aren't in the keyframes index
+                    if (data_size > 0 and (chunk[15] >> 4) == 1
+                            and not ((chunk[15] & 0x0f) == VideoCodecID.AVC and data_size > 1 and chunk[16] == 0)):
+                        report.keyframes += 1
+                case Tag.SCRIPT:
+                    report.script_tags += 1
+
+            # PreviousTagSize of this tag plus the next tag header in a single read
+            chunk = self._source.read_at(end, 4 + 13)
+            if len(chunk) < 4:
+                report.add_issue(end, 'truncated', 'Missing PreviousTagSize after last tag')
+                offset = end
+                break
+            prev_tag_size = int.from_bytes(chunk[:4], 'big')
+            if prev_tag_size != data_size + 11:
+                report.add_issue(end, 'prev_tag_size', f'PreviousTagSize is {prev_tag_size}, expected {data_size + 11}')
+            offset = end + 4
+
+        stopped = 'tag_type' in report.issue_counts or 'truncated' in report.issue_counts
+        if offset < self._file_length and not stopped:
+            report.add_issue(offset, 'trailing', f'{self._file_length - offset} trailing bytes after last tag')
+        report.verified_size = min(offset, self._file_length)
+        return report
+
+    def remux(self, overwrite: bool, archive: OutputArchive | None = None) -> None:
+        # copy of the input with a regenerated onMetaData holding the keyframes index
+        assert self._source is not None
+        self._overwrite = overwrite
+        self._archive = archive
+        path = self._input_path.with_suffix('.indexed.flv')
+        if not self.can_write_to(path):
+            self.warnings.warn('output_exists', f'{path.name} already exists, skipped.', once=True)
+            return
+
+        # first pass over the tag headers: the ranges copied verbatim, everything but the old onMetaData tags,
+        # and the keyframes at their offset in the copied data
+        data_offset = self.get_data_offset()
+        metadata = self.read_metadata()
+        ranges: List[Tuple[int, int]] = []
+        keyframes: List[Tuple[int, int]] = []
+        audio_mediainfo: int | None = None
+        video_mediainfo: int | None = None
+        last_timestamp = 0
+        copied = 0
+        start = end = data_offset + 4
+        for offset, tag_type, data_size, timestamp, mediainfo in self.iter_tag_headers(data_offset + 4):
+            end = min(offset + 11 + data_size + 4, self._file_length)
+            if tag_type == Tag.SCRIPT:
+                if self._source.read_at(offset + 11, 13) == b'\x02\x00\x0aonMetaData':
+                    ranges.append((start, offset))
+                    copied += offset - start
+                    start = end
+                continue
+            if data_size == 0 or (tag_type == Tag.VIDEO and (mediainfo >> 4) == 5):
+                continue
+            last_timestamp = max(last_timestamp, timestamp)
+            if tag_type == Tag.AUDIO and audio_mediainfo is None:
+                audio_mediainfo = mediainfo
+            if tag_type == Tag.VIDEO:
+                if video_mediainfo is None:
+                    video_mediainfo = mediainfo
+                if (mediainfo >> 4) == 1 and not self.is_config_tag(offset):
+                    keyframes.append((copied + offset - start, timestamp))
+        ranges.append((start, end))
+        copied += end - start
+        if end < self._file_length:
+            self.warnings.warn('trailing_bytes',
+                               f'Dropped {self._file_length - end} trailing bytes after the last tag.')
+
+        properties = dict(metadata.properties) if metadata is not None else {}
+        properties.update({
+            'hasMetadata': True,
+            'hasAudio': audio_mediainfo is not None,
+            'hasVideo': video_mediainfo is not None,
+            'hasKeyframes': len(keyframes) > 0,
+            'duration': last_timestamp / 1000,
+            'lasttimestamp': last_timestamp / 1000,
+            'lastkeyframetimestamp': keyframes[-1][1] / 1000 if keyframes else 0.0,
+        })
+        if video_mediainfo is not None:
+            properties['videocodecid'] = float(video_mediainfo & 0x0f)
+        if audio_mediainfo is not None:
+            properties['audiocodecid'] = float(audio_mediainfo >> 4)
+            properties['audiosamplerate'] = float(SampleRates[(audio_mediainfo >> 2) & 0x3])
+            properties['audiosamplesize'] = 16.0 if audio_mediainfo & 0x2 else 8.0
+            properties['stereo'] = bool(audio_mediainfo & 0x1)
+
+        def script_tag(base: int) -> bytes:
+            properties['filesize'] = float(base + copied)
+            properties['keyframes'] = {
+                'times': [timestamp / 1000 for _, timestamp in keyframes],
+                'filepositions': [float(base + position) for position, _ in keyframes],
+            }
+            data = write_script_data('onMetaData', properties)
+            tag_header = bytes([Tag.SCRIPT]) + len(data).to_bytes(3, 'big') + bytes(7)  # timestamp, stream id 0
+            return tag_header + data + (11 + len(data)).to_bytes(4, 'big')
+
+        # numbers are all doubles, the size of the tag doesn't depend on the positions it holds
+        base = 9 + 4 + len(script_tag(0))
+        header = b'FLV\x01' + bytes([(0x04 if audio_mediainfo is not None else 0)
+                                     | (0x01 if video_mediainfo is not None else 0)]) + (9).to_bytes(4, 'big')
+
+        # second pass: a sequential copy, the output can be a pipe or an archive member
+        with self.open_output(path, False) as fd:
+            fd.write(header + bytes(4) + script_tag(base))
+            for start, end in ranges:
+                while start < end:
+                    data = self._source.read_at(start, min(end - start, COPY_CHUNK_SIZE))
+                    if not data:
+                        raise FLVException('Input file shrunk while remuxing')
+                    fd.write(data)
+                    start += len(data)
+        self.outputs.append(path)
+
+    def cut(self, start: int | None, end: int | None, overwrite: bool, archive: OutputArchive | None = None) -> None:
+        # copy of the tags from the last keyframe at or before start up to end (ms), with the sequence headers
+        # in front and the timestamps rebased to 0; only that range of the input is read
+        assert self._source is not None
+        self._overwrite = overwrite
+        self._archive = archive
+        path = self._input_path.with_suffix('.cut.flv')
+        if not self.can_write_to(path):
+            self.warnings.warn('output_exists', f'{path.name} already exists, skipped.', once=True)
+            return
+
+        data_offset = self.get_data_offset()
+        offset = self.find_keyframe(start) if start is not None else None
+        base = 0
+        config: List[int] = []
+        if offset is None:
+            offset = data_offset + 4
+        else:
+            header = self.read_tag_header(offset)
+            assert header is not None
+            base = header[2]
+            for tag_offset, tag_type, _data_size, _timestamp, _mediainfo in self.iter_tag_headers(data_offset + 4):
+                if tag_offset >= offset or not self.is_config_tag(tag_offset):
+                    break
+                if tag_type != Tag.SCRIPT:
+                    config.append(tag_offset)
+
+        with self.open_output(path, False) as fd:
+            # the metadata of the input (duration, keyframes) doesn't match the cut, it is left out
+            output = bytearray(b'FLV\x01' + self._source.read_at(4, 1) + (9).to_bytes(4, 'big') + bytes(4))
+            for tag_offset in config:
+                self.seek(tag_offset)
+                self.copy_tag(output, 0)
+            self.seek(offset)
+            while (self._file_length - self._file_offset) >= 11:
+                if not self.copy_tag(output, base, end):
+                    break
+                if len(output) >= COPY_CHUNK_SIZE:
+                    fd.write(output)
+                    output = bytearray()
+            fd.write(output)
+        self.outputs.append(path)
+
+    def copy_tag(self, output: bytearray, base: int, end: int | None = None) -> bool:
+        # appends the tag at the current offset with its timestamp rebased and a correct PreviousTagSize
+        tag_offset = self._file_offset
+        header = bytearray(self.read_bytes(11))
+        tag_type = header[0]
+        data_size = int.from_bytes(header[1:4], 'big')
+        timestamp = int.from_bytes(header[4:7], 'big') | (header[7] << 24)
+        if tag_type not in (Tag.AUDIO, Tag.VIDEO, Tag.SCRIPT) or (tag_offset + 11 + data_size) > self._file_length:
+            return False
+        if end is not None and timestamp > end and tag_type != Tag.SCRIPT:
+            return False
+        data = self.read_bytes(data_size)
+        self.seek(self._file_offset + 4)
+        if tag_type == Tag.SCRIPT and data[:13] == b'\x02\x00\x0aonMetaData':
+            return True
+
+        timestamp = max(timestamp - base, 0)
+        header[4:7] = (timestamp & 0xffffff).to_bytes(3, 'big')
+        header[7] = (timestamp >> 24) & 0xff
+        output += header
+        output += data
+        output += (11 + data_size).to_bytes(4, 'big')
+        return True
+
+    def write_checkpoint(self) -> None:
+        # every output and the log are synced before the checkpoint replaces the previous one
+        assert self._checkpoint_log is not None
+        log = self._checkpoint_log
+        checkpoint = {
+            'version': CHECKPOINT_VERSION,
+            'input_offset': self._file_offset,
+            'input': self.input_identity(self._file_offset),
+            'options': self._checkpoint_options,
+            'audio': None if self._audio_writer is None else {
+                'mediainfo': self._audio_mediainfo,
+                'state': self.log_state('audio', self._audio_writer.get_state()),
+            },
+            'video': None if self._video_writer is None else {
+                'mediainfo': self._video_mediainfo,
+                'state': self.log_state('video', self._video_writer.get_state()),
+            },
+            'timecodes': None if self._timecode_writer is None else {
+                'state': self._timecode_writer.get_state(),
+            },
+            'extracted_audio': self.extracted_audio,
+            'extracted_video': self.extracted_video,
+            'video_timestamps': log.add('video_timestamps', self._video_timestamps),
+            'audio_timestamps': log.add('audio_timestamps', self._audio_timestamps),
+            'audio_positions': log.add('audio_positions', self._audio_positions),
+            'warnings': self.warnings.to_dict(),
+        }
+        checkpoint['log_size'] = log.commit()
+
+        path = self.checkpoint_path.with_name(self.checkpoint_path.name + '.tmp')
+        with path.open('w') as fd:
+            json.dump(checkpoint, fd)
+            fd.flush()
+            os.fsync(fd.fileno())
+        os.replace(path, self.checkpoint_path)
+        self._checkpointed = True
+
+    def log_state(self, name: str, state: Dict[str, Any] | None) -> Dict[str, Any] | None:
+        # the growing lists of a writer state (and of the alpha writer in it) go to the checkpoint log
+        assert self._checkpoint_log is not None
+        if state is None:
+            return None
+        return {key: self._checkpoint_log.add(f'{name}.{key}', value) if key in LOGGED_STATE
+                else self.log_state(f'{name}.{key}', value) if isinstance(value, dict) else value
+                for key, value in state.items()}
+
+    def restore_state(self, state: Dict[str, Any] | None, lists: Dict[str, List[int]]) -> Dict[str, Any] | None:
+        if state is None:
+            return None
+        return {key: logged_values(lists, value) if key in LOGGED_STATE
+                else self.restore_state(value, lists) if isinstance(value, dict) else value
+                for key, value in state.items()}
+
+    def input_identity(self, end: int) -> Dict[str, Any]:
+        # size, modification time and a hash of evenly spaced blocks of the input read before end
+        assert self._source is not None
+        fileno = self._source.fileno
+        digest = hashlib.sha256(end.to_bytes(8, 'big'))
+        if end <= SAMPLE_BLOCKS * SAMPLE_BLOCK_SIZE:
+            digest.update(self._source.read_at(0, end))
+        else:
+            step = (end - SAMPLE_BLOCK_SIZE) // (SAMPLE_BLOCKS - 1)
+            for i in range(SAMPLE_BLOCKS):
+                digest.update(self._source.read_at(i * step, SAMPLE_BLOCK_SIZE))
+        return {
+            'size': self._file_length,
+            'mtime_ns': None if fileno is None else os.fstat(fileno).st_mtime_ns,
+            'follow': self._follow,
+            'fingerprint': digest.hexdigest(),
+        }
+
+    def restore_checkpoint(self, checkpoint: Dict[str, Any]) -> None:
+        if checkpoint.get('version') != CHECKPOINT_VERSION or checkpoint['input_offset'] > self._file_length:
+            raise FLVException('Checkpoint does not match the input file')
+        if checkpoint['options'] != self._checkpoint_options:
+            raise FLVException('Checkpoint was written with different extraction options')
+        saved = checkpoint['input']
+        current = self.input_identity(checkpoint['input_offset'])
+        # a followed input may only have grown since, any other one must be unchanged
+        if saved['follow']:
+            unchanged = current['size'] >= saved['size'] and current['fingerprint'] == saved['fingerprint']
+        else:
+            unchanged = all(current[name] == saved[name] for name in ('size', 'mtime_ns', 'fingerprint'))
+        if not unchanged:
+            raise FLVException('Input file changed since the checkpoint was written')
+        self._checkpointed = True
+        assert self._checkpoint_log is not None
+        lists = self._checkpoint_log.restore(checkpoint['log_size'])
+
+        audio = checkpoint['audio']
+        if audio is not None:
+            self._audio_mediainfo = audio['mediainfo']
+            state = self.restore_state(audio['state'], lists)
+            self._audio_writer = DummyWriter() if state is None else self.get_audio_writer(audio['mediainfo'], state)
+
+        video = checkpoint['video']
+        if video is not None:
+            self._video_mediainfo = video['mediainfo']
+            state = self.restore_state(video['state'], lists)
+            self._video_writer = DummyWriter() if state is None else self.get_video_writer(video['mediainfo'], state)
+
+        timecodes = checkpoint['timecodes']
+        if timecodes is not None:
+            state = timecodes['state']
+            self._timecode_writer = TimeCodeWriter(
+                self._input_path.with_suffix('.txt') if state is not None else None, state)
+
+        # outputs not in the checkpoint were started by the interrupted run
+        self._overwrite = True
+
+        self.extracted_audio = checkpoint['extracted_audio']
+        self.extracted_video = checkpoint['extracted_video']
+        self._video_timestamps = array('q', logged_values(lists, checkpoint['video_timestamps']))
+        self._audio_timestamps = array('q', logged_values(lists, checkpoint['audio_timestamps']))
+        self._audio_positions = array('q', logged_values(lists, checkpoint['audio_positions']))
+        # writers share the warnings, replace them in place
+        self.warnings.restore(checkpoint['warnings'])
+
+        self.seek(checkpoint['input_offset'])
 
     def close_output(self, average_framerate: Fraction | None, disposing: bool) -> None:
+        for writer in (self._video_writer, self._audio_writer, self._timecode_writer):
+            if writer is not None and not disposing:
+                self.outputs.extend(path for path in writer.outputs if path not in self.outputs)
+            if writer is not None and disposing and self._archive is not None:
+                self._archive.discard(writer.outputs)
+        # archive members are discarded when closed, there is nothing to unlink
+        disposing = disposing and self._archive is None
+
         if self._video_writer is not None:
             self._video_writer.finish(average_framerate if average_framerate is not None else Fraction(25, 1))
             if disposing:
@@ -192,95 +1359,350 @@ class FLVFile(IDisposable, ABC):
                 self._timecode_writer.unlink()
             self._timecode_writer = None
 
+        self._fmp4_writer = None
+        self._mkv_writer = None
+
+    def stop(self) -> None:
+        # may be called from a signal handler, extraction ends after the current tag
+        self._stop_requested = True
+
+    def wait_for_data(self, size: int) -> bool:
+        if (self._file_length - self._file_offset) >= size:
+            return True
+        if not self._follow:
+            return False
+
+        assert self._source is not None
+        last_growth = time.monotonic()
+        while not self._stop_requested:
+            file_length = self._source.refresh_size()
+            if file_length != self._file_length:
+                self._file_length = file_length
+                last_growth = time.monotonic()
+            if (self._file_length - self._file_offset) >= size:
+                return True
+            if (time.monotonic() - last_growth) >= self._follow_timeout:
+                break
+            time.sleep(FOLLOW_POLL_INTERVAL)
+        return False
+
     def read_tag(self) -> bool:
-        if (self._file_length - self._file_offset) < 11:
+        tag_offset = self._tag_offset = self._file_offset
+        if not self.wait_for_data(11):
+            if self._recover and self._file_offset < self._file_length:
+                self.skip_damaged(tag_offset, self._file_length)
             return False
 
+        tag = self.read_tag_record()
         # 2bit reserved - 1bit filter - 5bit tagtype
-        tag_type = self.read_uint8()
-        if tag_type & 0xe0:
+        if tag.tag_type & 0xe0:
+            if self._recover:
+                return self.resync(tag_offset)
             raise FLVException('Encrypted or invalid packet')
 
-        data_size = self.read_uint24()
-        timestamp = self.read_uint24()
-        timestamp |= self.read_uint8() << 24
-        _stream_id = self.read_uint24()  # always 0
+        # stream id is always 0
+        if self._recover and (tag.stream_id != 0 or not self.is_plausible_tag(tag_offset, tag.tag_type, tag.data_size,
+                                                                              tag.timestamp)):
+            return self.resync(tag_offset)
+
+        # only a tag known to be sound ends the extraction, a damaged timestamp is resynchronized above
+        if self._end_timestamp is not None and tag.timestamp > self._end_timestamp and tag.tag_type != Tag.SCRIPT:
+            return False
 
         # Read tag data
-        if data_size == 0:
+        if tag.data_size == 0:
             return True
 
-        if (self._file_length - self._file_offset) < data_size:
-            return False
+        if not self.wait_for_data(tag.data_size):
+            return self._recover and self.resync(tag_offset)
 
-        mediainfo = self.read_uint8()
-        data_size -= 1
+        if tag.data_size >= PASSTHROUGH_MIN_SIZE and not self._recover and self.write_passthrough(tag):
+            self._last_timestamp = tag.timestamp
+            self.seek(tag.offset + 11 + tag.data_size)
+            return True
 
-        data = self.read_bytes(data_size)
+        data = bytes(self.read_tag_data(tag)[1:])
+        self._last_timestamp = tag.timestamp
+
+        if self._recover:
+            try:
+                self.write_tag(tag.tag_type, tag.mediainfo, data, tag.timestamp)
+            except FLVException as e:
+                self.warnings.warn('damaged_tag', f'Skipped damaged tag at offset {tag_offset}: {e}', offset=tag_offset)
+                self.skipped_ranges.append((tag_offset, self._file_offset))
+        else:
+            self.write_tag(tag.tag_type, tag.mediainfo, data, tag.timestamp)
+        return True
 
+    def write_tag(self, tag_type: int, mediainfo: int, data: bytes, timestamp: int) -> None:
         if tag_type == Tag.AUDIO:
             if self._audio_writer is None:
+                self._audio_mediainfo = mediainfo
                 self._audio_writer = self.get_audio_writer(mediainfo) if self._extract_audio else DummyWriter()
                 self.extracted_audio = not isinstance(self._audio_writer, DummyWriter)
+            self._audio_timestamps.append(timestamp)
             self._audio_writer.write_chunk(data, timestamp)
         elif tag_type == Tag.VIDEO and ((mediainfo >> 4) != 5):
             if self._video_writer is None:
+                self._video_mediainfo = mediainfo
                 self._video_writer = self.get_video_writer(mediainfo) if self._extract_video else DummyWriter()
                 self.extracted_video = not isinstance(self._video_writer, DummyWriter)
             if self._timecode_writer is None:
                 path = self._input_path.with_suffix('.txt')
                 self._timecode_writer = TimeCodeWriter(
-                    path if self._extract_timecodes and self.can_write_to(path) else None)
+                    path if self._extract_timecodes and self.can_write_to(path) else None, opener=self.open_output)
             self._video_timestamps.append(timestamp)
+            self._audio_positions.append(len(self._audio_timestamps))
             self._video_writer.write_chunk(data, timestamp, (mediainfo & 0xf0) >> 4)
             self._timecode_writer.write(timestamp)
+        elif tag_type == Tag.SCRIPT:
+            self.read_script_tag(bytes([mediainfo]) + data)
+
+    def write_passthrough(self, tag: FLVTag) -> bool:
+        # the payload of a large video tag goes from the input to the output without being read, when the video
+        # writer is set up and copies it as is; same bookkeeping as write_tag
+        assert self._source is not None
+        source = self._source.fileno
+        if (source is None or tag.tag_type != Tag.VIDEO or self._video_writer is None
+                or self._timecode_writer is None):
+            return False
+        head = self._source.read_at(tag.offset + 11, 1 + PASSTHROUGH_HEAD_SIZE)
+        tag.mediainfo = head[0]
+        offset = tag.offset + 12
+        size = tag.data_size - 1
+        if (tag.mediainfo >> 4) == 5:
+            return False
+        if not self._video_writer.write_passthrough(head[1:], source, offset, size, tag.timestamp,
+                                                    (tag.mediainfo & 0xf0) >> 4):
+            return False
+        self._video_timestamps.append(tag.timestamp)
+        self._audio_positions.append(len(self._audio_timestamps))
+        self._timecode_writer.write(tag.timestamp)
+        return True
+
+    def is_sane_timestamp(self, timestamp: int) -> bool:
+        if self._last_timestamp is None:
+            return True
+        return (self._last_timestamp - 1000) <= timestamp <= (self._last_timestamp + RESYNC_MAX_TIMESTAMP_JUMP)
+
+    def skip_damaged(self, start: int, end: int) -> None:
+        self.skipped_ranges.append((start, end))
+        self.warnings.warn('damaged_bytes', f'Skipped {end - start} damaged bytes at offset {start}.', offset=start)
+
+    def resync(self, tag_offset: int) -> bool:
+        # scan ahead in large windows for the next plausible tag header
+        assert self._source is not None
+        position = tag_offset + 1
+        while position < self._file_length:
+            window = self._source.read_at(position, RESYNC_WINDOW)
+            for match in RESYNC_PATTERN.finditer(window):
+                offset = position + match.start()
+                header = window[match.start():match.start() + 8]
+                timestamp = (int.from_bytes(header[4:7], 'big') | (header[7] << 24)) + self._timestamp_offset
+                if self.is_plausible_tag(offset, header[0], int.from_bytes(header[1:4], 'big'), timestamp):
+                    self.skip_damaged(tag_offset, offset)
+                    self.seek(offset)
+                    return self.read_tag()
+            if len(window) < RESYNC_WINDOW:
+                break
+            position += len(window) - 14  # keep a header and its PreviousTagSize across windows
+
+        self.skip_damaged(tag_offset, self._file_length)
+        self.seek(self._file_length)
+        return False
+
+    def find_tag_boundary(self, offset: int) -> int | None:
+        assert self._source is not None
+        position = offset
+        while position < self._file_length:
+            window = self._source.read_at(position, RESYNC_WINDOW)
+            for match in RESYNC_PATTERN.finditer(window):
+                if self.is_tag_boundary(position + match.start()):
+                    return position + match.start()
+            if len(window) < RESYNC_WINDOW:
+                break
+            position += len(window) - 14
+        return None
+
+    def is_tag_boundary(self, offset: int) -> bool:
+        # the PreviousTagSize before the header must point back to a tag of that size, the one after it to this tag
+        assert self._source is not None
+        header = self.read_tag_header(offset)
+        if header is None or offset < 4:
+            return False
+        data_size = header[1]
+        if int.from_bytes(self._source.read_at(offset + 11 + data_size, 4), 'big') != data_size + 11:
+            return False
+        prev_tag_size = int.from_bytes(self._source.read_at(offset - 4, 4), 'big')
+        if prev_tag_size < 11 or prev_tag_size > offset - 4:
+            return False
+        previous = self.read_tag_header(offset - 4 - prev_tag_size)
+        return previous is not None and previous[1] + 11 == prev_tag_size
+
+    def is_plausible_tag(self, offset: int, tag_type: int, data_size: int, timestamp: int) -> bool:
+        assert self._source is not None
+        end = offset + 11 + data_size
+        if tag_type not in (Tag.AUDIO, Tag.VIDEO, Tag.SCRIPT) or end > self._file_length:
+            return False
+        if not self.is_sane_timestamp(timestamp):
+            return False
+
+        # the PreviousTagSize that follows must point back to this tag, some muxers get it wrong
+        # so a valid tag header right after it is accepted as well
+        trailer = self._source.read_at(end, 4 + 11)
+        if len(trailer) >= 4 and int.from_bytes(trailer[:4], 'big') != data_size + 11:
+            if (len(trailer) < 15 or trailer[4] not in (Tag.AUDIO, Tag.VIDEO, Tag.SCRIPT)
+                    or trailer[12:15] != b'\x00\x00\x00'):
+                return False
+
+        if data_size == 0:
+            return True
+
+        # codecs don't change midstream
+        mediainfo = self._source.read_at(offset + 11, 1)[0]
+        if tag_type == Tag.AUDIO and self._audio_writer is not None:
+            return (mediainfo >> 4) == (self._audio_mediainfo >> 4)
+        if tag_type == Tag.VIDEO and self._video_writer is not None:
+            return (mediainfo & 0x0f) == (self._video_mediainfo & 0x0f)
         return True
 
-    def get_audio_writer(self, mediainfo: int) -> IAudioWriter | DummyWriter:
+    def get_audio_writer(self, mediainfo: int, state: Dict[str, Any] | None = None) -> IAudioWriter | DummyWriter:
         format_ = mediainfo >> 4
         rate = (mediainfo >> 2) & 0x3
         bits = (mediainfo >> 1) & 0x1
         chans = mediainfo & 0x1
 
         match format_:
+            case (AudioFormat.MP3 | AudioFormat.MP3_8k | AudioFormat.PCM | AudioFormat.PCM_LE | AudioFormat.AAC
+                  | AudioFormat.SPEEX) if self._matroska:
+                mkv_writer = self.get_mkv_writer()
+                if mkv_writer is None:
+                    return DummyWriter()
+                return mkv_writer.audio_writer(mediainfo)
             case AudioFormat.MP3 | AudioFormat.MP3_8k:
                 path = self._input_path.with_suffix('.mp3')
-                return MP3Writer(path, self.warnings) if self.can_write_to(path) else DummyWriter()
+                if not self.can_write_to(path, state):
+                    return DummyWriter()
+                return MP3Writer(path, self.warnings, state, self.open_output)
             case AudioFormat.PCM | AudioFormat.PCM_LE:
                 assert 0 <= rate < 4
                 samplerate = SampleRates[rate]
                 path = self._input_path.with_suffix('.wav')
-                if not self.can_write_to(path):
+                if not self.can_write_to(path, state):
+                    return DummyWriter()
+                # PCM is in the byte order of the encoding machine, WAVWriter detects it
+                return WAVWriter(path, 16 if bits == 1 else 8, 2 if chans == 1 else 1, samplerate, state,
+                                 None if format_ == AudioFormat.PCM else 'little', self.warnings, self.open_output)
+            case AudioFormat.ALAW | AudioFormat.ULAW:
+                path = self._input_path.with_suffix('.wav')
+                if not self.can_write_to(path, state):
+                    return DummyWriter()
+                return G711Writer(path, format_ == AudioFormat.ALAW, 2 if chans == 1 else 1, state, self.open_output)
+            case AudioFormat.ADPCM:
+                path = self._input_path.with_suffix('.wav')
+                if not self.can_write_to(path, state):
                     return DummyWriter()
-                if format_ == AudioFormat.PCM:
-                    self.warnings.append('PCM byte order unspecified, assuming little endian.')
-                return WAVWriter(path, 16 if bits == 1 else 8, 2 if chans == 1 else 1, samplerate)
+                return ADPCMWriter(path, 2 if chans == 1 else 1, SampleRates[rate], state, self.open_output)
+            case AudioFormat.AAC if self._fragmented_mp4:
+                fmp4_writer = self.get_fmp4_writer()
+                return fmp4_writer.audio_writer() if fmp4_writer is not None else DummyWriter()
             case AudioFormat.AAC:
                 path = self._input_path.with_suffix('.aac')
-                return AACWriter(path) if self.can_write_to(path) else DummyWriter()
+                return AACWriter(path, state, self.open_output) if self.can_write_to(path, state) else DummyWriter()
             case AudioFormat.SPEEX:
                 path = self._input_path.with_suffix('.spx')
-                return SpeexWriter(path, self._file_length & 0xffffffff) if self.can_write_to(path) else DummyWriter()
+                if not self.can_write_to(path, state):
+                    return DummyWriter()
+                return SpeexWriter(path, self._file_length & 0xffffffff, state, self.open_output)
             case _:
-                self.warnings.append(f'Unable to extract audio ({format_} is unsupported).')
+                self.warnings.warn('unsupported_audio', f'Unable to extract audio ({format_} is unsupported).',
+                                   once=True)
                 return DummyWriter()
 
-    def get_video_writer(self, mediainfo: int) -> IVideoWriter | DummyWriter:
+    def get_video_writer(self, mediainfo: int, state: Dict[str, Any] | None = None) -> IVideoWriter | DummyWriter:
         codec_id = mediainfo & 0x0f
 
         match codec_id:
+            case VideoCodecID.H263 | VideoCodecID.VP6 | VideoCodecID.VP6v2 | VideoCodecID.AVC if self._matroska:
+                mkv_writer = self.get_mkv_writer()
+                return mkv_writer.video_writer(codec_id) if mkv_writer is not None else DummyWriter()
             case VideoCodecID.H263 | VideoCodecID.VP6 | VideoCodecID.VP6v2:
                 path = self._input_path.with_suffix('.avi')
-                return AVIWriter(path, codec_id, self.warnings) if self.can_write_to(path) else DummyWriter()
+                if not self.can_write_to(path, state):
+                    return DummyWriter()
+                return AVIWriter(path, codec_id, self.warnings, state=state, opener=self.open_output)
+            case VideoCodecID.AVC if self._fragmented_mp4:
+                fmp4_writer = self.get_fmp4_writer()
+                return fmp4_writer.video_writer() if fmp4_writer is not None else DummyWriter()
             case VideoCodecID.AVC:
                 path = self._input_path.with_suffix('.264')
-                return RawH264Writer(path) if self.can_write_to(path) else DummyWriter()
+                return RawH264Writer(path, state, self.open_output) if self.can_write_to(path, state) else DummyWriter()
             case _:
-                self.warnings.append(f'Unable to extract video ({codec_id}) is unsupported).')
+                self.warnings.warn('unsupported_video', f'Unable to extract video ({codec_id}) is unsupported).',
+                                   once=True)
                 return DummyWriter()
 
-    def can_write_to(self, path: Path) -> bool:
-        return not path.exists() or self._overwrite
+    def get_fmp4_writer(self) -> FMP4Writer | None:
+        # audio and video share the same output file
+        if self._fmp4_writer is None:
+            path = self._input_path.with_suffix('.mp4')
+            if not self.can_write_to(path):
+                return None
+            self._fmp4_writer = FMP4Writer(path, self.warnings, opener=self.open_output)
+        return self._fmp4_writer
+
+    def get_mkv_writer(self) -> MKVWriter | None:
+        # audio and video share the same output file
+        if self._mkv_writer is None:
+            path = self._input_path.with_suffix('.mkv')
+            if not self.can_write_to(path):
+                return None
+            self._mkv_writer = MKVWriter(path, self.warnings, self.open_output)
+        return self._mkv_writer
+
+    def open_output(self, path: Path, seekable: bool) -> BinaryIO:
+        fd: BinaryIO
+        if self._archive is not None:
+            # archive members are file objects of their own, written like any output
+            fd = cast(BinaryIO, self._archive.open_member(path, seekable))
+        elif self._io_policy is not None:
+            fd = self._io_policy.open_output(path, self.estimate_output_size(path) if self._io_policy.preallocate
+                                             else 0)
+        else:
+            fd = open_output(path, seekable)
+        if self.hash_algorithms:
+            return cast(BinaryIO, HashingOutput(fd, path, seekable, self.hash_algorithms, self.output_digests))
+        return fd
+
+    def estimate_output_size(self, path: Path) -> int:
+        # payload bytes onMetaData announces for the streams of an output, 0 when unknown
+        metadata = self.read_metadata()
+        streams = OUTPUT_STREAMS.get(path.suffix, ())
+        if metadata is None or path.name.endswith('.alpha.avi'):
+            return 0
+        sizes = [size for size in (metadata.payload_size(stream) for stream in streams) if size is not None]
+        return sum(sizes) if len(sizes) == len(streams) else 0
+
+    def drop_cache(self) -> None:
+        assert self._io_policy is not None and self._source is not None
+        self._io_policy.drop_pages(self._source.fileno, self._file_offset)
+        self._next_cache_drop = self._file_offset + self._io_policy.drop_interval
+
+    def can_write_to(self, path: Path, state: Dict[str, Any] | None = None) -> bool:
+        if self._archive is not None:
+            if self._overwrite or path.name not in self._archive.names:
+                return True
+            self._output_refused = True
+            return False
+        # a writer resumed from a checkpoint reopens its own output
+        if state is not None or not path.exists():
+            return True
+        if not self._overwrite:
+            self._output_refused = True
+            return False
+        # outputs may be hard links into the result cache, replace them instead of truncating
+        path.unlink()
+        return True
 
     def calculate_average_framerate(self) -> Fraction | None:
         frame_count = len(self._video_timestamps)
@@ -291,20 +1713,8 @@ class FLVFile(IDisposable, ABC):
         return None
 
     def calculate_true_framerate(self) -> Fraction | None:
-        delta_count: Dict[int, int] = {}
-
-        # Calculate the distance between the timestamps, count how many times each delta appears
-        for i in range(1, len(self._video_timestamps)):
-            delta_s = self._video_timestamps[i] - self._video_timestamps[i - 1]
-
-            if delta_s <= 0:
-                continue
-            delta = delta_s
-
-            if delta in delta_count:
-                delta_count[delta] += 1
-            else:
-                delta_count[delta] = 1
+        # Count how many times each distance between the timestamps appears
+        delta_count = {delta: count for delta, count in delta_histogram(self._video_timestamps).items() if delta > 0}
 
         threshold = len(self._video_timestamps) // 10
         min_delta = 0xffffffff  # UInt32.MaxValue
@@ -335,8 +1745,6 @@ class FLVFile(IDisposable, ABC):
         return None
 
     def seek(self, offset: int) -> None:
-        assert self._fd is not None
-        self._fd.seek(offset)
         self._file_offset = offset
 
     def read_uint8(self) -> int:
@@ -350,7 +1758,32 @@ class FLVFile(IDisposable, ABC):
     def read_uint32(self) -> int:
         return int.from_bytes(self.read_bytes(4), 'big')
 
+    def read_view(self, size: int) -> memoryview:
+        # like read_bytes, without copying data that is already in the read buffer
+        start = self._file_offset - self._buffer_offset
+        if 0 <= start and (start + size) <= len(self._buffer):
+            self._file_offset += size
+            return memoryview(self._buffer)[start:start + size]
+        return memoryview(self.read_bytes(size))
+
     def read_bytes(self, size: int) -> bytes:
+        offset = self._file_offset
         self._file_offset += size
-        assert self._fd is not None
-        return self._fd.read(size)
+
+        # small reads are served from a buffer, sources may have a high per-read cost
+        start = offset - self._buffer_offset
+        if 0 <= start and (start + size) <= len(self._buffer):
+            return self._buffer[start:start + size]
+        assert self._source is not None
+        if size >= READ_BUFFER_SIZE:
+            return self._source.read_at(offset, size)
+        self._buffer = self._source.read_at(offset, READ_BUFFER_SIZE)
+        self._buffer_offset = offset
+        return self._buffer[:size]
+
+
+def extract_range(input_path: Path, part_path: Path, data_offset: int, start: int, end: int,
+                  options: Dict[str, bool]) -> RangeResult:
+    # runs in a worker process, the outputs are named after the part path
+    flv = FLVFile(part_path, FileSource(input_path))
+    return flv.extract_range(data_offset, start, end, **options)
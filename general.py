@@ -18,7 +18,13 @@
 # IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
+import errno
+import os
 from ctypes import c_int, c_uint, c_ulonglong
+from pathlib import Path
+from typing import BinaryIO, Callable
+
+from interfaces import FLVException
 
 
 class BitHelper:
@@ -93,3 +99,103 @@ class OggCRC(object):
         for i in range(length):
             crc.value = _lut[((crc.value >> 24) ^ buff[offset + i]) & 0xFF] ^ (crc.value << 8)
         return crc.value
+
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+# opens a writer's output, the flag tells whether the writer seeks back into it (e.g. to patch a header)
+OutputOpener = Callable[[Path, bool], BinaryIO]
+
+
+def open_output(path: Path, seekable: bool = True) -> BinaryIO:
+    return path.open('wb')
+
+
+def sync_output(fd: BinaryIO) -> int:
+    # make the written data durable and return the output size for a checkpoint
+    fd.flush()
+    os.fsync(fd.fileno())
+    return fd.tell()
+
+
+def copy_range(path: Path, fd: BinaryIO, start: int, end: int) -> None:
+    with path.open('rb') as src:
+        if output_fileno(fd) is not None:
+            copy_to_output(fd, src.fileno(), start, end - start)
+            return
+        src.seek(start)
+        while start < end:
+            data = src.read(min(end - start, COPY_CHUNK_SIZE))
+            if not data:
+                break
+            fd.write(data)
+            start += len(data)
+
+
+def output_fileno(fd: BinaryIO) -> int | None:
+    # the file descriptor the kernel can copy into, None for outputs that aren't plain files (e.g. archive members)
+    if not hasattr(os, 'pwrite'):
+        return None
+    try:
+        return fd.fileno()
+    except (OSError, ValueError):
+        return None
+
+
+# errors of a copy method the kernel doesn't support for this pair of files, the next method is tried
+_UNSUPPORTED_COPY_ERRORS = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF, errno.EPERM)
+_use_copy_file_range = hasattr(os, 'copy_file_range')
+_use_sendfile = hasattr(os, 'sendfile')
+
+
+def kernel_copy(source: int, target: int, offset: int, position: int, size: int) -> int:
+    global _use_copy_file_range, _use_sendfile
+    if _use_copy_file_range:
+        try:
+            return os.copy_file_range(source, target, size, offset, position)
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED_COPY_ERRORS:
+                raise
+            _use_copy_file_range = False
+    if _use_sendfile:
+        try:
+            os.lseek(target, position, os.SEEK_SET)
+            return os.sendfile(target, source, offset, size)
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED_COPY_ERRORS:
+                raise
+            _use_sendfile = False
+    data = os.pread(source, min(size, COPY_CHUNK_SIZE), offset)
+    return os.pwrite(target, data, position) if data else 0
+
+
+def copy_to_output(fd: BinaryIO, source: int, offset: int, size: int) -> None:
+    # append size bytes of the source file at offset to fd, the data doesn't pass through Python when the kernel
+    # can copy it (copy_file_range, then sendfile)
+    fd.flush()
+    target = fd.fileno()
+    position = fd.tell()
+    while size > 0:
+        copied = kernel_copy(source, target, offset, position, size)
+        if copied <= 0:
+            # some file systems report nothing copied before the end of the file, the rest is read and written
+            data = os.pread(source, min(size, COPY_CHUNK_SIZE), offset)
+            if not data:
+                raise FLVException('Input ended in the middle of a payload')
+            copied = os.pwrite(target, data, position)
+        offset += copied
+        position += copied
+        size -= copied
+    fd.seek(position)
+
+
+def reopen_output(path: Path, size: int) -> BinaryIO:
+    # reopen an output at a checkpoint, dropping whatever was written after it
+    fd = path.open('r+b')
+    if os.fstat(fd.fileno()).st_size < size:
+        fd.close()
+        raise FLVException(f'{path.name} is shorter than at the checkpoint')
+    fd.truncate(size)
+    fd.seek(size)
+    return fd
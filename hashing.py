@@ -0,0 +1,142 @@
+# FLV Extract
+# Copyright (C) 2006-2012 J.D. Purcell (moitah@yahoo.com)
+# Python port (C) 2012-2024 Gianluigi Tiesi <sherpya@gmail.com>
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import hashlib
+import io
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, BinaryIO, Dict, Iterator, List, Sequence
+
+from general import COPY_CHUNK_SIZE
+
+if TYPE_CHECKING:
+    from typing_extensions import Buffer
+
+# shake digests have no fixed length
+HASH_ALGORITHMS = sorted(name for name in hashlib.algorithms_guaranteed if not name.startswith('shake_'))
+HASH_MIRROR_SIZE = 8 * 1024 * 1024  # a seekable output up to this size is kept in memory to be hashed once patched
+
+
+@dataclass
+class OutputDigest:
+    size: int
+    digests: Dict[str, str]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'size': self.size, **self.digests}
+
+
+class HashingOutput(io.BufferedIOBase):
+    # hashes an output as it is written. An output opened for a writer that seeks back into it (to patch a header in
+    # finish()) is hashed once closed instead, from a copy kept in memory while it is small, else read back; only
+    # such an output hands out its file descriptor for the kernel to copy payloads into
+    _fd: BinaryIO
+    _path: Path
+    _algorithms: Sequence[str]
+    _hashes: List['hashlib._Hash']
+    _digests: Dict[Path, OutputDigest]  # where the digest is stored once closed
+    _patchable: bool  # opened for a writer that seeks back into it
+    _mirror: bytearray | None
+    _position: int = 0
+    _hashed: int = 0
+    _size: int = 0
+    _stale: bool = False
+
+    def __init__(self, fd: BinaryIO, path: Path, seekable: bool, algorithms: Sequence[str],
+                 digests: Dict[Path, OutputDigest]):
+        super().__init__()
+        self._fd = fd
+        self._path = path
+        self._algorithms = algorithms
+        self._hashes = [hashlib.new(name) for name in algorithms]
+        self._digests = digests
+        self._patchable = self._stale = seekable
+        self._mirror = bytearray() if seekable else None
+
+    def write(self, data: 'Buffer') -> int:
+        count = self._fd.write(data)
+        end = self._position + count
+        if self._position == self._hashed and not self._stale:
+            for digest in self._hashes:
+                digest.update(data)
+            self._hashed = end
+        else:
+            self._stale = True
+        if self._mirror is not None:
+            if self._position > len(self._mirror):
+                self._mirror.extend(bytes(self._position - len(self._mirror)))
+            self._mirror[self._position:end] = memoryview(data)
+            if len(self._mirror) > HASH_MIRROR_SIZE:
+                self._mirror = None
+        self._position = end
+        self._size = max(self._size, end)
+        return count
+
+    def writable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return self._fd.seekable()
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        # the kernel copies seek past what they add
+        self._position = self._fd.seek(offset, whence)
+        self._size = max(self._size, self._position)
+        return self._position
+
+    def fileno(self) -> int:
+        if not self._patchable:
+            raise io.UnsupportedOperation('fileno')
+        fileno = self._fd.fileno()
+        self._mirror = None
+        return fileno
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self) -> None:
+        if not self._fd.closed:
+            self._fd.flush()
+
+    def final_content(self) -> Iterator[bytes]:
+        # archive members are staged in a readable temporary file, the other outputs are plain files
+        if self._mirror is not None:
+            yield self._mirror
+        elif self._fd.readable():
+            self._fd.seek(0)
+            yield from iter(lambda: self._fd.read(COPY_CHUNK_SIZE), b'')
+        else:
+            with self._path.open('rb') as fd:
+                yield from iter(lambda: fd.read(COPY_CHUNK_SIZE), b'')
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        super().close()
+        try:
+            if self._stale or self._hashed != self._size:
+                self._hashes = [hashlib.new(name) for name in self._algorithms]
+                for data in self.final_content():
+                    for digest in self._hashes:
+                        digest.update(data)
+        finally:
+            self._fd.close()
+        self._digests[self._path] = OutputDigest(self._size, {name: digest.hexdigest()
+                                                              for name, digest in zip(self._algorithms, self._hashes)})
@@ -2,6 +2,7 @@ from abc import ABC, abstractmethod
 from enum import IntEnum
 from fractions import Fraction
 from pathlib import Path
+from typing import Any, Dict, List
 
 
 class IDisposable(ABC):
@@ -18,6 +19,17 @@ class IAudioWriter(ABC):
     @abstractmethod
     def finish(self) -> None: ...
 
+    @abstractmethod
+    def get_state(self) -> Dict[str, Any]: ...
+
+    def append_part(self, path: Path, state: Dict[str, Any]) -> None:
+        # output and final state of a range extracted by a worker process, in order
+        raise FLVException(f'{type(self).__name__} does not support parallel extraction')
+
+    @property
+    def outputs(self) -> List[Path]:
+        return [self._path]
+
     def unlink(self) -> None:
         self._path.unlink()
 
@@ -28,13 +40,50 @@ class IVideoWriter(ABC):
     @abstractmethod
     def write_chunk(self, chunk: bytes, timestamp: int, frametype: int) -> None: ...
 
+    def write_passthrough(self, head: bytes, source: int, offset: int, size: int, timestamp: int,
+                          frametype: int) -> bool:
+        # a frame of size bytes at offset in the source file, which starts with head; writers that copy it as is
+        # let the kernel do it and return True, the others get it through write_chunk
+        return False
+
     @abstractmethod
     def finish(self, average_framerate: Fraction) -> None: ...
 
+    @abstractmethod
+    def get_state(self) -> Dict[str, Any]: ...
+
+    def append_part(self, path: Path, state: Dict[str, Any]) -> None:
+        # output and final state of a range extracted by a worker process, in order
+        raise FLVException(f'{type(self).__name__} does not support parallel extraction')
+
+    @property
+    def outputs(self) -> List[Path]:
+        return [self._path]
+
     def unlink(self) -> None:
         self._path.unlink()
 
 
+class IInputSource(ABC):
+    @property
+    @abstractmethod
+    def size(self) -> int: ...
+
+    @abstractmethod
+    def read_at(self, offset: int, size: int) -> bytes: ...
+
+    def refresh_size(self) -> int:
+        # sources that can grow (see follow mode) look for new data here
+        return self.size
+
+    @property
+    def fileno(self) -> int | None:
+        # the file descriptor of a local file, for copying payloads without reading them
+        return None
+
+    def close(self) -> None: ...
+
+
 class VideoCodecID(IntEnum):
     H263 = 2
     SCREEN = 3
@@ -44,5 +93,23 @@ class VideoCodecID(IntEnum):
     AVC = 7
 
 
+class AudioFormat(IntEnum):
+    PCM = 0
+    ADPCM = 1
+    MP3 = 2
+    PCM_LE = 3
+    NELLY_16k = 4
+    NELLY_8k = 5
+    NELLYMOSER = 6
+    ALAW = 7
+    ULAW = 8
+    AAC = 10
+    SPEEX = 11
+    MP3_8k = 14
+
+
+SampleRates = [5512, 11025, 22050, 44100]
+
+
 class FLVException(Exception):
     pass
@@ -0,0 +1,106 @@
+# FLV Extract
+# Copyright (C) 2006-2012 J.D. Purcell (moitah@yahoo.com)
+# Python port (C) 2012-2024 Gianluigi Tiesi <sherpya@gmail.com>
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import io
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING, BinaryIO, List
+
+if TYPE_CHECKING:
+    from typing_extensions import Buffer
+
+DROP_CACHE_INTERVAL = 32 * 1024 * 1024  # input bytes between two page cache drops
+
+
+class PolicyOutput(io.FileIO):
+    # an output file, preallocated when its size can be estimated and trimmed to the data written once closed
+    _policy: 'IOPolicy'
+    _end: int = 0
+    _preallocated: bool = False
+
+    def __init__(self, path: Path, policy: 'IOPolicy', size: int):
+        super().__init__(path, 'wb')
+        self._policy = policy
+        if size > 0:
+            try:
+                os.posix_fallocate(self.fileno(), 0, size)
+                self._preallocated = True
+            except OSError:
+                pass
+
+    def write(self, data: 'Buffer') -> int:
+        count = super().write(data)
+        self._end = max(self._end, self.tell())
+        return count
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        # writers seek back into what they wrote, the kernel copies seek past what they add
+        position = super().seek(offset, whence)
+        self._end = max(self._end, position)
+        return position
+
+    def close(self) -> None:
+        if not self.closed:
+            if self._preallocated:
+                self.truncate(self._end)
+            self._policy.drop_output(self.fileno())
+        super().close()
+
+
+class IOPolicy:
+    # keeps large extractions from pushing everything else out of the page cache: the input is read with sequential
+    # and no-reuse hints, and the pages already processed, read or written, are dropped as the extraction goes
+    drop_cache: bool
+    preallocate: bool
+    drop_interval: int
+    _outputs: List[PolicyOutput]
+
+    def __init__(self, drop_cache: bool = True, preallocate: bool = False,
+                 drop_interval: int = DROP_CACHE_INTERVAL):
+        self.drop_cache = drop_cache and hasattr(os, 'posix_fadvise')
+        self.preallocate = preallocate and hasattr(os, 'posix_fallocate')
+        self.drop_interval = drop_interval
+        self._outputs = []
+
+    def open_input(self, fileno: int | None) -> None:
+        if self.drop_cache and fileno is not None:
+            os.posix_fadvise(fileno, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            os.posix_fadvise(fileno, 0, 0, os.POSIX_FADV_NOREUSE)
+
+    def open_output(self, path: Path, size: int) -> BinaryIO:
+        raw = PolicyOutput(path, self, size if self.preallocate else 0)
+        self._outputs.append(raw)
+        return io.BufferedWriter(raw)
+
+    def drop_pages(self, fileno: int | None, offset: int) -> None:
+        # the input up to offset and the outputs written so far; dirty pages are only dropped once written back,
+        # which the previous drop started
+        if not self.drop_cache:
+            return
+        if fileno is not None:
+            os.posix_fadvise(fileno, 0, offset, os.POSIX_FADV_DONTNEED)
+        self._outputs = [raw for raw in self._outputs if not raw.closed]
+        for raw in self._outputs:
+            os.posix_fadvise(raw.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+    def drop_output(self, fileno: int) -> None:
+        # a finished output is written back first, its pages wouldn't be dropped otherwise
+        if self.drop_cache:
+            os.fdatasync(fileno)
+            os.posix_fadvise(fileno, 0, 0, os.POSIX_FADV_DONTNEED)
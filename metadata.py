@@ -0,0 +1,91 @@
+# FLV Extract
+# Copyright (C) 2006-2012 J.D. Purcell (moitah@yahoo.com)
+# Python port (C) 2012-2024 Gianluigi Tiesi <sherpya@gmail.com>
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import math
+from bisect import bisect_right
+from dataclasses import dataclass, field
+from typing import Any, Dict, List
+
+
+def as_float(value: Any) -> float | None:
+    # AMF0 numbers are doubles, NaN and infinities are as good as missing
+    if not isinstance(value, (int, float)) or isinstance(value, bool) or not math.isfinite(value):
+        return None
+    return float(value)
+
+
+def as_int(value: Any) -> int | None:
+    number = as_float(value)
+    return None if number is None else int(number)
+
+
+@dataclass
+class FLVMetadata:
+    duration: float | None = None
+    width: int | None = None
+    height: int | None = None
+    framerate: float | None = None
+    video_codec_id: int | None = None
+    audio_codec_id: int | None = None
+    keyframe_times: List[float] = field(default_factory=list)  # seconds
+    keyframe_positions: List[int] = field(default_factory=list)  # tag offsets
+    properties: Dict[str, Any] = field(default_factory=dict)
+
+    @classmethod
+    def from_script_data(cls, value: Any) -> 'FLVMetadata':
+        properties = value if isinstance(value, dict) else {}
+        metadata = cls(duration=as_float(properties.get('duration')),
+                       width=as_int(properties.get('width')),
+                       height=as_int(properties.get('height')),
+                       framerate=as_float(properties.get('framerate')),
+                       video_codec_id=as_int(properties.get('videocodecid')),
+                       audio_codec_id=as_int(properties.get('audiocodecid')),
+                       properties=properties)
+
+        # as injected by yamdi, flvtool2 and most recorders
+        keyframes = properties.get('keyframes')
+        if isinstance(keyframes, dict):
+            times = keyframes.get('times')
+            positions = keyframes.get('filepositions')
+            if isinstance(times, list) and isinstance(positions, list) and len(times) == len(positions):
+                for t, p in zip(times, positions):
+                    time_, position = as_float(t), as_int(p)
+                    if time_ is None or position is None or (metadata.keyframe_times and
+                                                             time_ < metadata.keyframe_times[-1]):
+                        metadata.keyframe_times, metadata.keyframe_positions = [], []
+                        break
+                    metadata.keyframe_times.append(time_)
+                    metadata.keyframe_positions.append(position)
+
+        return metadata
+
+    def payload_size(self, stream: str) -> int | None:
+        # bytes of 'audio' or 'video' payload, as announced by yamdi (audiosize, videosize) or from the data rate
+        size = as_float(self.properties.get(f'{stream}size'))
+        if size is None:
+            rate = as_float(self.properties.get(f'{stream}datarate'))  # kbit/s
+            if rate is None or self.duration is None:
+                return None
+            size = rate * 1000 / 8 * self.duration
+        return int(size) if 0 < size < math.inf else None
+
+    def find_keyframe(self, timestamp: int) -> int | None:
+        # index of the last keyframe at or before timestamp (ms)
+        index = bisect_right(self.keyframe_times, timestamp / 1000) - 1
+        return index if index >= 0 else None
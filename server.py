@@ -0,0 +1,298 @@
+# FLV Extract
+# Copyright (C) 2006-2012 J.D. Purcell (moitah@yahoo.com)
+# Python port (C) 2012-2024 Gianluigi Tiesi <sherpya@gmail.com>
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from socketserver import StreamRequestHandler, ThreadingUnixStreamServer
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+from archive import open_archive, SPILL_BUFFER_SIZE
+from flvfile import FLVFile
+from hashing import HASH_ALGORITHMS
+from interfaces import FLVException
+from iopolicy import IOPolicy
+from source import FileSource
+
+SERVER_WORKERS = os.cpu_count() or 1
+SERVER_QUEUE_LIMIT = 64  # jobs waiting for a worker, the next ones are rejected
+
+# job options and the extract_streams arguments they set
+JOB_OPTIONS = {'audio': 'extract_audio', 'video': 'extract_video', 'timecodes': 'extract_timecodes',
+               'overwrite': 'overwrite', 'fmp4': 'fragmented_mp4', 'mkv': 'matroska', 'recover': 'recover',
+               'timing': 'timing', 'keyframes': 'keyframes_only'}
+JOB_TIME_OPTIONS = ('start', 'end')  # seconds
+JOB_IO_OPTIONS = ('drop_cache', 'preallocate')
+JOB_HASH_OPTION = 'hash'  # an algorithm or a list of them
+
+# workers are started from a clean process, the server has threads by the time one must be replaced
+_context = multiprocessing.get_context('forkserver')
+
+Event = Dict[str, Any]
+EventSender = Callable[[Event], None]
+
+# in a worker process, where the progress of its jobs is sent to the server
+_progress: 'multiprocessing.Queue[Tuple[int, Event]] | None' = None
+
+
+def init_worker(progress: 'multiprocessing.Queue[Tuple[int, Event]]') -> None:
+    global _progress
+    _progress = progress
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the server stops its workers
+
+
+def worker_pid() -> int:
+    return os.getpid()
+
+
+def report(key: int, event: Event) -> None:
+    assert _progress is not None
+    _progress.put((key, event))
+
+
+def run_job(key: int, job: Dict[str, Any]) -> Event:
+    # runs in a worker process, a job shares nothing with the others but the process
+    inputs = job.get('input')
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    if not inputs or not isinstance(inputs, list) or not all(isinstance(path, str) for path in inputs):
+        raise FLVException('A job needs an input path or a list of them')
+    options = job.get('options', {})
+    if not isinstance(options, dict):
+        raise FLVException('Job options must be an object')
+    unknown = set(options) - set(JOB_OPTIONS) - set(JOB_TIME_OPTIONS) - set(JOB_IO_OPTIONS) - {JOB_HASH_OPTION}
+    if unknown:
+        raise FLVException(f'Unknown options: {", ".join(sorted(unknown))}')
+
+    arguments: Dict[str, Any] = {argument: bool(options.get(name, False)) for name, argument in JOB_OPTIONS.items()}
+    for name in JOB_TIME_OPTIONS:
+        if options.get(name) is not None:
+            arguments[name] = round(float(options[name]) * 1000)
+    if any(options.get(name) for name in JOB_IO_OPTIONS):
+        arguments['io_policy'] = IOPolicy(bool(options.get('drop_cache')), bool(options.get('preallocate')))
+    algorithms = options.get(JOB_HASH_OPTION, [])
+    if isinstance(algorithms, str):
+        algorithms = [algorithms]
+    if not isinstance(algorithms, list) or not all(algorithm in HASH_ALGORITHMS for algorithm in algorithms):
+        raise FLVException(f'Hash algorithms must be among {", ".join(HASH_ALGORITHMS)}')
+
+    report(key, {'event': 'started', 'pid': os.getpid()})
+    flv = FLVFile(Path(inputs[0]))
+    segments: List[FileSource] = []
+    archive = None
+    try:
+        segments = [FileSource(Path(path)) for path in inputs[1:]]
+        if job.get('output_directory'):
+            flv.output_directory = Path(job['output_directory'])
+        flv.hash_algorithms = algorithms
+        if job.get('archive'):
+            archive = open_archive(Path(job['archive']), SPILL_BUFFER_SIZE)
+        flv.progress = lambda offset, size: report(key, {'event': 'progress', 'offset': offset, 'size': size})
+        flv.extract_streams(segments=segments, archive=archive, **arguments)
+    finally:
+        # the outputs of a failed job are removed
+        flv.dispose()
+        for source in segments:
+            source.close()
+        if archive is not None:
+            archive.close()
+
+    return {
+        'outputs': [str(path) for path in flv.outputs],
+        'extracted_audio': flv.extracted_audio,
+        'extracted_video': flv.extracted_video,
+        'average_framerate': str(flv.average_framerate) if flv.average_framerate is not None else None,
+        'true_framerate': str(flv.true_framerate) if flv.true_framerate is not None else None,
+        'timing': flv.timing.to_dict() if flv.timing is not None else None,
+        'warnings': flv.warnings.to_dict(),
+        'digests': {str(path): flv.output_digests[path].to_dict() for path in flv.outputs
+                    if path in flv.output_digests},
+    }
+
+
+class JobHandler(StreamRequestHandler):
+    # one JSON job per line, the events of every job of the connection are sent back as JSON lines
+    server: 'ExtractionServer'
+
+    def handle(self) -> None:
+        lock = threading.Lock()
+
+        def send(event: Event) -> None:
+            with lock:
+                try:
+                    self.wfile.write(json.dumps(event).encode() + b'\n')
+                except OSError:
+                    pass  # the client went away, its jobs still complete
+
+        pending: List[Future] = []
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                job = json.loads(line)
+                if not isinstance(job, dict):
+                    raise ValueError('a job is a JSON object')
+            except ValueError as e:
+                send({'event': 'error', 'error': f'Invalid job: {e}'})
+                continue
+            future = self.server.submit(job, send)
+            if future is not None:
+                pending.append(future)
+        wait(pending)
+
+
+class ExtractionServer(ThreadingUnixStreamServer):
+    # extracts jobs sent over a Unix socket on a pool of worker processes kept warm between jobs
+    daemon_threads = True
+    socket_path: Path
+    workers: int
+    _executor: ProcessPoolExecutor
+    _listeners: Dict[int, Tuple[Any, EventSender]]
+    _slots: threading.BoundedSemaphore
+    _lock: threading.Lock
+    _restart_lock: threading.Lock
+    _job_count: int = 0
+
+    def __init__(self, socket_path: Path, workers: int = SERVER_WORKERS, queue_limit: int = SERVER_QUEUE_LIMIT):
+        self.socket_path = socket_path
+        self.workers = workers
+        self._listeners = {}
+        self._slots = threading.BoundedSemaphore(workers + queue_limit)
+        self._lock = threading.Lock()
+        self._restart_lock = threading.Lock()
+        remove_stale_socket(socket_path)
+        self._executor = self.start_workers()
+        super().__init__(str(socket_path), JobHandler)
+
+    def start_workers(self) -> ProcessPoolExecutor:
+        # each pool has its own progress queue, a killed worker can leave the previous one locked
+        progress: 'multiprocessing.Queue[Tuple[int, Event]]' = _context.Queue()
+        threading.Thread(target=self.dispatch_progress, args=(progress,), daemon=True).start()
+        executor = ProcessPoolExecutor(self.workers, _context, initializer=init_worker, initargs=(progress,))
+        # the processes are started (and import everything) before the first job
+        wait([executor.submit(worker_pid) for _ in range(self.workers)])
+        return executor
+
+    def submit(self, job: Dict[str, Any], send: EventSender) -> Future | None:
+        if not self._slots.acquire(blocking=False):
+            send({'id': job.get('id'), 'event': 'rejected', 'error': 'Queue full'})
+            return None
+        with self._lock:
+            self._job_count += 1
+            key = self._job_count
+            job_id = job.get('id', key)
+            self._listeners[key] = (job_id, send)
+            executor = self._executor
+        send({'id': job_id, 'event': 'queued'})
+        try:
+            future = executor.submit(run_job, key, job)
+        except BrokenProcessPool:
+            executor = self.restart_workers(executor)
+            future = executor.submit(run_job, key, job)
+        # set once the last event of the job is sent, the waiters of a future wake before its callbacks run
+        reported: Future = Future()
+        future.add_done_callback(lambda done: self.job_done(key, executor, done, reported))
+        return reported
+
+    def job_done(self, key: int, executor: ProcessPoolExecutor, future: Future, reported: Future) -> None:
+        with self._lock:
+            job_id, send = self._listeners.pop(key)
+        self._slots.release()
+        try:
+            result = future.result()
+        except BrokenProcessPool:
+            # the callbacks of a broken pool run while it holds its shutdown lock
+            threading.Thread(target=self.restart_workers, args=(executor,), daemon=True).start()
+            send({'id': job_id, 'event': 'error', 'error': 'A worker process died while the job was pending'})
+        except Exception as e:
+            send({'id': job_id, 'event': 'error', 'error': str(e) or type(e).__name__})
+        else:
+            send({'id': job_id, 'event': 'done', 'result': result})
+        reported.set_result(None)
+
+    def restart_workers(self, broken: ProcessPoolExecutor) -> ProcessPoolExecutor:
+        # a job that kills its worker takes the pool down, the other jobs get a new one
+        with self._restart_lock:
+            with self._lock:
+                if self._executor is not broken:
+                    return self._executor
+            executor = self.start_workers()
+            with self._lock:
+                self._executor = executor
+        broken.shutdown(wait=False)
+        return executor
+
+    def dispatch_progress(self, progress: 'multiprocessing.Queue[Tuple[int, Event]]') -> None:
+        while True:
+            key, event = progress.get()
+            with self._lock:
+                listener = self._listeners.get(key)
+            if listener is not None:
+                job_id, send = listener
+                send({'id': job_id, **event})
+
+    def server_close(self) -> None:
+        super().server_close()
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self.socket_path.unlink(missing_ok=True)
+
+
+def remove_stale_socket(path: Path) -> None:
+    # left by a server that didn't exit cleanly, a running one is not replaced
+    if not path.is_socket():
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(str(path))
+        except OSError:
+            path.unlink()
+            return
+    raise FLVException(f'A server is already listening on {path}')
+
+
+def submit(socket_path: Path, job: Dict[str, Any]) -> Iterator[Event]:
+    # a client: the events of a job up to its result
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(str(socket_path))
+        sock.sendall(json.dumps(job).encode() + b'\n')
+        sock.shutdown(socket.SHUT_WR)
+        with sock.makefile('rb') as fd:
+            for line in fd:
+                event = json.loads(line)
+                yield event
+                if event['event'] in ('done', 'error', 'rejected'):
+                    return
+
+
+def serve(socket_path: Path, workers: int = SERVER_WORKERS, queue_limit: int = SERVER_QUEUE_LIMIT) -> None:
+    def stop(_signum: int, _frame: Any) -> None:
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, stop)
+    with ExtractionServer(socket_path, workers, queue_limit) as server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
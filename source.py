@@ -0,0 +1,239 @@
+# FLV Extract
+# Copyright (C) 2006-2012 J.D. Purcell (moitah@yahoo.com)
+# Python port (C) 2012-2024 Gianluigi Tiesi <sherpya@gmail.com>
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.client import HTTPConnection, HTTPSConnection, HTTPException, HTTPMessage
+from pathlib import Path
+from typing import BinaryIO, Dict, Protocol, Tuple
+from urllib.parse import urlsplit
+
+from interfaces import IInputSource, FLVException
+
+PREFETCH_WINDOW = 1024 * 1024
+PREFETCH_DEPTH = 4  # windows fetched ahead of the parser
+HTTP_TIMEOUT = 30.0  # seconds
+
+
+class RangeReader(Protocol):
+    def get_size(self) -> int: ...
+
+    def read_range(self, offset: int, size: int) -> bytes: ...
+
+
+class FileSource(IInputSource):
+    _fd: BinaryIO | None
+    _size: int
+
+    def __init__(self, path: Path):
+        self._fd = path.open('rb')
+        self._size = os.fstat(self._fd.fileno()).st_size
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def read_at(self, offset: int, size: int) -> bytes:
+        assert self._fd is not None
+        return os.pread(self._fd.fileno(), size, offset)
+
+    def refresh_size(self) -> int:
+        assert self._fd is not None
+        self._size = os.fstat(self._fd.fileno()).st_size
+        return self._size
+
+    @property
+    def fileno(self) -> int | None:
+        assert self._fd is not None
+        return self._fd.fileno()
+
+    def close(self) -> None:
+        if self._fd is not None:
+            self._fd.close()
+            self._fd = None
+
+
+class FileObjectSource(IInputSource):
+    _fileobj: BinaryIO
+    _size: int
+    _lock: threading.Lock
+
+    def __init__(self, fileobj: BinaryIO):
+        if not fileobj.seekable():
+            raise FLVException('Input must be seekable')
+        self._fileobj = fileobj
+        self._lock = threading.Lock()
+        self._size = self.refresh_size()
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def read_at(self, offset: int, size: int) -> bytes:
+        # the file position is shared with prefetch threads
+        with self._lock:
+            self._fileobj.seek(offset)
+            return self._fileobj.read(size)
+
+    def refresh_size(self) -> int:
+        with self._lock:
+            self._size = self._fileobj.seek(0, os.SEEK_END)
+        return self._size
+
+
+class RangeSource(IInputSource):
+    _reader: RangeReader
+    _size: int
+
+    def __init__(self, reader: RangeReader):
+        self._reader = reader
+        self._size = reader.get_size()
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def read_at(self, offset: int, size: int) -> bytes:
+        size = min(size, self._size - offset)
+        if size <= 0:
+            return b''
+        return self._reader.read_range(offset, size)
+
+    def refresh_size(self) -> int:
+        self._size = self._reader.get_size()
+        return self._size
+
+
+class HTTPRangeReader:
+    _url: str
+    _local: threading.local
+    _timeout: float
+
+    def __init__(self, url: str, timeout: float = HTTP_TIMEOUT):
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise FLVException(f'Unsupported URL scheme {parts.scheme}')
+        self._url = url
+        self._local = threading.local()
+        self._timeout = timeout
+
+    def connection(self) -> HTTPConnection:
+        # one keep-alive connection per thread, prefetch windows are fetched concurrently
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            parts = urlsplit(self._url)
+            if parts.scheme == 'https':
+                connection = HTTPSConnection(parts.netloc, timeout=self._timeout)
+            else:
+                connection = HTTPConnection(parts.netloc, timeout=self._timeout)
+            self._local.connection = connection
+        return connection
+
+    def send(self, method: str, headers: Dict[str, str]) -> Tuple[int, HTTPMessage, bytes]:
+        parts = urlsplit(self._url)
+        target = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+        connection = self.connection()
+        connection.request(method, target, headers=headers)
+        response = connection.getresponse()
+        return response.status, response.headers, response.read()
+
+    def request(self, method: str, headers: Dict[str, str]) -> Tuple[int, HTTPMessage, bytes]:
+        try:
+            return self.send(method, headers)
+        except (HTTPException, OSError):
+            # the server may have closed an idle keep-alive connection, retry once on a new one
+            self.connection().close()
+            self._local.connection = None
+            return self.send(method, headers)
+
+    def get_size(self) -> int:
+        status, headers, _ = self.request('HEAD', {})
+        if status != 200 or headers.get('Content-Length') is None:
+            raise FLVException(f'Unable to get the size of {self._url} (HTTP {status})')
+        return int(headers['Content-Length'])
+
+    def read_range(self, offset: int, size: int) -> bytes:
+        status, _, body = self.request('GET', {'Range': f'bytes={offset}-{offset + size - 1}'})
+        if status == 416:
+            return b''
+        if status != 206:
+            raise FLVException(f'Server does not support range requests (HTTP {status})')
+        return body
+
+
+class PrefetchSource(IInputSource):
+    _source: IInputSource
+    _window: int
+    _depth: int
+    _executor: ThreadPoolExecutor
+    _windows: Dict[int, Future]
+
+    def __init__(self, source: IInputSource, window: int = PREFETCH_WINDOW, depth: int = PREFETCH_DEPTH):
+        self._source = source
+        self._window = window
+        self._depth = depth
+        self._executor = ThreadPoolExecutor(max_workers=max(depth, 1), thread_name_prefix='prefetch')
+        self._windows = {}
+
+    @property
+    def size(self) -> int:
+        return self._source.size
+
+    def read_at(self, offset: int, size: int) -> bytes:
+        end = min(offset + size, self._source.size)
+        if end <= offset:
+            return b''
+
+        first = offset // self._window
+        last = (end - 1) // self._window
+        ahead = last + self._depth
+
+        # only the windows being read and the read-ahead ones are kept, a seek drops the others
+        for index in [index for index in self._windows if not first <= index <= ahead]:
+            self._windows.pop(index).cancel()
+        for index in range(first, ahead + 1):
+            if index * self._window >= self._source.size:
+                break
+            if index not in self._windows:
+                self._windows[index] = self._executor.submit(self._source.read_at, index * self._window,
+                                                             self._window)
+
+        windows = [self._windows[index].result() for index in range(first, last + 1)]
+        # a window fetched while the source was shorter is short, don't keep it if the source can grow
+        for index, window in zip(range(first, last + 1), windows):
+            if len(window) < self._window:
+                self._windows.pop(index, None)
+        if (any(len(window) < self._window for window in windows[:-1])
+                or len(windows[-1]) < end - last * self._window):
+            # the windows after a short one don't line up with it, and a short last one misses data
+            return self._source.read_at(offset, end - offset)
+        data = b''.join(windows)
+        start = offset - first * self._window
+        return data[start:start + size]
+
+    def refresh_size(self) -> int:
+        return self._source.refresh_size()
+
+    def close(self) -> None:
+        for future in self._windows.values():
+            future.cancel()
+        self._windows = {}
+        self._executor.shutdown(wait=True)
+        self._source.close()
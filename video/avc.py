@@ -0,0 +1,186 @@
+# FLV Extract
+# Copyright (C) 2006-2012 J.D. Purcell (moitah@yahoo.com)
+# Python port (C) 2012-2024 Gianluigi Tiesi <sherpya@gmail.com>
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+from ctypes import c_int
+from dataclasses import dataclass, field
+from typing import List, Tuple
+
+from general import BitHelper
+from interfaces import FLVException
+
+# Profiles carrying chroma_format_idc and friends in their SPS (ITU-T H.264 7.3.2.1.1)
+HIGH_PROFILES = (100, 110, 122, 244, 44, 83, 86, 118, 128, 138, 139, 134, 135)
+
+
+@dataclass
+class AVCConfig:
+    record: bytes
+    profile: int = 0
+    compatibility: int = 0
+    level: int = 0
+    nal_length_size: int = 4
+    sps: List[bytes] = field(default_factory=list)
+    pps: List[bytes] = field(default_factory=list)
+    width: int = 0
+    height: int = 0
+
+
+class ExpGolombReader:
+    _data: bytes
+    _offset: c_int
+    _length: int
+
+    def __init__(self, data: bytes):
+        self._data = data
+        self._offset = c_int(0)
+        self._length = len(data) * 8
+
+    def read(self, length: int) -> int:
+        if length == 0:
+            return 0
+        if self._offset.value + length > self._length:
+            raise FLVException('Truncated H.264 parameter set')
+        return BitHelper.read_frombytes(self._data, self._offset, length)
+
+    def read_ue(self) -> int:
+        zeros = 0
+        while self.read(1) == 0:
+            zeros += 1
+            if zeros > 31:
+                raise FLVException('Invalid Exp-Golomb code')
+        return (1 << zeros) - 1 + self.read(zeros)
+
+    def read_se(self) -> int:
+        value = self.read_ue()
+        return (value + 1) // 2 if value & 1 else -(value // 2)
+
+
+def unescape_rbsp(nal: bytes) -> bytes:
+    # remove emulation prevention bytes (00 00 03 -> 00 00)
+    if b'\x00\x00\x03' not in nal:
+        return nal
+    out = bytearray()
+    start = 0
+    while True:
+        pos = nal.find(b'\x00\x00\x03', start)
+        if pos == -1:
+            break
+        out += nal[start:pos + 2]
+        start = pos + 3
+    out += nal[start:]
+    return bytes(out)
+
+
+def skip_scaling_list(reader: ExpGolombReader, size: int) -> None:
+    last_scale = 8
+    next_scale = 8
+    for _ in range(size):
+        if next_scale != 0:
+            next_scale = (last_scale + reader.read_se() + 256) % 256
+        last_scale = next_scale if next_scale != 0 else last_scale
+
+
+def parse_sps_dimensions(sps: bytes) -> Tuple[int, int]:
+    # Reference: ITU-T H.264 7.3.2.1.1 (Sequence parameter set data syntax)
+    reader = ExpGolombReader(unescape_rbsp(sps[1:]))
+    profile_idc = reader.read(8)
+    reader.read(8)  # constraint flags
+    reader.read(8)  # level_idc
+    reader.read_ue()  # seq_parameter_set_id
+
+    chroma_format_idc = 1
+    separate_colour_plane = 0
+    if profile_idc in HIGH_PROFILES:
+        chroma_format_idc = reader.read_ue()
+        if chroma_format_idc == 3:
+            separate_colour_plane = reader.read(1)
+        reader.read_ue()  # bit_depth_luma_minus8
+        reader.read_ue()  # bit_depth_chroma_minus8
+        reader.read(1)  # qpprime_y_zero_transform_bypass_flag
+        if reader.read(1):  # seq_scaling_matrix_present_flag
+            for i in range(8 if chroma_format_idc != 3 else 12):
+                if reader.read(1):
+                    skip_scaling_list(reader, 16 if i < 6 else 64)
+
+    reader.read_ue()  # log2_max_frame_num_minus4
+    pic_order_cnt_type = reader.read_ue()
+    if pic_order_cnt_type == 0:
+        reader.read_ue()  # log2_max_pic_order_cnt_lsb_minus4
+    elif pic_order_cnt_type == 1:
+        reader.read(1)  # delta_pic_order_always_zero_flag
+        reader.read_se()  # offset_for_non_ref_pic
+        reader.read_se()  # offset_for_top_to_bottom_field
+        for _ in range(reader.read_ue()):
+            reader.read_se()  # offset_for_ref_frame
+
+    reader.read_ue()  # max_num_ref_frames
+    reader.read(1)  # gaps_in_frame_num_value_allowed_flag
+    width_in_mbs = reader.read_ue() + 1
+    height_in_map_units = reader.read_ue() + 1
+    frame_mbs_only = reader.read(1)
+    if not frame_mbs_only:
+        reader.read(1)  # mb_adaptive_frame_field_flag
+    reader.read(1)  # direct_8x8_inference_flag
+
+    width = width_in_mbs * 16
+    height = (2 - frame_mbs_only) * height_in_map_units * 16
+
+    if reader.read(1):  # frame_cropping_flag
+        left, right, top, bottom = (reader.read_ue() for _ in range(4))
+        if chroma_format_idc == 0 or separate_colour_plane:
+            crop_x, crop_y = 1, 2 - frame_mbs_only
+        else:
+            crop_x = 1 if chroma_format_idc == 3 else 2
+            crop_y = (2 if chroma_format_idc == 1 else 1) * (2 - frame_mbs_only)
+        width -= (left + right) * crop_x
+        height -= (top + bottom) * crop_y
+
+    return width, height
+
+
+def parse_avc_config(record: bytes) -> AVCConfig:
+    # Reference: ISO/IEC 14496-15 5.2.4.1 (AVCDecoderConfigurationRecord)
+    length = len(record)
+    if length < 7 or record[0] != 1:
+        raise FLVException('Invalid AVC decoder configuration record')
+
+    config = AVCConfig(record=bytes(record), profile=record[1], compatibility=record[2], level=record[3],
+                       nal_length_size=(record[4] & 0x03) + 1)
+
+    offset = 5
+    for count_mask, sets in ((0x1f, config.sps), (0xff, config.pps)):
+        if offset >= length:
+            break
+        count = record[offset] & count_mask
+        offset += 1
+        for _ in range(count):
+            len_ = int.from_bytes(record[offset:offset + 2], 'big')
+            offset += 2
+            if (offset + len_) > length:
+                raise FLVException('Truncated AVC decoder configuration record')
+            sets.append(bytes(record[offset:offset + len_]))
+            offset += len_
+
+    if config.sps:
+        try:
+            config.width, config.height = parse_sps_dimensions(config.sps[0])
+        except FLVException:
+            pass
+
+    return config
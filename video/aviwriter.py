@@ -22,11 +22,15 @@ from ctypes import c_ulonglong
 from fractions import Fraction
 from os import SEEK_CUR
 from pathlib import Path
-from typing import List
+from typing import Any, Dict, List, Tuple
 
-from general import BitHelper
+from diagnostics import Diagnostics
+from general import (BitHelper, OutputOpener, open_output, sync_output, reopen_output, copy_range, copy_to_output,
+                     output_fileno)
 from interfaces import IVideoWriter, VideoCodecID, FLVException
 
+MOVI_DATA_OFFSET = 224  # the frames follow the fixed size headers
+
 
 class VideoSizes:
     CIF = (352, 288)
@@ -36,6 +40,81 @@ class VideoSizes:
     QQVGA = (160, 120)
 
 
+def get_frame_size(codec_id: int, chunk: bytes) -> Tuple[int, int]:
+    match codec_id:
+        case VideoCodecID.H263:
+            # Reference: flv_h263_decode_picture_header from libavcodec's h263.c
+            if len(chunk) < 10:
+                return 0, 0
+
+            x = c_ulonglong(int.from_bytes(chunk[2:2 + 8], 'big'))
+
+            if BitHelper.read(x, 1) != 1:
+                return 0, 0
+
+            BitHelper.read(x, 5)
+            BitHelper.read(x, 8)
+
+            format_ = BitHelper.read(x, 3)
+
+            match format_:
+                case 0:
+                    width = BitHelper.read(x, 8)
+                    return width, BitHelper.read(x, 8)
+                case 1:
+                    width = BitHelper.read(x, 16)
+                    return width, BitHelper.read(x, 16)
+                case 2:
+                    return VideoSizes.CIF
+                case 3:
+                    return VideoSizes.QCIF
+                case 4:
+                    return VideoSizes.SQCIF
+                case 5:
+                    return VideoSizes.QVGA
+                case 6:
+                    return VideoSizes.QQVGA
+                case _:
+                    return 0, 0
+
+        case VideoCodecID.SCREEN | VideoCodecID.SCREENv2:  # FIXME: v2?
+            # Reference: flashsv_decode_frame from libavcodec's flashsv.c
+            # notice: libavcodec checks if width/height changes
+            if len(chunk) < 4:
+                return 0, 0
+
+            x = c_ulonglong(int.from_bytes(chunk[:4], 'big') << 32)
+            BitHelper.read(x, 4)  # blockWidth
+            width = BitHelper.read(x, 12)
+            BitHelper.read(x, 4)  # blockHeight
+            return width, BitHelper.read(x, 12)
+
+        case VideoCodecID.VP6 | VideoCodecID.VP6v2:
+            # Reference: vp6_parse_header from libavcodec's vp6.c
+            skip = 1 if (codec_id == VideoCodecID.VP6) else 4
+            if len(chunk) < (skip + 8):
+                return 0, 0
+
+            x = c_ulonglong(int.from_bytes(chunk[skip:skip + 8], 'big'))
+            delta_frame_lag = BitHelper.read(x, 1)
+            _quant = BitHelper.read(x, 6)
+            separated_coeff_flag = BitHelper.read(x, 1)
+            _sub_version = BitHelper.read(x, 5)
+            filter_header = BitHelper.read(x, 2)
+            _interlaced_flag = BitHelper.read(x, 1)
+
+            if delta_frame_lag != 0:
+                return 0, 0
+
+            if separated_coeff_flag != 0 or filter_header == 0:  # skip 16 bit
+                BitHelper.read(x, 16)
+
+            height = BitHelper.read(x, 8) * 16
+            return BitHelper.read(x, 8) * 16, height
+
+    return 0, 0
+
+
 class AVIWriter(IVideoWriter, ABC):
     # Chunk:          Off:  Len:
     #
@@ -58,7 +137,7 @@ class AVIWriter(IVideoWriter, ABC):
     _index: List[int]
     _is_alpha_writer: bool = False
     _alpha_writer: 'AVIWriter | None' = None
-    _warnings: List[str]
+    _warnings: Diagnostics
 
     @property
     def fourcc(self) -> bytes:
@@ -72,18 +151,30 @@ class AVIWriter(IVideoWriter, ABC):
             case _:
                 raise FLVException(f'Invalid codec ID {self._codec_id}')
 
-    def __init__(self, path: Path, codec_id: int, warnings: List[str], is_alpha_writer: bool = False):
+    def __init__(self, path: Path, codec_id: int, warnings: Diagnostics, is_alpha_writer: bool = False,
+                 state: Dict[str, Any] | None = None, opener: OutputOpener = open_output):
         if codec_id not in (VideoCodecID.H263, VideoCodecID.VP6, VideoCodecID.VP6v2):
             raise FLVException('Unsupported video codec')
 
         self._path = path
-        self._fd = self._path.open('wb')
         self._codec_id = codec_id
         self._warnings = warnings
         self._is_alpha_writer = is_alpha_writer
 
         if codec_id == VideoCodecID.VP6v2 and not self._is_alpha_writer:
-            self._alpha_writer = AVIWriter(self._path.with_suffix('.alpha.avi'), codec_id, warnings, True)
+            self._alpha_writer = AVIWriter(self._path.with_suffix('.alpha.avi'), codec_id, warnings, True,
+                                           state['alpha'] if state is not None else None, opener)
+
+        if state is not None:
+            self._fd = reopen_output(self._path, state['size'])
+            self._width = state['width']
+            self._height = state['height']
+            self._frame_count = state['frame_count']
+            self._movi_data_size = state['movi_data_size']
+            self._index = state['index']
+            return
+
+        self._fd = opener(self._path, True)
 
         self._fd.write(b'RIFF')
         self._fd.write(int.to_bytes(0, 4, 'little'))  # chunk size
@@ -155,8 +246,32 @@ class AVIWriter(IVideoWriter, ABC):
         self._index = []
 
     def write_chunk(self, chunk: bytes, timestamp: int, frame_type: int) -> None:
+        offset, length = self.get_frame_range(chunk, len(chunk))
+        self.write_frame_header(chunk, length, frame_type)
+        self._fd.write(chunk[offset:offset + length])
+        self.end_frame(length)
+
+        if self._alpha_writer is not None:
+            self._alpha_writer.write_chunk(chunk, timestamp, frame_type)
+
+    def write_passthrough(self, head: bytes, source: int, offset: int, size: int, timestamp: int,
+                          frame_type: int) -> bool:
+        if output_fileno(self._fd) is None or (self._alpha_writer is not None
+                                               and output_fileno(self._alpha_writer._fd) is None):
+            return False
+        start, length = self.get_frame_range(head, size)
+        self.write_frame_header(head, length, frame_type)
+        copy_to_output(self._fd, source, offset + start, length)
+        self.end_frame(length)
+
+        if self._alpha_writer is not None:
+            self._alpha_writer.write_passthrough(head, source, offset, size, timestamp, frame_type)
+        return True
+
+    def get_frame_range(self, head: bytes, size: int) -> Tuple[int, int]:
+        # offset and length of the frame in a chunk of size bytes
         offset = 0
-        length = len(chunk)
+        length = size
 
         if self._codec_id == VideoCodecID.VP6:
             offset = 1
@@ -164,7 +279,7 @@ class AVIWriter(IVideoWriter, ABC):
         elif self._codec_id == VideoCodecID.VP6v2:
             offset = 4
             if length >= 4:
-                alpha_offset = int.from_bytes(chunk[:4], 'big') & 0xffffff
+                alpha_offset = int.from_bytes(head[:4], 'big') & 0xffffff
                 if not self._is_alpha_writer:
                     length = alpha_offset
                 else:
@@ -174,19 +289,20 @@ class AVIWriter(IVideoWriter, ABC):
                 length = 0
 
         length = max(length, 0)
-        length = min(length, len(chunk) - offset)
+        return offset, min(length, size - offset)
 
+    def write_frame_header(self, head: bytes, length: int, frame_type: int) -> None:
         self._index.append(0x10 if (frame_type == 1) else 0)
         self._index.append(self._movi_data_size + 4)
         self._index.append(length)
 
         if (self._width == 0) and (self._height == 0):
-            self.get_frame_size(chunk)
+            self.get_frame_size(head)
 
         self._fd.write(b'00dc')
         self._fd.write(length.to_bytes(4, 'little', signed=True))
-        self._fd.write(chunk[offset:offset + length])
 
+    def end_frame(self, length: int) -> None:
         if (length % 2) != 0:
             self._fd.write(b'\x00')
             length += 1
@@ -194,98 +310,51 @@ class AVIWriter(IVideoWriter, ABC):
         self._movi_data_size += length + 8
         self._frame_count += 1
 
-        if self._alpha_writer is not None:
-            self._alpha_writer.write_chunk(chunk, timestamp, frame_type)
+    @property
+    def outputs(self) -> List[Path]:
+        return [self._path] + (self._alpha_writer.outputs if self._alpha_writer is not None else [])
 
-    def get_frame_size(self, chunk: bytes) -> None:
-        match self._codec_id:
-            case VideoCodecID.H263:
-                # Reference: flv_h263_decode_picture_header from libavcodec's h263.c
-                if len(chunk) < 10:
-                    return
-
-                x = c_ulonglong(int.from_bytes(chunk[2:2 + 8], 'big'))
-
-                if BitHelper.read(x, 1) != 1:
-                    return
-
-                BitHelper.read(x, 5)
-                BitHelper.read(x, 8)
-
-                format_ = BitHelper.read(x, 3)
-
-                match format_:
-                    case 0:
-                        self._width = BitHelper.read(x, 8)
-                        self._height = BitHelper.read(x, 8)
-                    case 1:
-                        self._width = BitHelper.read(x, 16)
-                        self._height = BitHelper.read(x, 16)
-                    case 2:
-                        self._width, self._height = VideoSizes.CIF
-                    case 3:
-                        self._width, self._height = VideoSizes.QCIF
-                    case 4:
-                        self._width, self._height = VideoSizes.SQCIF
-                    case 5:
-                        self._width, self._height = VideoSizes.QVGA
-                    case 6:
-                        self._width, self._height = VideoSizes.QQVGA
-                    case _:
-                        return
+    def append_part(self, path: Path, state: Dict[str, Any]) -> None:
+        if (self._width == 0) and (self._height == 0):
+            self._width, self._height = state['width'], state['height']
 
-            case VideoCodecID.SCREEN | VideoCodecID.SCREENv2:  # FIXME: v2?
-                # Reference: flashsv_decode_frame from libavcodec's flashsv.c
-                # notice: libavcodec checks if width/height changes
-                if len(chunk) < 4:
-                    return
-
-                x = c_ulonglong(int.from_bytes(chunk[:4], 'big') << 32)
-                BitHelper.read(x, 4)  # blockWidth
-                self._width = BitHelper.read(x, 12)
-                BitHelper.read(x, 4)  # blockHeight
-                self._height = BitHelper.read(x, 12)
-
-                # header = int.from_bytes(chunk[:4], byteorder='big')
-                # _block_width = (header >> 28) & 0xf  # first 4 bits
-                # self._width = (header >> 16) & 0xf  # next 12 bits
-                # _block_height = (header >> 12) & 0xf  # next 4 bits
-                # self._height = header & 0xfff  # last 12 bits
+        copy_range(path, self._fd, MOVI_DATA_OFFSET, MOVI_DATA_OFFSET + state['movi_data_size'])
+        index = state['index']
+        for i in range(0, len(index), 3):
+            self._index.append(index[i])
+            self._index.append(index[i + 1] + self._movi_data_size)
+            self._index.append(index[i + 2])
+        self._frame_count += state['frame_count']
+        self._movi_data_size += state['movi_data_size']
 
-            case VideoCodecID.VP6 | VideoCodecID.VP6v2:
-                # Reference: vp6_parse_header from libavcodec's vp6.c
-                skip = 1 if (self._codec_id == VideoCodecID.VP6) else 4
-                if len(chunk) < (skip + 8):
-                    return
-
-                x = c_ulonglong(int.from_bytes(chunk[skip:skip + 8], 'big'))
-                delta_frame_lag = BitHelper.read(x, 1)
-                _quant = BitHelper.read(x, 6)
-                separated_coeff_flag = BitHelper.read(x, 1)
-                _sub_version = BitHelper.read(x, 5)
-                filter_header = BitHelper.read(x, 2)
-                _interlaced_flag = BitHelper.read(x, 1)
-
-                if delta_frame_lag != 0:
-                    return
-
-                if separated_coeff_flag != 0 or filter_header == 0:  # skip 16 bit
-                    BitHelper.read(x, 16)
-
-                self._height = BitHelper.read(x, 8) * 16
-                self._width = BitHelper.read(x, 8) * 16
-
-                # chunk[0] contains the width and height (4 bits each, respectively) that should
-                # be cropped off during playback, which will be non-zero if the encoder padded
-                # the frames to a macroblock boundary.  But if you use this adjusted size in the
-                # AVI header, DirectShow seems to ignore it, and it can cause stride or chroma
-                # alignment problems with VFW if the width/height aren't multiples of 4.
-                if not self._is_alpha_writer:
-                    crop_x = chunk[0] >> 4
-                    crop_y = chunk[0] & 0xf
-                    if (crop_x != 0) or (crop_y != 0):
-                        self._warnings.append(
-                            f'Suggested cropping: {crop_x} pixels from right, {crop_y} pixels from bottom')
+        if self._alpha_writer is not None:
+            self._alpha_writer.append_part(path.with_suffix('.alpha.avi'), state['alpha'])
+
+    def get_state(self) -> Dict[str, Any]:
+        return {
+            'size': sync_output(self._fd),
+            'width': self._width,
+            'height': self._height,
+            'frame_count': self._frame_count,
+            'movi_data_size': self._movi_data_size,
+            'index': self._index,
+            'alpha': self._alpha_writer.get_state() if self._alpha_writer is not None else None,
+        }
+
+    def get_frame_size(self, chunk: bytes) -> None:
+        self._width, self._height = get_frame_size(self._codec_id, chunk)
+
+        # chunk[0] contains the width and height (4 bits each, respectively) that should
+        # be cropped off during playback, which will be non-zero if the encoder padded
+        # the frames to a macroblock boundary.  But if you use this adjusted size in the
+        # AVI header, DirectShow seems to ignore it, and it can cause stride or chroma
+        # alignment problems with VFW if the width/height aren't multiples of 4.
+        if self._codec_id in (VideoCodecID.VP6, VideoCodecID.VP6v2) and self._width and not self._is_alpha_writer:
+            crop_x = chunk[0] >> 4
+            crop_y = chunk[0] & 0xf
+            if (crop_x != 0) or (crop_y != 0):
+                self._warnings.warn('cropping', f'Suggested cropping: {crop_x} pixels from right, {crop_y} pixels from '
+                                                f'bottom', once=True)
 
     def write_index_chunk(self) -> None:
         index_data_size = self._frame_count * 16
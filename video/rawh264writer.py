@@ -20,18 +20,28 @@
 from abc import ABC
 from fractions import Fraction
 from pathlib import Path
+from struct import Struct
+from typing import Any, BinaryIO, Dict
 
+from general import OutputOpener, open_output, sync_output, reopen_output, copy_range
 from interfaces import IVideoWriter
 
 START_CODE = b'\x00\x00\x00\x01'
+NAL_LENGTH_16 = Struct('>H')
+NAL_LENGTH_32 = Struct('>I')
 
 
 class RawH264Writer(IVideoWriter, ABC):
+    _fd: BinaryIO
     _nal_length_size: int = 0
 
-    def __init__(self, path: Path):
+    def __init__(self, path: Path, state: Dict[str, Any] | None = None, opener: OutputOpener = open_output):
         self._path = path
-        self._fd = self._path.open('wb')
+        if state is None:
+            self._fd = opener(self._path, False)
+        else:
+            self._fd = reopen_output(self._path, state['size'])
+            self._nal_length_size = state['nal_length_size']
 
     def write_chunk(self, chunk: bytes, timestamp: int, frame_type: int) -> None:
         length = len(chunk)
@@ -39,6 +49,8 @@ class RawH264Writer(IVideoWriter, ABC):
             return
 
         # Reference: decode_frame from libavcodec's h264.c
+        view = memoryview(chunk)
+        parts = []
 
         # header
         if chunk[0] == 0:
@@ -66,30 +78,47 @@ class RawH264Writer(IVideoWriter, ABC):
                 else:
                     break
 
-                len_ = int.from_bytes(chunk[offset:offset + 2], 'big')
+                len_ = (chunk[offset] << 8) | chunk[offset + 1]
                 offset += 2
                 if (offset + len_) > length:
                     break
-                self._fd.write(START_CODE)
-                self._fd.write(chunk[offset:offset + len_])
+                parts.append(START_CODE)
+                parts.append(view[offset:offset + len_])
                 offset += len_
-        else:  # Video Data
+        elif self._nal_length_size == 2:  # Video Data
             offset = 4
-
-            if self._nal_length_size != 2:
-                self._nal_length_size = 4
-
-            while offset <= (length - self._nal_length_size):
-                if self._nal_length_size == 2:
-                    len_ = int.from_bytes(chunk[offset:offset + 2], 'big')
-                else:
-                    len_ = int.from_bytes(chunk[offset:offset + 4], 'big')
-                offset += self._nal_length_size
+            unpack_from = NAL_LENGTH_16.unpack_from
+            while offset <= (length - 2):
+                len_, = unpack_from(chunk, offset)
+                offset += 2
+                if (offset + len_) > length:
+                    break
+                parts.append(START_CODE)
+                parts.append(view[offset:offset + len_])
+                offset += len_
+        else:
+            offset = 4
+            self._nal_length_size = 4
+            unpack_from = NAL_LENGTH_32.unpack_from
+            while offset <= (length - 4):
+                len_, = unpack_from(chunk, offset)
+                offset += 4
                 if (offset + len_) > length:
                     break
-                self._fd.write(START_CODE)
-                self._fd.write(chunk[offset:offset + len_])
+                parts.append(START_CODE)
+                parts.append(view[offset:offset + len_])
                 offset += len_
 
+        if parts:
+            self._fd.writelines(parts)
+
     def finish(self, average_framerate: Fraction) -> None:
         self._fd.close()
+
+    def append_part(self, path: Path, state: Dict[str, Any]) -> None:
+        # the prefix holds the SPS and PPS of the sequence header the worker read before its range
+        copy_range(path, self._fd, state['prefix'], state['size'])
+        self._nal_length_size = state['nal_length_size']
+
+    def get_state(self) -> Dict[str, Any]:
+        return {'size': sync_output(self._fd), 'nal_length_size': self._nal_length_size}